@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# Measures mod resolution, mod add, serve-up and loading and saving the config
+# against the stand-in server in standin.py, so nothing touches the network
+# and runs can be compared across commits:
+#
+#     python benchmarks/bench.py --output before.json
+#     git checkout my-branch
+#     python benchmarks/bench.py --compare before.json
+#
+# Flags it doesn't know (--latency 80, --bandwidth 5M, --error-rate 0.01...)
+# are passed on to the stand-in. Each command runs in a fresh interpreter with
+# its own cache directory, and with --trace, so the results also say how many
+# requests it made and how much it downloaded.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+TABLECLOTH = os.path.join(ROOT, "tablecloth.py")
+
+GAME_VERSION = "1.20.1"
+MOD_VERSION = "1.0.4"
+
+def ParseList(value: str) -> list:
+	return [int(item) for item in value.split(",") if item]
+
+def StartStandIn(standInArgs: list):
+	process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, "standin.py"), "--port", "0"] + standInArgs, stdout=subprocess.PIPE, text=True)
+	line = process.stdout.readline()
+	if not line.startswith("Listening on "):
+		process.kill()
+		raise SystemExit("The stand-in server didn't start")
+	return process, line.split()[-1]
+
+def Profile(mods: dict) -> dict:
+	return {
+		"minecraft": {"version": GAME_VERSION},
+		"fabric": {"loader": "0.14.21", "installer": "0.11.2"},
+		"mods": mods,
+		"overrides": {"jar-name": None, "java-path": None, "java-args": []},
+	}
+
+def WriteConfig(directory: str, profiles: dict, cacheRoot: str) -> None:
+	config = {
+		"profiles": profiles,
+		"settings": {
+			"assume-current-profile": True,
+			"current-profile": next(iter(profiles)),
+			"launch": {"jar-name": "server.jar", "java-path": None, "min-ram": "1G", "max-ram": "2G", "java-args": []},
+			"validation": {"hashes": True, "size": True},
+			"cache": {"enabled": True, "path": cacheRoot, "max-size": "100G", "metadata-ttl": 600},
+		},
+	}
+	with open(os.path.join(directory, "tablecloth.json"), "w") as configFile:
+		json.dump(config, configFile)
+
+# Runs Tablecloth in directory and returns how long it took and what its trace
+# says.
+def RunTablecloth(argv: list, directory: str, env: dict) -> tuple:
+	tracePath = os.path.join(directory, "trace.json")
+	start = time.perf_counter()
+	result = subprocess.run([sys.executable, TABLECLOTH, "--trace", tracePath] + argv, cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+	elapsed = time.perf_counter() - start
+	if result.returncode != 0:
+		print("  {} failed: {}".format(" ".join(argv), result.stderr.strip().splitlines()[-1:] or result.returncode))
+	try:
+		with open(tracePath, "r") as traceFile:
+			summary = json.load(traceFile)["summary"]
+	except (OSError, ValueError, KeyError):
+		summary = {}
+	return elapsed, summary
+
+def Describe(summary: dict) -> dict:
+	hosts = summary.get("hosts", {})
+	downloads = summary.get("downloads", {})
+	return {
+		"requests": sum(host["requests"] for host in hosts.values()),
+		"downloaded-files": downloads.get("files", 0),
+		"downloaded-bytes": downloads.get("bytes", 0),
+		"retries": summary.get("counters", {}).get("http-retries", 0) + summary.get("counters", {}).get("download-retries", 0),
+	}
+
+def Record(results: list, scenario: str, mods: int, profiles: int, timings: list, summary: dict = None) -> None:
+	result = {
+		"scenario": scenario,
+		"mods": mods,
+		"profiles": profiles,
+		"runs": len(timings),
+		"median": statistics.median(timings),
+		"min": min(timings),
+	}
+	if summary is not None:
+		result.update(Describe(summary))
+	results.append(result)
+	line = "{:<22} {:>5} mods {:>4} profiles  median {:8.3f}s  min {:8.3f}s".format(scenario, mods, profiles, result["median"], result["min"])
+	if summary is not None:
+		line += "  {} requests, {} files".format(result["requests"], result["downloaded-files"])
+	print(line, flush=True)
+
+def Remove(path: str) -> None:
+	if os.path.isdir(path):
+		shutil.rmtree(path)
+	elif os.path.exists(path):
+		os.remove(path)
+
+def ClearMetadata(cacheRoot: str) -> None:
+	shutil.rmtree(os.path.join(cacheRoot, "metadata"), ignore_errors=True)
+
+# Resolves a profile of modCount mods, adds one more to it and serves it up,
+# each from a cold start and again with what the last step left behind.
+def BenchmarkMods(modCount: int, runs: int, env: dict, results: list) -> dict:
+	with tempfile.TemporaryDirectory() as directory:
+		cacheRoot = os.path.join(directory, "cache")
+		mods = {"mod-{}".format(i): {"version": MOD_VERSION, "enabled": True, "modrinth": None} for i in range(modCount)}
+		WriteConfig(directory, {"bench": Profile(mods)}, cacheRoot)
+
+		timings = []
+		for _ in range(runs):
+			ClearMetadata(cacheRoot)
+			elapsed, summary = RunTablecloth(["mod", "refresh"], directory, env)
+			timings.append(elapsed)
+		Record(results, "mod refresh", modCount, 1, timings, summary)
+
+		timings = []
+		for _ in range(runs):
+			ClearMetadata(cacheRoot)
+			elapsed, summary = RunTablecloth(["mod", "add", "bench-extra", MOD_VERSION], directory, env)
+			timings.append(elapsed)
+			RunTablecloth(["mod", "remove", "bench-extra"], directory, env)
+		Record(results, "mod add", modCount, 1, timings, summary)
+
+		# Cold: nothing installed and nothing cached.
+		timings = []
+		for _ in range(runs):
+			for path in ["mods", "server.jar", "libraries", ".fabric", ".tablecloth", "cache"]:
+				Remove(os.path.join(directory, path))
+			elapsed, summary = RunTablecloth(["serve-up"], directory, env)
+			timings.append(elapsed)
+		Record(results, "serve-up cold", modCount, 1, timings, summary)
+
+		# From the artifact cache: a new server directory on a host that already
+		# has every jar.
+		timings = []
+		for _ in range(runs):
+			for path in ["mods", "libraries", ".fabric", ".tablecloth"]:
+				Remove(os.path.join(directory, path))
+			elapsed, summary = RunTablecloth(["serve-up"], directory, env)
+			timings.append(elapsed)
+		Record(results, "serve-up cached", modCount, 1, timings, summary)
+
+		# Warm: everything's already installed.
+		timings = []
+		for _ in range(runs):
+			elapsed, summary = RunTablecloth(["serve-up"], directory, env)
+			timings.append(elapsed)
+		Record(results, "serve-up warm", modCount, 1, timings, summary)
+
+		with open(os.path.join(directory, "tablecloth.json"), "r") as configFile:
+			return json.load(configFile)["profiles"]["bench"]
+
+# Loads the config, touches every profile and saves it again, in this process
+# so only Tablecloth's own work is timed.
+def BenchmarkConfig(profile: dict, modCount: int, profileCounts: list, maxEntries: int, runs: int, results: list) -> None:
+	sys.path.insert(0, ROOT)
+	import tablecloth
+
+	for profileCount in profileCounts:
+		if profileCount * modCount > maxEntries:
+			print("{:<22} {:>5} mods {:>4} profiles  skipped (over --max-entries)".format("config load/save", modCount, profileCount))
+			continue
+		with tempfile.TemporaryDirectory() as directory:
+			WriteConfig(directory, {"profile-{}".format(i): profile for i in range(profileCount)}, os.path.join(directory, "cache"))
+			loads = []
+			saves = []
+			for _ in range(runs):
+				start = time.perf_counter()
+				config = tablecloth.TableclothConfig(directory)
+				for name in config.GetProfileNames():
+					config.GetProfile(name)
+				loads.append(time.perf_counter() - start)
+
+				start = time.perf_counter()
+				config.MarkDirty()
+				config.Save()
+				saves.append(time.perf_counter() - start)
+			Record(results, "config load", modCount, profileCount, loads)
+			Record(results, "config save", modCount, profileCount, saves)
+
+def Compare(results: list, path: str) -> None:
+	with open(path, "r") as baselineFile:
+		baseline = json.load(baselineFile)
+	older = {(result["scenario"], result["mods"], result["profiles"]): result for result in baseline["results"]}
+	print("\nCompared with {} ({}):".format(path, baseline.get("commit") or "unknown commit"))
+	for result in results:
+		old = older.get((result["scenario"], result["mods"], result["profiles"]))
+		if old is None or not old["median"]:
+			continue
+		change = (result["median"] - old["median"]) / old["median"]
+		print("{:<22} {:>5} mods {:>4} profiles  {:8.3f}s -> {:8.3f}s  {:+6.1%}".format(
+			result["scenario"], result["mods"], result["profiles"], old["median"], result["median"], change))
+
+def GitCommit():
+	try:
+		return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Benchmarks Tablecloth against a local stand-in for Modrinth and Fabric meta. Unknown flags go to standin.py.")
+	parser.add_argument("--mods", type=ParseList, default=[10, 100, 1000], help="Mod counts to benchmark, comma-separated")
+	parser.add_argument("--profiles", type=ParseList, default=[1, 10, 100, 500], help="Profile counts to load and save the config with, comma-separated")
+	parser.add_argument("--max-entries", type=int, default=100000, help="Skips config benchmarks with more profiles times mods than this")
+	parser.add_argument("--runs", type=int, default=3, help="Runs of each benchmark")
+	parser.add_argument("--output", "-o", help="Writes the results to this JSON file")
+	parser.add_argument("--compare", help="Compares the results with an earlier --output file")
+	args, standInArgs = parser.parse_known_args()
+
+	standIn, base = StartStandIn(standInArgs)
+	env = dict(os.environ, TABLECLOTH_MODRINTH_API=base + "/v2/", TABLECLOTH_FABRIC_META=base + "/", TABLECLOTH_MOJANG_META=base + "/")
+	print("Stand-in at {} {}".format(base, " ".join(standInArgs)).rstrip())
+	results = []
+	try:
+		for modCount in args.mods:
+			profile = BenchmarkMods(modCount, args.runs, env, results)
+			BenchmarkConfig(profile, modCount, args.profiles, args.max_entries, args.runs, results)
+	finally:
+		standIn.terminate()
+		standIn.wait()
+
+	if args.output:
+		with open(args.output, "w") as outputFile:
+			json.dump({
+				"commit": GitCommit(),
+				"date": time.time(),
+				"python": platform.python_version(),
+				"platform": platform.platform(),
+				"stand-in": standInArgs,
+				"results": results,
+			}, outputFile, indent=2)
+	if args.compare:
+		Compare(results, args.compare)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# A local stand-in for the parts of Modrinth's API and Fabric's meta server
+# that Tablecloth uses, and of Mojang's version metadata and the Maven
+# repository the Fabric libraries come from, so it can be measured without the
+# network. Every project exists: asking for any slug makes one up, with the
+# same versions, jars and hashes every time. Latency, bandwidth, errors,
+# dropped transfers and rate limits can be turned up to see how Tablecloth
+# copes.
+#
+#     python benchmarks/standin.py --port 8780 --latency 80 --bandwidth 5M
+#
+# then point Tablecloth at it:
+#
+#     TABLECLOTH_MODRINTH_API=http://127.0.0.1:8780/v2/ \
+#     TABLECLOTH_FABRIC_META=http://127.0.0.1:8780/ \
+#     TABLECLOTH_MOJANG_META=http://127.0.0.1:8780/ ./tablecloth.py serve-up
+#
+# GET /stats reports how many requests of each kind were answered.
+
+import argparse
+import collections
+import hashlib
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+# Sent in chunks this big, so bandwidth limits and drops apply part-way.
+CHUNK_SIZE = 16 * 1024
+
+def ParseSize(size: str) -> int:
+	units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+	size = size.strip().upper().rstrip("B")
+	if size and size[-1] in units:
+		return int(float(size[:-1]) * units[size[-1]])
+	return int(size)
+
+def _id(prefix: str, key: str) -> str:
+	return prefix + hashlib.sha1(key.encode()).hexdigest()[:7]
+
+# Turns a Maven coordinate (group:artifact:version) into the path of its jar.
+def MavenPath(name: str) -> str:
+	group, artifact, version = name.split(":")[:3]
+	return "/".join(group.split(".") + [artifact, version, "{}-{}.jar".format(artifact, version)])
+
+# Makes up the projects, versions and files the stand-in serves. Projects are
+# made the first time they're asked for, by slug, and remembered so later
+# requests can name them or their versions by ID.
+class Catalog:
+	def __init__(self, options: argparse.Namespace):
+		self.__options = options
+		self.__lock = threading.Lock()
+		self.__projects = {}
+		self.__versions = {}
+		self.__jars = {}
+		# Projects that have been named by ID (as dependencies are) but not
+		# made yet, and their slugs.
+		self.__named = {}
+
+	# Every jar is the seed repeated to the jar size, so it never has to be
+	# kept in memory.
+	def JarBytes(self, key: str, size: int) -> bytes:
+		seed = hashlib.sha256(key.encode()).digest()
+		return (seed * (size // len(seed) + 1))[:size]
+
+	def __hashes(self, key: str, size: int) -> dict:
+		if not key in self.__jars:
+			data = self.JarBytes(key, size)
+			self.__jars[key] = {"sha1": hashlib.sha1(data).hexdigest(), "sha512": hashlib.sha512(data).hexdigest()}
+		return self.__jars[key]
+
+	def __make(self, slug: str) -> dict:
+		options = self.__options
+		projectId = _id("P", slug)
+		versionIds = []
+		for i in range(options.versions):
+			versionId = _id("V", "{}:{}".format(slug, i))
+			filename = "{}-1.0.{}.jar".format(slug, i)
+			key = "{}/{}".format(versionId, filename)
+			dependencies = []
+			# Every Nth mod-N requires mod-N-dep, so dependency resolution has
+			# work to do.
+			number = slug.rsplit("-", 1)[-1]
+			if options.dependencies and number.isdigit() and int(number) % options.dependencies == 0:
+				dependency = "{}-dep".format(slug)
+				self.__named[_id("P", dependency)] = dependency
+				dependencies.append({"project_id": _id("P", dependency), "version_id": None, "dependency_type": "required"})
+			self.__versions[versionId] = {
+				"id": versionId,
+				"project_id": projectId,
+				"version_number": "1.0.{}".format(i),
+				"loaders": ["fabric"],
+				"game_versions": options.game_versions,
+				"date_published": "2023-01-01T00:{:02d}:{:02d}Z".format(i // 60, i % 60),
+				"dependencies": dependencies,
+				"files": [{
+					"url": "{}/data/{}".format(options.base, key),
+					"filename": filename,
+					"size": options.jar_size,
+					"primary": True,
+					"hashes": self.__hashes(key, options.jar_size),
+				}],
+			}
+			versionIds.append(versionId)
+		project = {"id": projectId, "slug": slug, "title": slug, "versions": versionIds}
+		self.__projects[projectId] = project
+		self.__projects[slug] = project
+		return project
+
+	# Gets the project by slug or ID, making it up if it's a slug. Slugs that
+	# start with missing- don't exist.
+	def Project(self, key: str):
+		with self.__lock:
+			if key in self.__projects:
+				return self.__projects[key]
+			if key in self.__named:
+				return self.__make(self.__named[key])
+			isId = len(key) == 8 and key.startswith("P")
+			if isId or key.startswith("missing-"):
+				return None
+			return self.__make(key)
+
+	def Version(self, versionId: str):
+		with self.__lock:
+			return self.__versions.get(versionId)
+
+	def Hashes(self, key: str, size: int) -> dict:
+		with self.__lock:
+			return self.__hashes(key, size)
+
+	# The loader's server profile: the loader and the libraries it needs.
+	# Every other library comes without hashes, as some do from Fabric meta,
+	# so they have to be checked against the .sha1 files next to them.
+	def ServerProfile(self, gameVersion: str, loaderVersion: str) -> dict:
+		options = self.__options
+		names = ["net.fabricmc:fabric-loader:" + loaderVersion]
+		names += ["org.example.lib{}:library-{}:1.{}".format(i % 3, i, i) for i in range(options.libraries)]
+		libraries = []
+		for i, name in enumerate(names):
+			library = {"name": name, "url": options.base + "/maven/"}
+			if i % 2 == 0:
+				library.update(self.Hashes(MavenPath(name), options.library_size))
+				library["size"] = options.library_size
+			libraries.append(library)
+		return {
+			"id": "fabric-loader-{}-{}".format(loaderVersion, gameVersion),
+			"mainClass": "net.fabricmc.loader.impl.launch.knot.KnotServer",
+			"libraries": libraries,
+		}
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	catalog = None
+	options = None
+	stats = collections.Counter()
+	statsLock = threading.Lock()
+	random = random.Random()
+	rateLimit = {"reset": 0.0, "used": 0}
+	rateLimitLock = threading.Lock()
+
+	def log_message(self, format, *args):
+		pass
+
+	def __count(self, kind: str) -> None:
+		with StandInHandler.statsLock:
+			StandInHandler.stats[kind] += 1
+
+	def __chance(self, rate: float) -> bool:
+		with StandInHandler.statsLock:
+			return StandInHandler.random.random() < rate
+
+	# Returns the rate limit headers to send, and whether the request is over
+	# the limit.
+	def __rateLimit(self):
+		options = StandInHandler.options
+		if not options.rate_limit:
+			return {}, False
+		with StandInHandler.rateLimitLock:
+			now = time.time()
+			state = StandInHandler.rateLimit
+			if now >= state["reset"]:
+				state["reset"] = now + options.rate_window
+				state["used"] = 0
+			state["used"] += 1
+			remaining = options.rate_limit - state["used"]
+			reset = max(1, int(state["reset"] - now + 0.999))
+		headers = {"X-Ratelimit-Limit": options.rate_limit, "X-Ratelimit-Remaining": max(0, remaining), "X-Ratelimit-Reset": reset}
+		return headers, remaining < 0
+
+	def __send(self, status: int, body: bytes, contentType: str, headers: dict = None, dropAt: int = None) -> None:
+		self.send_response(status)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, str(value))
+		self.end_headers()
+
+		bandwidth = StandInHandler.options.bandwidth
+		sent = 0
+		start = time.monotonic()
+		while sent < len(body):
+			if dropAt is not None and sent >= dropAt:
+				self.__count("dropped")
+				self.close_connection = True
+				return
+			chunk = body[sent:sent + CHUNK_SIZE]
+			self.wfile.write(chunk)
+			sent += len(chunk)
+			if bandwidth:
+				ahead = sent / bandwidth - (time.monotonic() - start)
+				if ahead > 0:
+					time.sleep(ahead)
+
+	def __sendJson(self, status: int, data, headers: dict) -> None:
+		body = json.dumps(data).encode()
+		etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+		headers = dict(headers, ETag=etag)
+		if status == 200 and self.headers.get("If-None-Match") == etag:
+			self.__count("not-modified")
+			self.__send(304, b"", "application/json", headers)
+			return
+		self.__send(status, body, "application/json", headers)
+
+	def __sendJar(self, key: str, size: int, headers: dict) -> None:
+		body = StandInHandler.catalog.JarBytes(key, size)
+		etag = '"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+		headers = dict(headers, ETag=etag)
+		headers["Accept-Ranges"] = "bytes"
+		status = 200
+		rangeHeader = self.headers.get("Range", "")
+		if rangeHeader.startswith("bytes=") and rangeHeader.endswith("-") and self.headers.get("If-Range", etag) == etag:
+			offset = int(rangeHeader[len("bytes="):-1])
+			if offset >= size:
+				self.__send(416, b"", "text/plain", dict(headers, **{"Content-Range": "bytes */{}".format(size)}))
+				return
+			headers["Content-Range"] = "bytes {}-{}/{}".format(offset, size - 1, size)
+			body = body[offset:]
+			status = 206
+			self.__count("resumed")
+		dropAt = len(body) // 2 if self.__chance(StandInHandler.options.drop_rate) else None
+		self.__send(status, body, "application/java-archive", headers, dropAt)
+
+	def do_GET(self):
+		options = StandInHandler.options
+		url = urllib.parse.urlsplit(self.path)
+		query = urllib.parse.parse_qs(url.query)
+		parts = [urllib.parse.unquote(part) for part in url.path.strip("/").split("/")]
+		catalog = StandInHandler.catalog
+
+		if parts == ["stats"]:
+			with StandInHandler.statsLock:
+				stats = dict(StandInHandler.stats)
+			self.__sendJson(200, stats, {})
+			return
+
+		if options.latency or options.jitter:
+			time.sleep((options.latency + random.uniform(0, options.jitter)) / 1000)
+
+		isDownload = parts[:1] in [["data"], ["maven"], ["v1"]] or parts[:3] == ["v2", "versions", "loader"]
+		headers = {}
+		if not isDownload:
+			headers, over = self.__rateLimit()
+			if over:
+				self.__count("rate-limited")
+				self.__sendJson(429, {"error": "ratelimited"}, headers)
+				return
+		if self.__chance(options.error_rate):
+			self.__count("errors")
+			self.__sendJson(503, {"error": "unavailable"}, headers)
+			return
+
+		if parts[:1] == ["data"] and len(parts) == 3:
+			self.__count("jar")
+			self.__sendJar("{}/{}".format(parts[1], parts[2]), options.jar_size, headers)
+		elif parts[:3] == ["v2", "versions", "loader"] and parts[-2:] == ["server", "jar"]:
+			self.__count("server-jar")
+			self.__sendJar("/".join(parts[3:6]), options.server_jar_size, headers)
+		elif parts[:3] == ["v2", "versions", "loader"] and len(parts) == 7 and parts[-2:] == ["server", "json"]:
+			self.__count("server-profile")
+			self.__sendJson(200, catalog.ServerProfile(parts[3], parts[4]), headers)
+		elif parts[:1] == ["maven"] and parts[-1].endswith(".jar.sha1"):
+			self.__count("library-sha1")
+			self.__send(200, catalog.Hashes("/".join(parts[1:])[:-len(".sha1")], options.library_size)["sha1"].encode(), "text/plain", headers)
+		elif parts[:1] == ["maven"] and parts[-1].endswith(".jar"):
+			self.__count("library")
+			self.__sendJar("/".join(parts[1:]), options.library_size, headers)
+		elif parts == ["mc", "game", "version_manifest_v2.json"]:
+			self.__count("game-versions")
+			self.__sendJson(200, {"versions": [
+				{"id": gameVersion, "type": "release", "url": "{}/v1/packages/{}.json".format(options.base, gameVersion)}
+				for gameVersion in options.game_versions
+			]}, headers)
+		elif parts[:2] == ["v1", "packages"] and len(parts) == 3:
+			self.__count("game-version")
+			gameVersion = parts[2][:-len(".json")]
+			if not gameVersion in options.game_versions:
+				self.__sendJson(404, {"error": "not_found"}, headers)
+				return
+			key = "vanilla/{}/server.jar".format(gameVersion)
+			self.__sendJson(200, {"id": gameVersion, "downloads": {"server": {
+				"url": "{}/v1/objects/{}/server.jar".format(options.base, gameVersion),
+				"sha1": catalog.Hashes(key, options.server_jar_size)["sha1"],
+				"size": options.server_jar_size,
+			}}}, headers)
+		elif parts[:2] == ["v1", "objects"] and len(parts) == 4:
+			self.__count("vanilla-jar")
+			self.__sendJar("vanilla/{}/server.jar".format(parts[2]), options.server_jar_size, headers)
+		elif parts[:2] == ["v2", "project"] and len(parts) == 4 and parts[3] == "version":
+			self.__count("project-versions")
+			project = catalog.Project(parts[2])
+			if project is None:
+				self.__sendJson(404, {"error": "not_found"}, headers)
+				return
+			loaders = json.loads(query.get("loaders", ["[]"])[0])
+			gameVersions = json.loads(query.get("game_versions", ["[]"])[0])
+			versions = [catalog.Version(versionId) for versionId in reversed(project["versions"])]
+			self.__sendJson(200, [
+				version for version in versions
+				if (not loaders or set(loaders) & set(version["loaders"])) and (not gameVersions or set(gameVersions) & set(version["game_versions"]))
+			], headers)
+		elif parts[:2] == ["v2", "project"] and len(parts) == 3:
+			self.__count("project")
+			project = catalog.Project(parts[2])
+			self.__sendJson(200 if project else 404, project or {"error": "not_found"}, headers)
+		elif parts == ["v2", "projects"]:
+			self.__count("projects")
+			projects = [catalog.Project(key) for key in json.loads(query.get("ids", ["[]"])[0])]
+			self.__sendJson(200, [project for project in projects if project is not None], headers)
+		elif parts == ["v2", "versions"]:
+			self.__count("versions")
+			versions = [catalog.Version(key) for key in json.loads(query.get("ids", ["[]"])[0])]
+			self.__sendJson(200, [version for version in versions if version is not None], headers)
+		else:
+			self.__count("not-found")
+			self.__sendJson(404, {"error": "not_found"}, headers)
+
+def BuildArgparser() -> argparse.ArgumentParser:
+	parser = argparse.ArgumentParser(description="A local stand-in for Modrinth's API, Fabric's meta server and Mojang's version metadata")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=0, help="0 picks a free port. The address is printed once it's listening")
+	parser.add_argument("--latency", type=float, default=0, help="Milliseconds to wait before answering each request")
+	parser.add_argument("--jitter", type=float, default=0, help="Up to this many more milliseconds, chosen at random")
+	parser.add_argument("--bandwidth", type=ParseSize, default=0, help="Bytes per second each response is sent at, such as 5M. 0 is unlimited")
+	parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with HTTP 503")
+	parser.add_argument("--drop-rate", type=float, default=0, help="Fraction of jar downloads broken off halfway")
+	parser.add_argument("--rate-limit", type=int, default=0, help="API requests allowed per window, with Modrinth's rate limit headers. 0 is unlimited")
+	parser.add_argument("--rate-window", type=float, default=60, help="Seconds in each rate limit window")
+	parser.add_argument("--versions", type=int, default=5, help="Versions each project has")
+	parser.add_argument("--dependencies", type=int, default=0, help="Makes every Nth mod-N project require another project. 0 turns dependencies off")
+	parser.add_argument("--game-versions", type=lambda value: value.split(","), default=["1.20", "1.20.1"], help="The Minecraft versions every version supports, comma-separated")
+	parser.add_argument("--jar-size", type=ParseSize, default=ParseSize("256K"), help="The size of each mod jar")
+	parser.add_argument("--server-jar-size", type=ParseSize, default=ParseSize("1M"), help="The size of the server jar, and of the vanilla server jar")
+	parser.add_argument("--libraries", type=int, default=12, help="Libraries the Fabric loader needs, besides itself")
+	parser.add_argument("--library-size", type=ParseSize, default=ParseSize("128K"), help="The size of each library")
+	parser.add_argument("--seed", type=int, default=0, help="Seeds the errors and drops, so runs can be repeated")
+	return parser
+
+def main() -> None:
+	options = BuildArgparser().parse_args()
+	server = http.server.ThreadingHTTPServer((options.host, options.port), StandInHandler)
+	server.daemon_threads = True
+	options.base = "http://{}:{}".format(options.host, server.server_address[1])
+	StandInHandler.options = options
+	StandInHandler.catalog = Catalog(options)
+	StandInHandler.random.seed(options.seed)
+	print("Listening on " + options.base, flush=True)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Measures how long Tablecloth takes to start for commands that never touch the
+# network. Each run is a fresh interpreter so nothing is warm except the OS
+# file cache. Run it from anywhere:
+#
+#     python benchmarks/startup.py --runs 20 --profiles 200
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TABLECLOTH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tablecloth.py")
+
+COMMANDS = [
+	["profile", "list"],
+	["mod", "list"],
+	["mod", "search", "mod-0"],
+	["--help"],
+]
+
+def WriteConfig(directory: str, profileCount: int, modCount: int) -> None:
+	profiles = {}
+	for i in range(profileCount):
+		profiles["profile-{}".format(i)] = {
+			"minecraft": { "version": "1.20.1" },
+			"fabric": { "loader": "0.14.21", "installer": "0.11.2" },
+			"mods": { "mod-{}".format(m): { "version": None } for m in range(modCount) },
+			"overrides": { "jar-name": None, "java-path": None, "java-args": [] },
+		}
+	config = {
+		"profiles": profiles,
+		"settings": {
+			"assume-current-profile": True,
+			"current-profile": "profile-0",
+			"launch": {
+				"jar-name": "server.jar",
+				"java-path": None,
+				"min-ram": "1G",
+				"max-ram": "2G",
+				"java-args": []
+			}
+		}
+	}
+	with open(os.path.join(directory, "tablecloth.json"), "w") as configFile:
+		json.dump(config, configFile)
+
+def TimeCommand(argv: list, cwd: str, runs: int) -> list:
+	timings = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		subprocess.run(argv, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+		timings.append(time.perf_counter() - start)
+	return timings
+
+# Runs the command once with -X importtime and reports whether requests showed up.
+def ImportsRequests(argv: list, cwd: str) -> bool:
+	result = subprocess.run([sys.executable, "-X", "importtime"] + argv[1:], cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+	return any(line.rstrip().endswith("| requests") for line in result.stderr.splitlines())
+
+def Report(label: str, timings: list, baseline: float, importsRequests=None) -> None:
+	median = statistics.median(timings)
+	line = "{:<28} median {:7.1f} ms  min {:7.1f} ms  over python {:7.1f} ms".format(
+		label, median * 1000, min(timings) * 1000, (median - baseline) * 1000)
+	if importsRequests is not None:
+		line += "  requests imported: {}".format("yes" if importsRequests else "no")
+	print(line)
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Cold-start timings for local-only Tablecloth commands")
+	parser.add_argument("--runs", type=int, default=15, help="Runs per command")
+	parser.add_argument("--profiles", type=int, default=100, help="Profiles in the generated config")
+	parser.add_argument("--mods", type=int, default=40, help="Mods per generated profile")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		WriteConfig(directory, args.profiles, args.mods)
+		print("{} profiles x {} mods, {} runs each".format(args.profiles, args.mods, args.runs))
+
+		baseline = statistics.median(TimeCommand([sys.executable, "-c", "pass"], directory, args.runs))
+		Report("python -c pass", [baseline], baseline)
+		for command in COMMANDS:
+			argv = [sys.executable, TABLECLOTH] + command
+			Report(" ".join(command), TimeCommand(argv, directory, args.runs), baseline, ImportsRequests(argv, directory))
+
+if __name__ == "__main__":
+	main()
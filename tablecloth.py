@@ -29,15 +29,37 @@
 
 import argparse
 import collections.abc
+import contextlib
 import copy
 import json
 import os
-import requests
 import shutil
-import subprocess
 import sys
+import threading
+import time
+import typing
 
+if typing.TYPE_CHECKING:
+	# Only for annotations; requests itself is imported when it's first needed.
+	import requests
+
+try:
+	import fcntl
+except ImportError:
+	# Not available on Windows. Cache eviction just won't be locked there.
+	fcntl = None
+
+TABLECLOTH_VERSION = "0.2"
 TABLECLOTH_CONFIG_PATH = 'tablecloth.json'
+TABLECLOTH_LOCK_PATH = 'tablecloth.lock.json'
+
+# Where Modrinth's API and Fabric's meta server are. They can be pointed
+# elsewhere, such as at the stand-in server in benchmarks/.
+MODRINTH_API_URL = os.environ.get("TABLECLOTH_MODRINTH_API", "https://api.modrinth.com/v2/")
+FABRIC_META_URL = os.environ.get("TABLECLOTH_FABRIC_META", "https://meta.fabricmc.net/")
+MOJANG_META_URL = os.environ.get("TABLECLOTH_MOJANG_META", "https://piston-meta.mojang.com/")
+# Where Fabric libraries come from when Fabric meta doesn't say.
+FABRIC_MAVEN_URL = "https://maven.fabricmc.net/"
 
 DEFAULT_MINECRAFT_VERSION = "1.20"
 DEFAULT_FABRIC_LOADER = "0.14.21"
@@ -53,6 +75,90 @@ CONFIG_SETTINGS = "settings"
 
 CONFIG_SERVER_JAR_NAME = "jar-name"
 
+# Where Tablecloth keeps state about the server directory that isn't config.
+TABLECLOTH_STATE_DIR = '.tablecloth'
+INSTALL_MANIFEST_PATH = os.path.join(TABLECLOTH_STATE_DIR, 'installed.json')
+# Where Fabric's server launcher keeps the loader's libraries, and the vanilla
+# server jar and the launch jar it makes, relative to the server directory.
+FABRIC_LIBRARIES_DIR = 'libraries'
+FABRIC_DATA_DIR = '.fabric/server'
+
+# The number of files downloaded at once when no other value has been given.
+DEFAULT_DOWNLOAD_JOBS = 8
+# How much of a download is held in memory at once.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# How many times a file is downloaded before giving up on it, such as when
+# what arrives doesn't match its hashes.
+DOWNLOAD_ATTEMPTS = 3
+
+# Modrinth asks that clients identify themselves with a unique User-Agent.
+HTTP_USER_AGENT = "greenstack/tablecloth-mc/{} (+https://github.com/greenstack/tablecloth-mc)".format(TABLECLOTH_VERSION)
+# Seconds to wait for a connection and then for each read from it.
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+# How many connections are kept alive per host.
+HTTP_POOL_SIZE = 32
+# How many times a request is retried after a connection error or a response
+# that suggests the host is having trouble, and the base and cap (in seconds)
+# for the delay between attempts.
+HTTP_RETRIES = 4
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 30
+HTTP_RETRY_STATUSES = [500, 502, 503, 504]
+# Requests waiting on a host's rate limit go out in this order: API calls
+# before file downloads.
+HTTP_PRIORITY_METADATA = 0
+HTTP_PRIORITY_DOWNLOAD = 1
+# How much of a host's rate limit is kept for API calls; downloads wait for
+# the next window rather than use it.
+HTTP_RATELIMIT_RESERVE = 5
+# Once less than this share of a host's rate limit is left, requests are
+# spread evenly over what's left of the window instead of sent in a burst.
+HTTP_RATELIMIT_PACE_BELOW = 0.25
+# How long to wait after a 429 that doesn't say when to try again.
+HTTP_RATELIMIT_DEFAULT_WAIT = 10
+
+# How launch --supervise restarts the server and records what it's doing.
+# Delays are in seconds. A server that stays up for stable-after seconds is
+# no longer counted as crash-looping.
+DEFAULT_SUPERVISOR_SETTINGS = {
+	"sample-interval": 15,
+	"metrics-path": os.path.join(TABLECLOTH_STATE_DIR, "metrics.jsonl"),
+	"metrics-max-size": "10M",
+	"metrics-backups": 3,
+	"restart-delay": 5,
+	"restart-delay-max": 300,
+	"max-restarts": 5,
+	"stable-after": 600,
+}
+
+# How launch reads the server's log for lag, startups, players and
+# exceptions. Analysis only runs when textfile or listen is set. window is how
+# many seconds of lag the rolling figures cover; the textfile is rewritten
+# every export-interval seconds.
+DEFAULT_LOG_METRICS_SETTINGS = {
+	"textfile": None,
+	"listen": None,
+	"window": 300,
+	"export-interval": 15,
+}
+
+# Batches smaller than this are resolved one mod at a time, since that's
+# fewer requests than going through Modrinth's bulk endpoints.
+MODRINTH_BULK_THRESHOLD = 4
+# How many IDs are sent in each bulk request. This keeps the URLs short enough
+# for Modrinth to accept them.
+MODRINTH_IDS_PER_REQUEST = 100
+# How many of each project's newest versions the bulk lookup searches. Mods
+# pinned to an older version are looked up on their own.
+MODRINTH_RECENT_VERSIONS = 10
+
+# The largest the artifact cache may grow before old files are evicted.
+DEFAULT_CACHE_MAX_SIZE = "4G"
+# How many seconds a cached API response is used before asking the host if
+# it has changed.
+DEFAULT_METADATA_TTL = 600
+
 class TableclothArgparseFactory:
 	def __init__(self, argparser):
 		self.__commandStack = [argparser.add_subparsers()]
@@ -91,10 +197,25 @@ class TableclothProfile:
 		self.__jarName = None
 		self.__javaPath = None
 		self.__javaArgs = []
+		self.__preset = None
+		self.__observer = None
 
 	def Name(self):
 		return self.__name
 
+	def SetName(self, name: str) -> None:
+		self.__name = name
+
+	# Sets the object told whenever a mod is added, changed or removed. It
+	# needs a ModChanged(profileName, modName, settings) method; settings is
+	# None when the mod was removed.
+	def SetObserver(self, observer) -> None:
+		self.__observer = observer
+
+	def __notify(self, modName) -> None:
+		if self.__observer is not None:
+			self.__observer.ModChanged(self.__name, modName, self.__mods.get(modName))
+
 	def SetMinecraftVersion(self, minecraftVersion: str) -> None:
 		self.__minecraftVersion = minecraftVersion
 
@@ -129,6 +250,7 @@ class TableclothProfile:
 		profile.SetJarName(data["overrides"]["jar-name"])
 		profile.SetJavaPath(data["overrides"]["java-path"])
 		profile.__javaArgs = data["overrides"]["java-args"]
+		profile.__preset = data["overrides"].get("preset")
 
 		return profile
 
@@ -149,6 +271,7 @@ class TableclothProfile:
 				"jar-name": self.__jarName,
 				"java-path": self.__javaPath,
 				"java-args": self.__javaArgs,
+				"preset": self.__preset,
 			}
 		}
 		
@@ -175,6 +298,7 @@ class TableclothProfile:
 			"enabled": True,
 			"modrinth": modInfo,
 		}
+		self.__notify(modName)
 		return True
 
 	def UpdateMod(self, modName, version) -> bool:
@@ -189,19 +313,71 @@ class TableclothProfile:
 		)
 
 		if not modInfo:
-			return
+			return False
 		
 		self.__mods[modName] = {
 			"version": version,
 			"enabled": self.__mods[modName]["enabled"],
 			"modrinth": modInfo,
 		}
+		self.__notify(modName)
 
 		if not self.__mods[modName]["enabled"]:
 			print("Updated the mod, but it's still disabled")
+		return True
+
+	# Looks up every mod in this profile again, such as after the Minecraft
+	# version has changed. Returns the names of the mods that couldn't be found.
+	def RefreshMods(self) -> list:
+		resolved = ModrinthHostService().ResolveMods(
+			self.GetMinecraftVersion(),
+			{modName: settings["version"] for modName, settings in self.__mods.items()}
+		)
+
+		failed = []
+		for modName, modInfo in resolved.items():
+			if not modInfo:
+				failed.append(modName)
+				continue
+			self.__mods[modName]["modrinth"] = modInfo
+			self.__notify(modName)
+		return failed
+
+	# Finds every mod the enabled mods require, adds the ones that are missing
+	# and records which mods need each one. Returns the resolver's report.
+	def ResolveDependencies(self) -> dict:
+		enabled = {modName: settings["modrinth"] for modName, settings in self.__mods.items() if settings["enabled"]}
+		report = ModrinthHostService().ResolveDependencies(self.GetMinecraftVersion(), enabled)
+
+		for modName, dependencies in report["dependencies"].items():
+			self.__mods[modName]["modrinth"]["dependencies"] = dependencies
+		for modName, modInfo in report["added"].items():
+			if modName in self.__mods:
+				report["conflicts"].append("{} is required by {}, but it's disabled".format(modName, ", ".join(sorted(report["required-by"][modName]))))
+				continue
+			self.__mods[modName] = {
+				"version": modInfo["version-number"],
+				"enabled": True,
+				"modrinth": modInfo,
+			}
+			self.__notify(modName)
+		for modName, settings in self.__mods.items():
+			if report["required-by"].get(modName):
+				settings["required-by"] = sorted(report["required-by"][modName])
+			else:
+				settings.pop("required-by", None)
+		return report
+
+	# Moves a mod to another version that's already been looked up, such as
+	# one update-check found.
+	def ApplyUpdate(self, modName, modInfo: dict) -> None:
+		self.__mods[modName]["version"] = modInfo["version-number"]
+		self.__mods[modName]["modrinth"] = modInfo
+		self.__notify(modName)
 
 	def RemoveMod(self, modName) -> None:
 		self.__mods.pop(modName)
+		self.__notify(modName)
 
 	# Gets a list of all mods in this profile.
 	def ListMods(self) -> list:
@@ -229,6 +405,113 @@ class TableclothProfile:
 	def DoesOverrideJavaPath(self) -> bool:
 		return self.GetJavaPath() is not None
 
+	# Args passed to Java after the ones in settings.launch.java-args.
+	def SetJavaArgs(self, javaArgs: list) -> None:
+		self.__javaArgs = javaArgs
+
+	def GetJavaArgs(self) -> list:
+		return self.__javaArgs
+
+	# The JVM tuning preset launch uses for this profile, instead of the one in
+	# settings.launch.preset.
+	def SetPreset(self, preset) -> None:
+		self.__preset = preset
+
+	def GetPreset(self) -> str:
+		return self.__preset
+
+	def DoesOverridePreset(self) -> bool:
+		return self.GetPreset() is not None
+
+# Maps mods to the profiles that use them by mod name, Modrinth project ID and
+# Modrinth version ID, so questions like "which profiles use this mod" don't
+# have to walk every profile. The config builds it the first time it's asked
+# for and keeps it current as profiles and their mods change.
+class ModIndex:
+	def __init__(self) -> None:
+		self.__byName = {}
+		self.__byProject = {}
+		self.__byVersion = {}
+		# profile name -> mod name -> what the mod was indexed under
+		self.__entries = {}
+
+	def __link(self, table: dict, key, profileName: str, modName: str) -> None:
+		if key:
+			table.setdefault(key, {}).setdefault(profileName, set()).add(modName)
+
+	def __unlink(self, table: dict, key, profileName: str, modName: str) -> None:
+		if not key or not key in table:
+			return
+		mods = table[key].get(profileName, set())
+		mods.discard(modName)
+		if not mods:
+			table[key].pop(profileName, None)
+		if not table[key]:
+			table.pop(key)
+
+	def AddProfile(self, profileName: str, mods: dict) -> None:
+		for modName, settings in mods.items():
+			self.ModChanged(profileName, modName, settings)
+
+	def RemoveProfile(self, profileName: str) -> None:
+		for modName in list(self.__entries.get(profileName, {})):
+			self.ModChanged(profileName, modName, None)
+		self.__entries.pop(profileName, None)
+
+	def RenameProfile(self, oldProfileName: str, newProfileName: str) -> None:
+		entries = self.__entries.get(oldProfileName, {})
+		mods = {modName: entry["settings"] for modName, entry in entries.items()}
+		self.RemoveProfile(oldProfileName)
+		self.AddProfile(newProfileName, mods)
+
+	# Records the current settings of a mod in a profile. Settings of None
+	# means the mod was removed.
+	def ModChanged(self, profileName: str, modName: str, settings) -> None:
+		entries = self.__entries.setdefault(profileName, {})
+		old = entries.pop(modName, None)
+		if old:
+			self.__unlink(self.__byName, modName, profileName, modName)
+			self.__unlink(self.__byProject, old["project-id"], profileName, modName)
+			self.__unlink(self.__byVersion, old["version-id"], profileName, modName)
+		if settings is None:
+			return
+
+		modrinth = settings.get("modrinth") or {}
+		entries[modName] = {
+			"project-id": modrinth.get("project-id"),
+			"version-id": modrinth.get("version-id"),
+			"settings": settings,
+		}
+		self.__link(self.__byName, modName, profileName, modName)
+		self.__link(self.__byProject, modrinth.get("project-id"), profileName, modName)
+		self.__link(self.__byVersion, modrinth.get("version-id"), profileName, modName)
+
+	# Finds the profiles that use a mod, given its name, Modrinth project ID
+	# or Modrinth version ID. Returns a dictionary of profile name to the
+	# names the mod goes by in that profile.
+	def Find(self, key: str) -> dict:
+		for table in [self.__byName, self.__byProject, self.__byVersion]:
+			if key in table:
+				return {profileName: sorted(mods) for profileName, mods in sorted(table[key].items())}
+		return {}
+
+	# Gets the settings a profile has for a mod, or None if it doesn't have it.
+	def GetModSettings(self, profileName: str, modName: str):
+		entry = self.__entries.get(profileName, {}).get(modName)
+		return entry["settings"] if entry else None
+
+	# Finds the profiles that pin a mod to a version. The version may be the
+	# version the user set, the Modrinth version number or the version ID.
+	def FindPinned(self, key: str, version: str) -> dict:
+		found = {}
+		for profileName, mods in self.Find(key).items():
+			for modName in mods:
+				settings = self.GetModSettings(profileName, modName)
+				modrinth = settings.get("modrinth") or {}
+				if version in [settings.get("version"), modrinth.get("version-number"), modrinth.get("version-id")]:
+					found.setdefault(profileName, []).append(modName)
+		return found
+
 # Represents and provides methods for Tablecloth configuration.
 class TableclothConfig:
 	def __defaultConfig() -> dict:
@@ -244,23 +527,42 @@ class TableclothConfig:
 					"java-path": None,
 					"min-ram": "1G",
 					"max-ram": "2G",
-					"java-args": []
+					"java-args": [],
+					"preset": None,
+					"large-pages": False,
+					"pre-touch": False,
 				},
 				"validation": {
 					"hashes": True,
 					"size": True,
-				}
+				},
+				"downloads": {
+					"jobs": DEFAULT_DOWNLOAD_JOBS,
+					"prefetch-server-files": True,
+				},
+				"cache": {
+					"enabled": True,
+					"path": None,
+					"max-size": DEFAULT_CACHE_MAX_SIZE,
+					"metadata-ttl": DEFAULT_METADATA_TTL,
+				},
+				"supervisor": dict(DEFAULT_SUPERVISOR_SETTINGS),
+				"log-metrics": dict(DEFAULT_LOG_METRICS_SETTINGS),
 			}
 		}
 
-	def __init__(self):
-		if (not os.path.exists(TABLECLOTH_CONFIG_PATH)):
+	# root is the server directory the config belongs to.
+	def __init__(self, root: str = "."):
+		self.__path = os.path.join(root, TABLECLOTH_CONFIG_PATH)
+		if (not os.path.exists(self.__path)):
 			self.__config = TableclothConfig.__defaultConfig()
 			self.__isDirty = True
+			self.__modIndex = None
 			return
 
-		self.__config = TableclothConfig.Load(TABLECLOTH_CONFIG_PATH)
+		self.__config = TableclothConfig.Load(self.__path)
 		self.__isDirty = False
+		self.__modIndex = None
 
 	def IsDirty(self) -> bool:
 		return self.__isDirty
@@ -268,32 +570,104 @@ class TableclothConfig:
 	def MarkDirty(self) -> None:
 		self.__isDirty = True
 
+	# Profiles are left as plain dictionaries here and only turned into
+	# TableclothProfile objects when something asks for them. Most commands
+	# touch a single profile, so there's no point paying for all of them.
 	def Load(filePath) -> dict:
 		with open(filePath, 'r') as configFile:
-			config = json.load(configFile)
-		profiles = {}
-		for profile, data in config[CONFIG_PROFILES].items():
-			profiles[profile] = TableclothProfile.FromDict(profile, data)
-		# We pop it to allow us to put in the class-specified versions properly.
-		config.pop(CONFIG_PROFILES)
-		config[CONFIG_PROFILES] = profiles
-		return config
+			return json.load(configFile)
 
 	def Save(self):
-		with open(TABLECLOTH_CONFIG_PATH, 'w') as configFile:
+		with open(self.__path, 'w') as configFile:
 			# We indent because we need the config to be more easily human-readable
 			json.dump(self.ToDict(), configFile, indent=4)
 
+	# Gets the launch settings, filling in anything an older config doesn't
+	# have.
 	def GetLaunchInfo(self):
-		return self.__config[CONFIG_SETTINGS]["launch"]
+		settings = {
+			"java-path": None,
+			"java-args": [],
+			"preset": None,
+			"large-pages": False,
+			"pre-touch": False,
+		}
+		settings.update(self.__config[CONFIG_SETTINGS]["launch"])
+		return settings
+
+	# Gets the number of files that may be downloaded at once. Older configs
+	# don't have this setting, so fall back to the default.
+	def GetDownloadJobs(self) -> int:
+		downloads = self.__config[CONFIG_SETTINGS].get("downloads", {})
+		return max(1, int(downloads.get("jobs", DEFAULT_DOWNLOAD_JOBS)))
+
+	# Gets whether serve-up fetches what the Fabric launcher needs to start the
+	# server. Configs from before this setting existed do.
+	def GetPrefetchServerFiles(self) -> bool:
+		return bool(self.__config[CONFIG_SETTINGS].get("downloads", {}).get("prefetch-server-files", True))
+
+	# Gets the settings for validating installed files.
+	def GetValidationSettings(self) -> dict:
+		settings = {
+			"hashes": True,
+			"size": True,
+		}
+		settings.update(self.__config[CONFIG_SETTINGS].get("validation", {}))
+		return settings
+
+	# Gets the artifact cache settings, filling in anything an older config
+	# doesn't have.
+	def GetCacheSettings(self) -> dict:
+		settings = {
+			"enabled": True,
+			"path": None,
+			"max-size": DEFAULT_CACHE_MAX_SIZE,
+			"metadata-ttl": DEFAULT_METADATA_TTL,
+		}
+		settings.update(self.__config[CONFIG_SETTINGS].get("cache", {}))
+		return settings
+
+	# Gets the index of which profiles use which mods, building it if this
+	# is the first time it's been asked for.
+	def GetModIndex(self) -> ModIndex:
+		if self.__modIndex is None:
+			self.__modIndex = ModIndex()
+			for profileName, profile in self.__config[CONFIG_PROFILES].items():
+				self.__modIndex.AddProfile(profileName, profile["mods"] if isinstance(profile, dict) else profile.Mods())
+		return self.__modIndex
+
+	# Called by profiles when one of their mods changes.
+	def ModChanged(self, profileName: str, modName: str, settings) -> None:
+		if self.__modIndex is not None:
+			self.__modIndex.ModChanged(profileName, modName, settings)
+
+	# Gets the settings for launch --supervise, filling in anything an older
+	# config doesn't have.
+	def GetSupervisorSettings(self) -> dict:
+		settings = dict(DEFAULT_SUPERVISOR_SETTINGS)
+		settings.update(self.__config[CONFIG_SETTINGS].get("supervisor", {}))
+		return settings
+
+	# Gets the settings for the launch log analysis, filling in anything an
+	# older config doesn't have.
+	def GetLogMetricsSettings(self) -> dict:
+		settings = dict(DEFAULT_LOG_METRICS_SETTINGS)
+		settings.update(self.__config[CONFIG_SETTINGS].get("log-metrics", {}))
+		return settings
 
 	def AddProfile(self, profileName: str, mcVersion: str, fabLoaderVer: str, fabInstallerVer: str):
-		self.__config[CONFIG_PROFILES][profileName] = TableclothProfile(mcVersion, fabLoaderVer, fabInstallerVer)
+		self.__config[CONFIG_PROFILES][profileName] = TableclothProfile(profileName, mcVersion, fabLoaderVer, fabInstallerVer)
+		if self.__modIndex is not None:
+			self.__modIndex.RemoveProfile(profileName)
 		self.MarkDirty()
 
 	def RenameProfile(self, oldProfileName: str, newProfileName: str):
-		self.__config[CONFIG_PROFILES][newProfileName] = self.__config[CONFIG_PROFILES][oldProfileName]
-		del self.__config[CONFIG_PROFILES][oldProfileName]
+		profile = self.__config[CONFIG_PROFILES].pop(oldProfileName)
+		if isinstance(profile, TableclothProfile):
+			profile.SetName(newProfileName)
+		self.__config[CONFIG_PROFILES][newProfileName] = profile
+		if self.__modIndex is not None:
+			self.__modIndex.RenameProfile(oldProfileName, newProfileName)
 		self.MarkDirty()
 
 	def CopyProfile(self, oldProfileName: str, newProfileName: str) -> bool:
@@ -305,19 +679,46 @@ class TableclothConfig:
 			return False
 
 		self.MarkDirty()
-		self.__config[CONFIG_PROFILES][newProfileName] = copy.deepcopy(self.__config[CONFIG_PROFILES][oldProfileName])
+		# The copy is kept as a dictionary so it doesn't share anything with
+		# the original; it becomes a profile again when it's asked for.
+		original = self.__config[CONFIG_PROFILES][oldProfileName]
+		if isinstance(original, TableclothProfile):
+			original = original.ToDict()
+		self.__config[CONFIG_PROFILES][newProfileName] = copy.deepcopy(original)
+		if self.__modIndex is not None:
+			self.__modIndex.AddProfile(newProfileName, self.__config[CONFIG_PROFILES][newProfileName]["mods"])
 		return True
 
+	# Adds (or replaces) the profile from its dictionary form, as ToDict gives.
+	def ImportProfile(self, profileName: str, data: dict) -> None:
+		self.__config[CONFIG_PROFILES][profileName] = copy.deepcopy(data)
+		if self.__modIndex is not None:
+			self.__modIndex.RemoveProfile(profileName)
+			self.__modIndex.AddProfile(profileName, data["mods"])
+		self.MarkDirty()
+
 	def DeleteProfile(self, profileName: str) -> None:
 		self.__config[CONFIG_PROFILES].pop(profileName)
+		if self.__modIndex is not None:
+			self.__modIndex.RemoveProfile(profileName)
 		self.MarkDirty()
 
 	def GetProfile(self, profileName: str) -> TableclothProfile:
-		return self.__config[CONFIG_PROFILES][profileName]
+		profile = self.__config[CONFIG_PROFILES][profileName]
+		if isinstance(profile, dict):
+			profile = TableclothProfile.FromDict(profileName, profile)
+			self.__config[CONFIG_PROFILES][profileName] = profile
+		if isinstance(profile, TableclothProfile):
+			profile.SetObserver(self)
+		return profile
 
 	def GetCurrentProfileName(self) -> str:
 		return self.__config[CONFIG_SETTINGS]["current-profile"]
 
+	def SetCurrentProfileName(self, profileName: str) -> None:
+		self.__config[CONFIG_SETTINGS]["current-profile"] = profileName
+		self.MarkDirty()
+
 	def GetCurrentProfile(self) -> TableclothProfile:
 		if self.__config[CONFIG_SETTINGS]["assume-current-profile"]:
 			return self.GetProfile(self.GetCurrentProfileName())
@@ -342,15 +743,1186 @@ class TableclothConfig:
 		return name
 
 	def ToDict(self) -> dict:
-		config = copy.deepcopy(self.__config)
-		
-		# Convert the profiles to dictionaries for JSON serialization
+		# Convert the profiles to dictionaries for JSON serialization. Profiles
+		# that were never loaded are still dictionaries.
 		profiles = {}
-		for profile, settings in config[CONFIG_PROFILES].items():
-			profiles[profile] = settings.ToDict()
+		for profile, settings in self.__config[CONFIG_PROFILES].items():
+			profiles[profile] = settings if isinstance(settings, dict) else settings.ToDict()
 
+		config = dict(self.__config)
 		config[CONFIG_PROFILES] = profiles
-		return config
+		return copy.deepcopy(config)
+
+# Records exactly what serve-up installed for a profile: the URL, size and
+# hashes of the server jar and of every mod file. Installing from a lock needs
+# no lookups and always puts the same bytes on disk.
+class TableclothLock:
+	LOCK_VERSION = 1
+
+	def __init__(self, data: dict):
+		self.__data = data
+
+	# Creates a lock for the profile, given the server jar that was installed
+	# for it and the files that were prefetched for the Fabric launcher, if any.
+	def FromProfile(profile: TableclothProfile, server: dict, serverFiles: list = None):
+		mods = {}
+		for mod, info in profile.Mods().items():
+			if not info["enabled"]:
+				continue
+			mods[mod] = {
+				"version": info["version"],
+				"project-id": info["modrinth"]["project-id"],
+				"version-id": info["modrinth"]["version-id"],
+				"files": [{
+					"filename": file["filename"],
+					"url": file["url"],
+					"size": file.get("size"),
+					"hashes": file.get("hashes", {}),
+				} for file in info["modrinth"]["files"]],
+			}
+
+		return TableclothLock({
+			"lock-version": TableclothLock.LOCK_VERSION,
+			"profile": profile.Name(),
+			"minecraft": profile.GetMinecraftVersion(),
+			"fabric": {
+				"loader": profile.GetFabricLoaderVersion(),
+				"installer": profile.GetFabricInstallerVersion(),
+			},
+			"server": server,
+			"server-files": serverFiles or [],
+			"mods": mods,
+		})
+
+	def Load(filePath: str = TABLECLOTH_LOCK_PATH):
+		with open(filePath, 'r') as lockFile:
+			data = json.load(lockFile)
+		if data.get("lock-version") != TableclothLock.LOCK_VERSION:
+			raise ValueError("{} has an unsupported lock version ({})".format(filePath, data.get("lock-version")))
+		return TableclothLock(data)
+
+	def Save(self, filePath: str = TABLECLOTH_LOCK_PATH) -> None:
+		tempPath = _tempPath(filePath)
+		with open(tempPath, 'w') as lockFile:
+			json.dump(self.__data, lockFile, indent=4)
+		os.replace(tempPath, filePath)
+
+	def ToDict(self) -> dict:
+		return copy.deepcopy(self.__data)
+
+	def ProfileName(self) -> str:
+		return self.__data["profile"]
+
+	def Server(self) -> dict:
+		return self.__data["server"]
+
+	# The files prefetched for the Fabric launcher: its libraries and the
+	# vanilla server jar. Locks written before they were prefetched have none.
+	def ServerFiles(self) -> list:
+		return self.__data.get("server-files", [])
+
+	def Mods(self) -> dict:
+		return self.__data["mods"]
+
+	# Maps each mod to its list of files, as ModHostService.InstallModFiles
+	# takes them.
+	def ModFiles(self) -> dict:
+		return {mod: info["files"] for mod, info in self.Mods().items()}
+
+	# Every file in the lock (the server jar included), keyed by filename.
+	def Files(self) -> dict:
+		files = {self.Server()["filename"]: self.Server()}
+		for info in self.Mods().values():
+			for file in info["files"]:
+				files[file["filename"]] = file
+		return files
+
+	# Compares this lock to a newer one. Returns the mods that were added,
+	# removed and changed, along with the files the newer lock would need that
+	# this one doesn't already have.
+	def Diff(self, newer) -> dict:
+		oldMods = self.Mods()
+		newMods = newer.Mods()
+		known = set()
+		for file in self.Files().values():
+			known.add(file.get("hashes", {}).get("sha512") or file["url"])
+
+		return {
+			"server-changed": self.Server().get("hashes") != newer.Server().get("hashes") or self.Server()["url"] != newer.Server()["url"],
+			"added": sorted(mod for mod in newMods if not mod in oldMods),
+			"removed": sorted(mod for mod in oldMods if not mod in newMods),
+			"changed": sorted(mod for mod in newMods if mod in oldMods and oldMods[mod]["version-id"] != newMods[mod]["version-id"]),
+			"downloads": [
+				file for file in newer.Files().values()
+				if not (file.get("hashes", {}).get("sha512") or file["url"]) in known
+			],
+		}
+
+# requests takes longer to import than the rest of Tablecloth put together, and
+# most commands never use the network, so it's only imported once it's needed.
+def _requests():
+	import requests
+	import requests.adapters
+	return requests
+
+# Gets a hidden, unique name next to path to write to before renaming the
+# result over path.
+def _tempPath(path: str) -> str:
+	directory, name = os.path.split(path)
+	return os.path.join(directory, ".{}.{}.part".format(name, os.urandom(8).hex()))
+
+# Raised when a file couldn't be downloaded.
+class DownloadError(Exception):
+	pass
+
+# Raised instead of sending a request when Tablecloth is running offline.
+class OfflineError(Exception):
+	pass
+
+# Stands in for a requests.Response for API responses that may have come from
+# the metadata cache.
+class ApiResponse:
+	def __init__(self, statusCode: int, data, fromCache: bool = False):
+		self.status_code = statusCode
+		self.from_cache = fromCache
+		self.__data = data
+
+	def json(self):
+		return self.__data
+
+# Makes sure a rename in the directory survives a crash. Not every platform
+# lets us open a directory, so this is best-effort.
+def _fsyncDirectory(directory: str) -> None:
+	try:
+		fd = os.open(directory, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
+
+# Records where a command's time goes: how long each phase took, every HTTP
+# request (with its latency and how long it waited on the rate limit), every
+# file downloaded (bytes, transfer and disk time), and how often caches
+# answered and requests had to be retried. Nothing is recorded unless --timings
+# or --trace started a trace, so the calls cost nothing otherwise. Times are
+# seconds since the trace started.
+class Trace:
+	TRACE_VERSION = 1
+	__current = None
+
+	def __init__(self, command: list):
+		self.__command = command
+		self.__lock = threading.Lock()
+		self.__startedAt = time.time()
+		self.__start = time.monotonic()
+		self.__phases = []
+		self.__requests = []
+		self.__downloads = []
+		self.__counters = collections.Counter()
+
+	def Start(command: list) -> None:
+		Trace.__current = Trace(command)
+
+	# Gets the trace being recorded, or None.
+	def Current():
+		return Trace.__current
+
+	def __now(self) -> float:
+		return time.monotonic() - self.__start
+
+	@contextlib.contextmanager
+	def __phase(self, name: str):
+		start = self.__now()
+		try:
+			yield
+		finally:
+			with self.__lock:
+				self.__phases.append({
+					"name": name,
+					"start": round(start, 4),
+					"duration": round(self.__now() - start, 4),
+					"thread": threading.current_thread().name,
+				})
+
+	# Times the block as the named phase. Phases may overlap when they run on
+	# different threads.
+	def Phase(name: str):
+		trace = Trace.__current
+		if trace is None:
+			return contextlib.nullcontext()
+		return trace.__phase(name)
+
+	def Request(**fields) -> None:
+		trace = Trace.__current
+		if trace is not None:
+			with trace.__lock:
+				trace.__requests.append(dict(fields, start=round(trace.__now() - fields.get("latency", 0), 4)))
+
+	def Download(**fields) -> None:
+		trace = Trace.__current
+		if trace is not None:
+			with trace.__lock:
+				trace.__downloads.append(dict(fields, end=round(trace.__now(), 4)))
+
+	def Count(name: str, amount = 1) -> None:
+		trace = Trace.__current
+		if trace is not None:
+			with trace.__lock:
+				trace.__counters[name] += amount
+
+	def __percentile(values: list, fraction: float) -> float:
+		values = sorted(values)
+		return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+	def __hitRate(hits: int, total: int):
+		return round(hits / total, 4) if total else None
+
+	def Summary(self) -> dict:
+		with self.__lock:
+			phases = collections.defaultdict(float)
+			for phase in self.__phases:
+				phases[phase["name"]] += phase["duration"]
+			hosts = {}
+			for request in self.__requests:
+				host = hosts.setdefault(request["host"], {"requests": 0, "errors": 0, "latencies": [], "rate-limit-wait": 0.0})
+				host["requests"] += 1
+				host["errors"] += 1 if request.get("error") or request.get("status", 0) >= 400 else 0
+				host["latencies"].append(request["latency"])
+				host["rate-limit-wait"] += request.get("wait", 0)
+			for host in hosts.values():
+				latencies = host.pop("latencies")
+				host["latency-median"] = round(Trace.__percentile(latencies, 0.5), 4)
+				host["latency-p95"] = round(Trace.__percentile(latencies, 0.95), 4)
+				host["rate-limit-wait"] = round(host["rate-limit-wait"], 4)
+			transferred = sum(download["bytes"] for download in self.__downloads)
+			transferTime = sum(download["transfer"] for download in self.__downloads)
+			counters = self.__counters
+			metadataLookups = counters["metadata-cache-fresh"] + counters["metadata-cache-revalidated"] + counters["metadata-cache-miss"]
+			artifactLookups = counters["artifact-cache-hit"] + counters["artifact-cache-miss"]
+			return {
+				"duration": round(self.__now(), 4),
+				"phases": {name: round(duration, 4) for name, duration in phases.items()},
+				"hosts": hosts,
+				"downloads": {
+					"files": len(self.__downloads),
+					"bytes": transferred,
+					"transfer": round(transferTime, 4),
+					"disk": round(sum(download["disk"] for download in self.__downloads), 4),
+					"throughput": round(transferred / transferTime) if transferTime else None,
+				},
+				"metadata-cache-hit-rate": Trace.__hitRate(counters["metadata-cache-fresh"] + counters["metadata-cache-revalidated"], metadataLookups),
+				"artifact-cache-hit-rate": Trace.__hitRate(counters["artifact-cache-hit"], artifactLookups),
+				"counters": dict(counters),
+			}
+
+	def ToDict(self) -> dict:
+		summary = self.Summary()
+		with self.__lock:
+			return {
+				"trace-version": Trace.TRACE_VERSION,
+				"tablecloth-version": TABLECLOTH_VERSION,
+				"command": self.__command,
+				"started": self.__startedAt,
+				"summary": summary,
+				"phases": list(self.__phases),
+				"requests": list(self.__requests),
+				"downloads": list(self.__downloads),
+			}
+
+	def Save(self, path: str) -> None:
+		tempPath = _tempPath(path)
+		with open(tempPath, 'w') as traceFile:
+			json.dump(self.ToDict(), traceFile, indent=2)
+		os.replace(tempPath, path)
+
+	def PrintSummary(self) -> None:
+		summary = self.Summary()
+		counters = collections.Counter(summary["counters"])
+		print("Timings ({:.2f}s in total):".format(summary["duration"]))
+		for name, duration in sorted(summary["phases"].items(), key=lambda phase: -phase[1]):
+			print("  {:<24} {:8.2f}s".format(name, duration))
+		for hostName, host in sorted(summary["hosts"].items()):
+			print("  {}: {} requests, {} failed, median {:.0f} ms, p95 {:.0f} ms, {:.2f}s waiting on the rate limit".format(
+				hostName, host["requests"], host["errors"], host["latency-median"] * 1000, host["latency-p95"] * 1000, host["rate-limit-wait"]))
+		downloads = summary["downloads"]
+		if downloads["files"]:
+			print("  Downloads: {} files, {} in {:.2f}s ({}/s), {:.2f}s writing to disk".format(
+				downloads["files"], FormatSize(downloads["bytes"]), downloads["transfer"], FormatSize(downloads["throughput"] or 0), downloads["disk"]))
+		if summary["metadata-cache-hit-rate"] is not None:
+			print("  Metadata cache: {} fresh, {} revalidated, {} missed ({:.0%} answered)".format(
+				counters["metadata-cache-fresh"], counters["metadata-cache-revalidated"], counters["metadata-cache-miss"], summary["metadata-cache-hit-rate"]))
+		if summary["artifact-cache-hit-rate"] is not None:
+			print("  Artifact cache: {} hits, {} misses ({:.0%}); {} files were already installed".format(
+				counters["artifact-cache-hit"], counters["artifact-cache-miss"], summary["artifact-cache-hit-rate"], counters["already-installed"]))
+		print("  Retries: {} requests, {} downloads ({} resumed)".format(counters["http-retries"], counters["download-retries"], counters["download-resumed"]))
+
+# Keeps requests to one host within the rate limit it reports through its
+# X-Ratelimit-Limit, X-Ratelimit-Remaining and X-Ratelimit-Reset headers, as
+# Modrinth does. Until the host says otherwise, requests go out as fast as
+# they're made. As the budget runs low they're paced over what's left of the
+# window, and once it's gone (or the host answers 429) they wait for the
+# reset. Waiting API calls go before waiting downloads.
+class RateLimiter:
+	__limiters = {}
+	__limitersLock = threading.Lock()
+
+	def __init__(self):
+		self.__condition = threading.Condition()
+		self.__limit = None
+		self.__remaining = None
+		self.__resetAt = 0.0
+		self.__nextSlot = 0.0
+		self.__inFlight = 0
+		self.__waiting = collections.Counter()
+
+	# Gets the limiter for the url's host.
+	def For(url: str):
+		import urllib.parse
+		host = urllib.parse.urlsplit(url).netloc
+		with RateLimiter.__limitersLock:
+			if not host in RateLimiter.__limiters:
+				RateLimiter.__limiters[host] = RateLimiter()
+			return RateLimiter.__limiters[host]
+
+	# How long a request of the given priority has to wait before it can go
+	# out. Only called with the condition held.
+	def __delay(self, priority: int, now: float) -> float:
+		if any(self.__waiting[other] for other in range(priority)):
+			# Something more important is waiting; it's woken up first.
+			return HTTP_BACKOFF_BASE
+		if self.__remaining is None:
+			return 0
+		if now >= self.__resetAt:
+			# The window has passed, so the budget is whatever the host says next.
+			self.__remaining = None
+			return 0
+		reserve = 0 if priority == HTTP_PRIORITY_METADATA else HTTP_RATELIMIT_RESERVE
+		if self.__remaining <= reserve:
+			return self.__resetAt - now
+		return max(0, self.__nextSlot - now)
+
+	# Waits until a request of the given priority may be sent.
+	def Acquire(self, priority: int = HTTP_PRIORITY_METADATA) -> None:
+		with self.__condition:
+			self.__waiting[priority] += 1
+			try:
+				while True:
+					now = time.monotonic()
+					delay = self.__delay(priority, now)
+					if delay <= 0:
+						break
+					self.__condition.wait(delay)
+			finally:
+				self.__waiting[priority] -= 1
+
+			self.__inFlight += 1
+			if self.__remaining is not None:
+				self.__remaining -= 1
+				if self.__limit and self.__remaining < self.__limit * HTTP_RATELIMIT_PACE_BELOW:
+					self.__nextSlot = max(now, self.__nextSlot) + (self.__resetAt - now) / max(1, self.__remaining)
+			self.__condition.notify_all()
+
+	# Takes what the host said about its rate limit from the response to a
+	# request let through by Acquire. response is None if the request failed.
+	def Release(self, response) -> None:
+		with self.__condition:
+			self.__inFlight -= 1
+			if response is not None:
+				self.__update(response)
+			self.__condition.notify_all()
+
+	def __header(self, response, name: str):
+		try:
+			return float(response.headers[name])
+		except (KeyError, ValueError):
+			return None
+
+	def __update(self, response) -> None:
+		now = time.monotonic()
+		limit = self.__header(response, "X-Ratelimit-Limit")
+		remaining = self.__header(response, "X-Ratelimit-Remaining")
+		reset = self.__header(response, "X-Ratelimit-Reset")
+		if response.status_code == 429:
+			wait = self.__header(response, "Retry-After") or reset or HTTP_RATELIMIT_DEFAULT_WAIT
+			self.__remaining = 0
+			self.__resetAt = max(self.__resetAt, now + wait)
+			return
+		if remaining is None or reset is None:
+			return
+		if limit is not None:
+			self.__limit = limit
+		# Requests still out were already taken from the budget here but may
+		# not have been counted by the host yet.
+		self.__remaining = max(0, remaining - self.__inFlight)
+		self.__resetAt = now + reset
+
+# The one HTTP session all of Tablecloth's traffic goes through. Connections
+# are kept alive and reused, every request has a timeout, and requests that fail
+# in ways that are likely temporary are retried with jittered exponential
+# backoff.
+class HttpClient:
+	__shared = None
+	__sharedLock = threading.Lock()
+	__metadataCache = None
+	__offline = False
+
+	def __init__(self, retries: int = HTTP_RETRIES, timeout: tuple = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+		self.__retries = retries
+		self.__timeout = timeout
+		self.__session = _requests().Session()
+		self.__session.headers["User-Agent"] = HTTP_USER_AGENT
+		# Retries are handled here rather than by the adapter so they can be
+		# jittered the same way for every kind of failure.
+		adapter = _requests().adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+		self.__session.mount("https://", adapter)
+		self.__session.mount("http://", adapter)
+
+	# Sets up how every client answers API requests: from which metadata cache
+	# (if any), and whether it may use the network at all.
+	def Configure(metadataCache = None, offline: bool = False) -> None:
+		HttpClient.__metadataCache = metadataCache
+		HttpClient.__offline = offline
+
+	def IsOffline() -> bool:
+		return HttpClient.__offline
+
+	# Gets the client shared by the whole process.
+	def Shared():
+		with HttpClient.__sharedLock:
+			if HttpClient.__shared is None:
+				HttpClient.__shared = HttpClient()
+			return HttpClient.__shared
+
+	def __backoff(self, attempt: int) -> None:
+		import random
+		time.sleep(random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt)))
+
+	# Sends a GET request once the host's rate limit allows it. Connection
+	# errors, timeouts, 5xx responses and 429s are retried; if they keep
+	# happening, the last error is raised or the last response returned.
+	def Get(self, url: str, params: dict = None, headers: dict = None, stream: bool = False, priority: int = HTTP_PRIORITY_METADATA) -> "requests.Response":
+		if HttpClient.__offline:
+			raise OfflineError("Can't get {} while offline".format(url))
+		import urllib.parse
+		limiter = RateLimiter.For(url)
+		host = urllib.parse.urlsplit(url).netloc
+		attempt = 0
+		while True:
+			waitStart = time.monotonic()
+			limiter.Acquire(priority)
+			sent = time.monotonic()
+			try:
+				response = self.__session.get(url, params=params, headers=headers, stream=stream, timeout=self.__timeout)
+			except (_requests().ConnectionError, _requests().Timeout) as e:
+				limiter.Release(None)
+				Trace.Request(url=url, host=host, attempt=attempt, error=type(e).__name__, latency=round(time.monotonic() - sent, 4), wait=round(sent - waitStart, 4))
+				if attempt >= self.__retries:
+					raise
+			else:
+				limiter.Release(response)
+				# For a streamed response, this is only the time to the headers.
+				Trace.Request(url=url, host=host, attempt=attempt, status=response.status_code, latency=round(time.monotonic() - sent, 4), wait=round(sent - waitStart, 4),
+					bytes=None if stream else len(response.content))
+				if response.status_code == 429 and attempt < self.__retries:
+					# The limiter holds the next request back until the reset.
+					response.close()
+					attempt += 1
+					Trace.Count("http-retries")
+					continue
+				if not response.status_code in HTTP_RETRY_STATUSES or attempt >= self.__retries:
+					return response
+				response.close()
+			self.__backoff(attempt)
+			attempt += 1
+			Trace.Count("http-retries")
+
+	# Gets a JSON API response, answering from the metadata cache when it has a
+	# fresh copy. Stale copies are revalidated with the ETag or Last-Modified
+	# the host sent, so an unchanged response isn't sent again. When offline,
+	# any cached copy is used, however old.
+	def GetJson(self, url: str, params: dict = None) -> ApiResponse:
+		cache = HttpClient.__metadataCache
+		entry = cache.Get(url, params) if cache is not None else None
+		if entry is not None and (HttpClient.__offline or cache.IsFresh(entry)):
+			Trace.Count("metadata-cache-fresh")
+			return ApiResponse(200, entry["body"], True)
+		if HttpClient.__offline:
+			raise OfflineError("{} isn't in the metadata cache, and Tablecloth is offline".format(url))
+
+		headers = {}
+		if entry is not None and entry.get("etag"):
+			headers["If-None-Match"] = entry["etag"]
+		if entry is not None and entry.get("last-modified"):
+			headers["If-Modified-Since"] = entry["last-modified"]
+
+		with self.Get(url, params = params, headers = headers) as response:
+			if response.status_code == 304 and entry is not None:
+				Trace.Count("metadata-cache-revalidated")
+				cache.Put(url, params, entry["body"], entry.get("etag"), entry.get("last-modified"))
+				return ApiResponse(200, entry["body"], True)
+			if cache is not None:
+				Trace.Count("metadata-cache-miss")
+			if not response.status_code == 200:
+				return ApiResponse(response.status_code, None)
+			data = response.json()
+			if cache is not None:
+				cache.Put(url, params, data, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+			return ApiResponse(200, data)
+
+# Raised when a downloaded file isn't the file it was expected to be.
+class IntegrityError(DownloadError):
+	pass
+
+# Where an unfinished download of destination is kept between attempts (and
+# between runs), along with the sidecar that says where it came from. Both are
+# hidden, so the server never mistakes them for a jar.
+def _partialPaths(destination: str) -> tuple:
+	directory, name = os.path.split(destination)
+	partial = os.path.join(directory, ".{}.partial".format(name))
+	return partial, partial + ".json"
+
+def _discardPartial(destination: str) -> None:
+	for path in _partialPaths(destination):
+		with contextlib.suppress(FileNotFoundError):
+			os.remove(path)
+
+def _partialSize(destination: str) -> int:
+	try:
+		return os.path.getsize(_partialPaths(destination)[0])
+	except OSError:
+		return 0
+
+# Finds how much of the url was already downloaded to destination, and the
+# ETag or Last-Modified it was downloaded under. A partial file can only be
+# picked up again if it came from the same url and something can tell whether
+# the rest still belongs to it: a validator the host gave, or the hashes the
+# finished file must have. Anything else is thrown away.
+def _loadPartial(url: str, destination: str, hashes: dict) -> tuple:
+	partial, sidecar = _partialPaths(destination)
+	try:
+		with open(sidecar, 'r') as sidecarFile:
+			state = json.load(sidecarFile)
+		offset = os.path.getsize(partial)
+	except (OSError, ValueError):
+		_discardPartial(destination)
+		return 0, None
+	if state.get("url") != url or not (state.get("etag") or state.get("last-modified") or hashes):
+		_discardPartial(destination)
+		return 0, None
+	return offset, state
+
+# Yields the response's body as it arrives. iter_content waits for each chunk
+# to fill, and a connection that breaks off partway through one takes what
+# arrived of it along; reading whatever has arrived instead means every byte
+# received can be kept for resuming.
+def _iterReceived(response):
+	raw = response.raw
+	if not hasattr(raw, "read1"):
+		# Older urllib3.
+		yield from response.iter_content(DOWNLOAD_CHUNK_SIZE)
+		return
+	import urllib3
+	while True:
+		try:
+			chunk = raw.read1(DOWNLOAD_CHUNK_SIZE, decode_content=True)
+		except urllib3.exceptions.ReadTimeoutError as e:
+			raise _requests().ConnectionError(e)
+		except (urllib3.exceptions.ProtocolError, urllib3.exceptions.DecodeError) as e:
+			raise _requests().exceptions.ChunkedEncodingError(e)
+		if not chunk:
+			return
+		yield chunk
+
+# Makes one attempt at DownloadFile.
+def _downloadOnce(url: str, destination: str, hashes: dict, size: int) -> dict:
+	import hashlib
+	directory = os.path.dirname(destination) or "."
+	partial, sidecar = _partialPaths(destination)
+	digests = {algorithm: hashlib.new(algorithm) for algorithm in set(ArtifactCache.HASH_ALGORITHMS) | set(hashes)}
+
+	offset, state = _loadPartial(url, destination, hashes)
+	headers = None
+	if offset:
+		headers = {"Range": "bytes={}-".format(offset)}
+		# If-Range makes the host send the whole file instead if it changed.
+		validator = state.get("etag") or state.get("last-modified")
+		if validator:
+			headers["If-Range"] = validator
+
+	requested = time.monotonic()
+	with HttpClient.Shared().Get(url, headers=headers, stream=True, priority=HTTP_PRIORITY_DOWNLOAD) as response:
+		firstByte = time.monotonic() - requested
+		if response.status_code == 206 and offset:
+			if not response.headers.get("Content-Range", "").startswith("bytes {}-".format(offset)):
+				_discardPartial(destination)
+				raise IntegrityError("the host sent the wrong part of the file")
+			# The bytes already on disk still have to go through the hashes.
+			with open(partial, 'rb') as partialFile:
+				for chunk in iter(lambda: partialFile.read(DOWNLOAD_CHUNK_SIZE), b""):
+					for digest in digests.values():
+						digest.update(chunk)
+			print("Resuming {} from {}".format(os.path.basename(destination), FormatSize(offset)))
+			Trace.Count("download-resumed")
+			mode = 'ab'
+		elif response.status_code == 200:
+			offset = 0
+			mode = 'wb'
+			etag = response.headers.get("ETag")
+			with open(sidecar, 'w') as sidecarFile:
+				json.dump({
+					"url": url,
+					# Weak ETags can't be used to resume.
+					"etag": etag if etag and not etag.startswith("W/") else None,
+					"last-modified": response.headers.get("Last-Modified"),
+				}, sidecarFile)
+		else:
+			if response.status_code == 416:
+				# What's on disk can't be the start of this file.
+				_discardPartial(destination)
+			raise DownloadError("HTTP {}".format(response.status_code))
+
+		# If the transfer breaks off, what arrived stays in the partial file for
+		# the next attempt.
+		received = offset
+		transferStart = time.monotonic()
+		disk = 0.0
+		with open(partial, mode) as partialFile:
+			for chunk in _iterReceived(response):
+				writeStart = time.monotonic()
+				partialFile.write(chunk)
+				disk += time.monotonic() - writeStart
+				for digest in digests.values():
+					digest.update(chunk)
+				received += len(chunk)
+			writeStart = time.monotonic()
+			partialFile.flush()
+			os.fsync(partialFile.fileno())
+			disk += time.monotonic() - writeStart
+		transfer = time.monotonic() - transferStart
+		Trace.Download(url=url, filename=os.path.basename(destination), status=response.status_code, offset=offset, bytes=received - offset,
+			latency=round(firstByte, 4), transfer=round(transfer, 4), disk=round(disk, 4),
+			throughput=round((received - offset) / transfer) if transfer else None)
+
+	actual = {algorithm: digest.hexdigest() for algorithm, digest in digests.items()}
+	try:
+		if size is not None and received != size:
+			raise IntegrityError("expected {} bytes but got {}".format(size, received))
+		for algorithm, digest in hashes.items():
+			if actual[algorithm] != digest.lower():
+				raise IntegrityError("the {} hash doesn't match".format(algorithm))
+	except IntegrityError:
+		_discardPartial(destination)
+		raise
+	os.replace(partial, destination)
+	with contextlib.suppress(FileNotFoundError):
+		os.remove(sidecar)
+
+	_fsyncDirectory(directory)
+	return {"size": received, "hashes": actual}
+
+# Streams the file at the url to the destination. The data goes to a hidden
+# partial file in the same directory, which is only renamed once it's
+# complete and flushed to disk. An interrupted download will never leave a
+# partial file under the destination's name.
+#
+# When a transfer breaks off, what arrived is kept and the next attempt (or
+# the next run) asks the host for the rest with a Range request. The file is
+# hashed as it arrives, so checking it against the expected hashes and size
+# (if given) doesn't take another read of anything but the resumed part. A
+# file that doesn't match is thrown away and downloaded again from the start.
+# Attempts only run out when they stop making progress. Returns the size and
+# hashes of what was downloaded.
+def DownloadFile(url: str, destination: str, hashes: dict = None, size: int = None) -> dict:
+	attempt = 1
+	while True:
+		before = _partialSize(destination)
+		try:
+			return _downloadOnce(url, destination, hashes or {}, size)
+		except OfflineError:
+			raise
+		except (IntegrityError, _requests().ConnectionError, _requests().exceptions.ChunkedEncodingError) as e:
+			if _partialSize(destination) > before:
+				attempt = 1
+			elif attempt >= DOWNLOAD_ATTEMPTS:
+				raise
+			else:
+				attempt += 1
+			Trace.Count("download-retries")
+			print("Downloading {} again: {}".format(os.path.basename(destination), e))
+
+# Copies source to destination through a temporary file, so the destination
+# either doesn't exist or is complete.
+def _copyFileAtomic(source: str, destination: str) -> None:
+	directory = os.path.dirname(destination) or "."
+	tempPath = _tempPath(destination)
+	try:
+		shutil.copyfile(source, tempPath)
+		with open(tempPath, 'rb+') as tempFile:
+			os.fsync(tempFile.fileno())
+		os.replace(tempPath, destination)
+	except BaseException:
+		if os.path.exists(tempPath):
+			os.remove(tempPath)
+		raise
+	# Makes the rename itself survive a crash.
+	_fsyncDirectory(directory)
+
+# Hashes the file at path with the given algorithm.
+def _hashFile(path: str, algorithm: str) -> str:
+	import hashlib
+	digest = hashlib.new(algorithm)
+	with open(path, 'rb') as file:
+		for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+# Hashes the file at path with each of the algorithms in one pass.
+def _hashFileAll(path: str, algorithms: list) -> dict:
+	import hashlib
+	digests = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+	with open(path, 'rb') as file:
+		for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+			for digest in digests.values():
+				digest.update(chunk)
+	return {algorithm: digest.hexdigest() for algorithm, digest in digests.items()}
+
+# Determines if the file at path has the hashes it's expected to have.
+def _verifyFile(path: str, hashes: dict) -> bool:
+	if not hashes:
+		return True
+	actual = _hashFileAll(path, list(hashes.keys()))
+	return all(actual[algorithm] == digest.lower() for algorithm, digest in hashes.items())
+
+# Converts sizes such as 512M or 4G to bytes.
+def ParseSize(size) -> int:
+	if isinstance(size, int):
+		return size
+	units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+	size = str(size).strip().upper().rstrip("B")
+	if size and size[-1] in units:
+		return int(float(size[:-1]) * units[size[-1]])
+	return int(size)
+
+# Converts a number of bytes to something easier to read.
+def FormatSize(size: int) -> str:
+	for unit in ["B", "KiB", "MiB", "GiB"]:
+		if size < 1024:
+			return "{:.1f} {}".format(size, unit) if unit != "B" else "{} B".format(size)
+		size /= 1024
+	return "{:.1f} TiB".format(size)
+
+# Holds an exclusive lock on the file at path for the duration of the block.
+@contextlib.contextmanager
+def _lockFile(path: str):
+	with open(path, 'a') as lockFile:
+		if fcntl is not None:
+			fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			if fcntl is not None:
+				fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+
+# A content-addressed store of downloaded files, shared by every profile and
+# server directory on the host. Files are keyed by the hashes Modrinth reports
+# for them. Every write goes through a rename, so several Tablecloth processes
+# can use the cache at once; only eviction needs to take the lock.
+class ArtifactCache:
+	# The order in which hashes are used as keys, strongest first.
+	HASH_ALGORITHMS = ["sha512", "sha1"]
+
+	def __init__(self, root: str, maxSize: int):
+		self.__root = root
+		self.__maxSize = maxSize
+
+	def DefaultRoot() -> str:
+		base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+		return os.path.join(base, "tablecloth")
+
+	# Creates the cache described by the config, or None if it's disabled.
+	def FromConfig(config: TableclothConfig):
+		settings = config.GetCacheSettings()
+		if not settings["enabled"]:
+			return None
+		return ArtifactCache(settings["path"] or ArtifactCache.DefaultRoot(), ParseSize(settings["max-size"]))
+
+	def Root(self) -> str:
+		return self.__root
+
+	def MaxSize(self) -> int:
+		return self.__maxSize
+
+	def __artifactRoot(self) -> str:
+		return os.path.join(self.__root, "artifacts")
+
+	def __entryPath(self, algorithm: str, digest: str) -> str:
+		return os.path.join(self.__artifactRoot(), algorithm, digest[:2], digest)
+
+	# Picks the hash used to key a file, or (None, None) if there isn't one.
+	def __key(self, hashes: dict):
+		for algorithm in ArtifactCache.HASH_ALGORITHMS:
+			if hashes.get(algorithm):
+				return algorithm, hashes[algorithm].lower()
+		return None, None
+
+	# Gets the path of the cached file matching the hashes, or None if it isn't
+	# cached. The file may be evicted at any time, so be ready for it to vanish.
+	def Path(self, hashes: dict):
+		algorithm, digest = self.__key(hashes)
+		if algorithm is None:
+			return None
+		entry = self.__entryPath(algorithm, digest)
+		return entry if os.path.exists(entry) else None
+
+	# Copies the cached file matching the hashes to the destination. Returns
+	# whether the file was found.
+	def Fetch(self, hashes: dict, destination: str) -> bool:
+		algorithm, digest = self.__key(hashes)
+		if algorithm is None:
+			return False
+		entry = self.__entryPath(algorithm, digest)
+		try:
+			_copyFileAtomic(entry, destination)
+		except FileNotFoundError:
+			# Either it was never cached or it was evicted while we looked.
+			return False
+		# The modification time is what eviction uses to tell how recently a
+		# file was used.
+		with contextlib.suppress(OSError):
+			os.utime(entry)
+		return True
+
+	# Adds the file at path to the cache. The file is only stored if it really
+	# has the hash it's keyed by, which is taken from actualHashes when the
+	# caller already knows them. Returns whether it was stored.
+	def Store(self, path: str, hashes: dict, actualHashes: dict = None) -> bool:
+		algorithm, digest = self.__key(hashes)
+		if algorithm is None:
+			return False
+		actual = (actualHashes or {}).get(algorithm) or _hashFile(path, algorithm)
+		if actual != digest:
+			return False
+		entry = self.__entryPath(algorithm, digest)
+		if os.path.exists(entry):
+			with contextlib.suppress(OSError):
+				os.utime(entry)
+			return True
+		os.makedirs(os.path.dirname(entry), exist_ok=True)
+		_copyFileAtomic(path, entry)
+		return True
+
+	# Lists (path, size, last used) for every file in the cache.
+	def Entries(self) -> list:
+		entries = []
+		for directory, _, files in os.walk(self.__artifactRoot()):
+			for name in files:
+				# Skip copies that are still being written.
+				if name.startswith("."):
+					continue
+				path = os.path.join(directory, name)
+				try:
+					stat = os.stat(path)
+				except FileNotFoundError:
+					continue
+				entries.append((path, stat.st_size, stat.st_mtime))
+		return entries
+
+	def Stats(self) -> dict:
+		entries = self.Entries()
+		return {
+			"path": self.__root,
+			"entries": len(entries),
+			"size": sum(size for _, size, _ in entries),
+			"max-size": self.__maxSize,
+			"oldest": min((used for _, _, used in entries), default=None),
+			"newest": max((used for _, _, used in entries), default=None),
+		}
+
+	# Evicts the least recently used files until the cache fits in maxSize
+	# (the configured cap if not given). Returns the number of files and bytes
+	# removed.
+	def Prune(self, maxSize: int = None) -> tuple:
+		if maxSize is None:
+			maxSize = self.__maxSize
+		if not os.path.exists(self.__artifactRoot()):
+			return 0, 0
+
+		removedFiles = 0
+		removedBytes = 0
+		with _lockFile(os.path.join(self.__root, "prune.lock")):
+			entries = sorted(self.Entries(), key=lambda entry: entry[2])
+			total = sum(size for _, size, _ in entries)
+			for path, size, _ in entries:
+				if total <= maxSize:
+					break
+				with contextlib.suppress(FileNotFoundError):
+					os.remove(path)
+					removedFiles += 1
+					removedBytes += size
+				total -= size
+		return removedFiles, removedBytes
+
+# Keeps API responses on disk, keyed by their URL and query, so repeated
+# lookups don't need the network. Each response remembers when it was fetched
+# and the validators the host sent with it.
+class MetadataCache:
+	def __init__(self, root: str, ttl: int):
+		self.__root = os.path.join(root, "metadata")
+		self.__ttl = ttl
+
+	# Creates the cache described by the config, or None if it's disabled.
+	def FromConfig(config: TableclothConfig):
+		settings = config.GetCacheSettings()
+		if not settings["enabled"]:
+			return None
+		return MetadataCache(settings["path"] or ArtifactCache.DefaultRoot(), int(settings["metadata-ttl"]))
+
+	def __entryPath(self, url: str, params: dict) -> str:
+		import hashlib
+		key = json.dumps([url, sorted((params or {}).items())])
+		return os.path.join(self.__root, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+	# Gets the cached response for the request, or None if there isn't one.
+	def Get(self, url: str, params: dict):
+		try:
+			with open(self.__entryPath(url, params), 'r') as entryFile:
+				return json.load(entryFile)
+		except (OSError, ValueError):
+			return None
+
+	def IsFresh(self, entry: dict) -> bool:
+		return time.time() - entry["fetched"] < self.__ttl
+
+	# Stores (or refreshes) the response to the request.
+	def Put(self, url: str, params: dict, body, etag: str = None, lastModified: str = None) -> None:
+		path = self.__entryPath(url, params)
+		tempPath = _tempPath(path)
+		try:
+			os.makedirs(self.__root, exist_ok=True)
+			with open(tempPath, 'w') as entryFile:
+				json.dump({
+					"url": url,
+					"params": params,
+					"fetched": time.time(),
+					"etag": etag,
+					"last-modified": lastModified,
+					"body": body,
+				}, entryFile)
+			os.replace(tempPath, path)
+		except OSError as e:
+			# Not being able to cache a response shouldn't stop anything.
+			print("Couldn't cache the response from {}: {}".format(url, e))
+			if os.path.exists(tempPath):
+				os.remove(tempPath)
+
+	def Stats(self) -> dict:
+		entries = 0
+		size = 0
+		if os.path.exists(self.__root):
+			with os.scandir(self.__root) as scan:
+				for entry in scan:
+					if entry.name.endswith(".json"):
+						entries += 1
+						size += entry.stat().st_size
+		return {"entries": entries, "size": size, "ttl": self.__ttl}
+
+	# Removes every cached response. Returns how many were removed.
+	def Clear(self) -> int:
+		removed = 0
+		if os.path.exists(self.__root):
+			with os.scandir(self.__root) as scan:
+				for entry in scan:
+					with contextlib.suppress(FileNotFoundError):
+						os.remove(entry.path)
+						removed += 1
+		return removed
+
+# Records what serve-up has installed, along with each file's size and
+# modification time when it was installed. If neither has changed since, the
+# file is still what was installed and doesn't need to be hashed again.
+# Paths given to the manifest are relative to root, the server directory it
+# belongs to, and that's how they're recorded.
+class InstallManifest:
+	def __init__(self, path: str = INSTALL_MANIFEST_PATH, validateHashes: bool = True, validateSize: bool = True, root: str = "."):
+		self.__root = root
+		self.__path = os.path.join(root, path)
+		self.__validateHashes = validateHashes
+		self.__validateSize = validateSize
+		self.__lock = threading.Lock()
+		self.__isDirty = False
+		self.__files = {}
+		if os.path.exists(self.__path):
+			try:
+				with open(self.__path, 'r') as manifestFile:
+					self.__files = json.load(manifestFile).get("files", {})
+			except (OSError, ValueError):
+				# A broken manifest just means everything gets checked again.
+				print("Couldn't read {}; all installed files will be checked again".format(self.__path))
+
+	def FromConfig(config: TableclothConfig, path: str = INSTALL_MANIFEST_PATH, root: str = "."):
+		validation = config.GetValidationSettings()
+		return InstallManifest(path, validation["hashes"], validation["size"], root)
+
+	def __fullPath(self, path: str) -> str:
+		return os.path.join(self.__root, path)
+
+	def IsDirty(self) -> bool:
+		return self.__isDirty
+
+	def Save(self) -> None:
+		if not self.__isDirty:
+			return
+		os.makedirs(os.path.dirname(self.__path) or ".", exist_ok=True)
+		tempPath = _tempPath(self.__path)
+		with self.__lock:
+			with open(tempPath, 'w') as manifestFile:
+				json.dump({"files": self.__files}, manifestFile, indent=1)
+			os.replace(tempPath, self.__path)
+			self.__isDirty = False
+
+	# Determines if the file at path is already the file described by expected,
+	# which may have a url, hashes and size. Files the manifest doesn't know
+	# about (or that changed since) are checked against the expected hashes and
+	# size, as far as the validation settings allow.
+	def IsCurrent(self, path: str, expected: dict) -> bool:
+		try:
+			stat = os.stat(self.__fullPath(path))
+		except FileNotFoundError:
+			return False
+
+		expectedHashes = expected.get("hashes", {})
+		with self.__lock:
+			entry = self.__files.get(path)
+		if (entry is not None and
+				entry["size"] == stat.st_size and
+				entry["mtime"] == stat.st_mtime_ns and
+				entry.get("url") == expected.get("url") and
+				all(entry["hashes"].get(algorithm) == digest for algorithm, digest in expectedHashes.items())):
+			return True
+
+		# The manifest can't vouch for the file, so check it the slow way.
+		checked = False
+		if self.__validateSize and expected.get("size") is not None:
+			if stat.st_size != expected["size"]:
+				return False
+			checked = True
+		if self.__validateHashes and expectedHashes:
+			algorithm = "sha512" if "sha512" in expectedHashes else next(iter(expectedHashes))
+			if _hashFile(self.__fullPath(path), algorithm) != expectedHashes[algorithm].lower():
+				return False
+			checked = True
+		if not checked:
+			return False
+
+		self.Record(path, expected)
+		return True
+
+	# Remembers that the file described by source was installed at path. The
+	# mods that use it stay the same until Reference says otherwise.
+	def Record(self, path: str, source: dict) -> None:
+		stat = os.stat(self.__fullPath(path))
+		with self.__lock:
+			old = self.__files.get(path)
+			self.__files[path] = {
+				"url": source.get("url"),
+				"size": stat.st_size,
+				"mtime": stat.st_mtime_ns,
+				"hashes": dict(source.get("hashes", {})),
+			}
+			if old is not None and "used-by" in old:
+				self.__files[path]["used-by"] = old["used-by"]
+			self.__isDirty = True
+
+	# Gets the hashes recorded for the file at path, if any.
+	def GetHashes(self, path: str) -> dict:
+		with self.__lock:
+			entry = self.__files.get(path)
+		return dict(entry["hashes"]) if entry is not None and entry["hashes"] else None
+
+	def Forget(self, path: str) -> None:
+		with self.__lock:
+			if self.__files.pop(path, None) is not None:
+				self.__isDirty = True
+
+	# Deletes the files at paths and forgets them.
+	def Remove(self, paths: list) -> None:
+		for path in paths:
+			with contextlib.suppress(FileNotFoundError):
+				os.remove(self.__fullPath(path))
+			self.Forget(path)
+
+	# Records which of the profile's mods use each file in mods/, given
+	# modFiles, which maps each mod to its files. A directory only holds one
+	# profile's mods at a time, so every other reference is dropped, and files
+	# no mod uses any more are left with none.
+	def Reference(self, profileName: str, modFiles: dict) -> None:
+		usedBy = {}
+		for mod, files in modFiles.items():
+			for file in files:
+				usedBy.setdefault("mods/" + file["filename"], set()).add(mod)
+		with self.__lock:
+			for path, entry in self.__files.items():
+				if not path.startswith("mods/"):
+					continue
+				references = {profileName: sorted(usedBy[path])} if path in usedBy else {}
+				if entry.get("used-by") != references:
+					entry["used-by"] = references
+					self.__isDirty = True
+
+	# Drops the references the profile's mod has to its files, except the
+	# files in keep, without touching the disk. Returns the files that no mod
+	# uses any more.
+	def Unreference(self, profileName: str, modName: str, keep: set = frozenset()) -> list:
+		orphaned = []
+		with self.__lock:
+			for path, entry in self.__files.items():
+				mods = entry.get("used-by", {}).get(profileName)
+				if path in keep or not mods or not modName in mods:
+					continue
+				mods.remove(modName)
+				if not mods:
+					entry["used-by"].pop(profileName)
+				if not entry["used-by"]:
+					orphaned.append(path)
+				self.__isDirty = True
+		return orphaned
+
+	# Finds the files in directory that were installed by Tablecloth but that
+	# no mod uses any more, with one pass over the directory. Files the
+	# manifest doesn't know about, and files recorded before it kept track of
+	# which mods use them, aren't counted as orphans. Returns the orphans and
+	# the files the manifest doesn't know about.
+	def FindOrphans(self, directory: str = "mods") -> tuple:
+		try:
+			with os.scandir(self.__fullPath(directory)) as entries:
+				# Hidden files are downloads in progress.
+				present = set(directory + "/" + entry.name for entry in entries if entry.is_file() and not entry.name.startswith("."))
+		except FileNotFoundError:
+			return [], []
+		with self.__lock:
+			tracked = set(self.__files)
+			referenced = set(path for path, entry in self.__files.items() if entry.get("used-by", True))
+		return sorted((present & tracked) - referenced), sorted(present - tracked)
+
+# Opens the install manifest of every directory mods are installed into: the
+# server directory (unless mods/ is a link to a materialized profile, which
+# has a manifest of its own) and each materialized profile, or just
+# profileName's. Returns a list of (directory, manifest).
+def _openInstallManifests(config: TableclothConfig, profileName: str = None, root: str = ".") -> list:
+	manifests = []
+	if not os.path.islink(os.path.join(root, "mods")):
+		manifests.append((root, InstallManifest.FromConfig(config, root=root)))
+	profilesDirectory = os.path.join(root, TABLECLOTH_STATE_DIR, "profiles")
+	if os.path.isdir(profilesDirectory):
+		with os.scandir(profilesDirectory) as entries:
+			for entry in sorted(entries, key=lambda entry: entry.name):
+				if entry.is_dir() and (profileName is None or entry.name == profileName):
+					manifests.append((entry.path, InstallManifest.FromConfig(config, "installed.json", entry.path)))
+	return manifests
 
 # Base class to support other mod hosts down the line.
 class ModHostService:
@@ -359,28 +1931,159 @@ class ModHostService:
 
 	def GetApiUrl(self):
 		return self.__apiBase
+
+	# The HTTP client host services send their requests through.
+	def Http(self) -> HttpClient:
+		return HttpClient.Shared()
 	
+	# Responsible for getting all the information needed to download many mods
+	# at once. modVersions maps each mod's name to the version wanted. Returns
+	# a dict mapping each mod's name to its info, or None if it couldn't be
+	# found.
+	def ResolveMods(self, gameVersion: str, modVersions: dict) -> dict:
+		pass
+
 	# Responsible for getting all the information needed to download the mod.
 	def GetHostModInfo(self, gameVersion: str, modName: str, modVersion: str):
+		return self.ResolveMods(gameVersion, {modName: modVersion}).get(modName)
+
+	# Installs a single file for a mod, unless the manifest shows it's already
+	# installed. Returns how the file was installed ("current", "cached" or
+	# "downloaded") and, if that failed, a short description of what went wrong.
+	def __downloadModFile(self, mod: str, file: dict, cache: ArtifactCache, manifest, verifyHashes: bool, verifySize: bool, root: str):
+		path = "mods/" + file["filename"]
+		if manifest is not None and manifest.IsCurrent(path, file):
+			Trace.Count("already-installed")
+			return "current", None
+
+		fullPath = os.path.join(root, path)
+		hashes = file.get("hashes", {})
+		if cache is not None and cache.Fetch(hashes, fullPath):
+			print("Copied mod file from the cache to " + fullPath)
+			Trace.Count("artifact-cache-hit")
+			status = "cached"
+		else:
+			if cache is not None:
+				Trace.Count("artifact-cache-miss")
+			try:
+				downloaded = DownloadFile(
+					file["url"],
+					fullPath,
+					hashes if verifyHashes else None,
+					file.get("size") if verifySize else None
+				)
+			except (_requests().RequestException, OfflineError, DownloadError, OSError) as e:
+				return None, "{} ({})".format(file["filename"], e)
+			print("Downloaded mod file to " + fullPath)
+			status = "downloaded"
+
+			if cache is not None:
+				try:
+					if not cache.Store(fullPath, hashes, downloaded["hashes"]):
+						print("Not caching {}: it doesn't match the hash Modrinth reported".format(fullPath))
+				except OSError as e:
+					print("Couldn't add {} to the cache: {}".format(fullPath, e))
+
+		if manifest is not None:
+			manifest.Record(path, file)
+		return status, None
+
+	# Installs the files in modFiles, which maps each mod to a list of files
+	# (each with a url, filename, and ideally hashes and size), using up to
+	# `jobs` workers. Files the manifest shows are already installed are
+	# skipped, and files in the cache are taken from it. If verifyHashes or
+	# verifySize are set, downloaded files must match their hashes or size, or
+	# they're downloaded again. Files go in the mods folder under root. Returns
+	# a dict mapping each failed mod to a list of failures.
+	def InstallModFiles(self, modFiles: dict, jobs: int = DEFAULT_DOWNLOAD_JOBS, cache: ArtifactCache = None, manifest = None, verifyHashes: bool = True, verifySize: bool = True, root: str = ".") -> dict:
+		import concurrent.futures
+		failures = {}
+		statuses = collections.Counter()
+		with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+			pending = {}
+			for mod, files in modFiles.items():
+				failures[mod] = []
+				for file in files:
+					pending[executor.submit(self.__downloadModFile, mod, file, cache, manifest, verifyHashes, verifySize, root)] = mod
+
+			for future in concurrent.futures.as_completed(pending):
+				mod = pending[future]
+				try:
+					status, error = future.result()
+				except Exception as e:
+					status, error = None, str(e)
+				statuses[status] += 1
+				if error is not None:
+					print("Couldn't download file for mod [{}]: {}".format(mod, error))
+					failures[mod].append(error)
+
+		if statuses["current"]:
+			print("{} mod files were already installed and up to date.".format(statuses["current"]))
+		succeeded = [mod for mod, errors in failures.items() if not errors]
+		failed = {mod: errors for mod, errors in failures.items() if errors}
+		print("Installed {} of {} mods.".format(len(succeeded), len(failures)))
+		if succeeded and (statuses["cached"] or statuses["downloaded"]):
+			print("Succeeded:")
+			for mod in sorted(succeeded):
+				print("  - " + mod)
+		if failed:
+			print("Failed:")
+			for mod in sorted(failed):
+				print("  - {}: {}".format(mod, ", ".join(failed[mod])))
+
+		# Nothing new went into the cache if nothing was downloaded.
+		if cache is not None and statuses["downloaded"]:
+			try:
+				with Trace.Phase("cache-prune"):
+					cache.Prune()
+			except OSError as e:
+				print("Couldn't prune the cache: {}".format(e))
+		return failed
+
+	# Responsible for finding everything the mods require. mods maps each mod's
+	# name to its info. Returns a report with the mods that had to be "added"
+	# (name to info), the "dependencies" newly found for the given mods, which
+	# mods each mod is "required-by", and any "conflicts", "cycles" or
+	# "missing" dependencies.
+	def ResolveDependencies(self, gameVersion: str, mods: dict) -> dict:
 		pass
 
-	# Used by serve-up
-	def DownloadMods(self, profile: TableclothProfile):
+	# Responsible for finding the newest version of each of the queries, which
+	# are (project ID, game version, loader) tuples, using up to `jobs`
+	# workers. Each query is only looked up once. Returns a dict mapping each
+	# query to the newest version's info, or None if there isn't one.
+	def GetNewestVersions(self, queries: list, jobs: int = DEFAULT_DOWNLOAD_JOBS) -> dict:
 		pass
 
+	# Responsible for listing the files of every enabled mod in the profile, as
+	# InstallModFiles takes them.
+	def GetModFiles(self, profile: TableclothProfile) -> dict:
+		pass
+
+	# Used by serve-up. Downloads the files of every enabled mod using up to
+	# `jobs` workers, skipping files the manifest shows are already installed
+	# and taking them from the cache when it has them. Returns a dict mapping
+	# each failed mod to a list of failures.
+	def DownloadMods(self, profile: TableclothProfile, jobs: int = DEFAULT_DOWNLOAD_JOBS, cache: ArtifactCache = None, manifest = None) -> dict:
+		return self.InstallModFiles(self.GetModFiles(profile), jobs, cache, manifest)
+
 class ModrinthHostService(ModHostService):
 	def __init__(self):
-		super().__init__("https://api.modrinth.com/v2/")
+		super().__init__(MODRINTH_API_URL.rstrip("/") + "/")
 
 	def __findModVersion(self, gameVersion: str, modName: str, modVersion: str) -> dict:
-		versionResponse = requests.get(
-			self.GetApiUrl() + "project/" + modName + "/version",
-			params = {
-				# Filter results to only those supported by Fabric.
-				'loaders' : '["fabric"]',
-				# Filter results to only the game version.
-				'game_versions': '["{}"]'.format(gameVersion),
-			})
+		try:
+			versionResponse = self.Http().GetJson(
+				self.GetApiUrl() + "project/" + modName + "/version",
+				params = {
+					# Filter results to only those supported by Fabric.
+					'loaders' : '["fabric"]',
+					# Filter results to only the game version.
+					'game_versions': '["{}"]'.format(gameVersion),
+				})
+		except (_requests().RequestException, OfflineError) as e:
+			print("Could not get version data for the mod! {}".format(e))
+			return None
 		
 		if not versionResponse.status_code == 200:
 			print("Could not get version data for the mod! HTTP {}".format(versionResponse.status_code))
@@ -404,44 +2107,293 @@ class ModrinthHostService(ModHostService):
 					versionList.append(versionInfo["version_number"])
 			return versionList
 
-	def GetHostModInfo(self, gameVersion: str, modName: str, modVersion: str):
+	def __toHostModInfo(self, versionInfo: dict) -> dict:
+		return {
+			"project-id": versionInfo["project_id"],
+			"version-id": versionInfo["id"],
+			"version-number": versionInfo["version_number"],
+			"files": versionInfo["files"],
+			"dependencies": self.__toDependencies(versionInfo),
+			# Will be used to check for updates... eventually
+			"publish_date": versionInfo["date_published"],
+		}
+
+	# Keeps the dependencies Modrinth can identify. Some only name a file
+	# that's hosted elsewhere; there's nothing Tablecloth can do with those.
+	def __toDependencies(self, versionInfo: dict) -> list:
+		return [{
+			"project-id": dependency.get("project_id"),
+			"version-id": dependency.get("version_id"),
+			"type": dependency["dependency_type"],
+		} for dependency in versionInfo.get("dependencies", []) if dependency.get("project_id") or dependency.get("version_id")]
+
+	# Resolves a single mod with the project's own version list.
+	def __resolveMod(self, gameVersion: str, modName: str, modVersion: str):
 		modInfo = self.__findModVersion(gameVersion, modName, modVersion)
 
+		if modInfo is None:
+			return None
 		if isinstance(modInfo, collections.abc.Sequence):
 			if len(modInfo) == 0:
-				print("No versions supporting this profile's Minecraft version ({}) were found or the mod doesn't support Fabric".format(gameVersion))
+				print("[{}] No versions supporting this profile's Minecraft version ({}) were found or the mod doesn't support Fabric".format(modName, gameVersion))
 				return None
 			else:
-				print("Version wasn't found. Valid versions are:")
+				print("[{}] Version {} wasn't found. Valid versions are:".format(modName, modVersion))
 				print(modInfo)
 				return None
-		
-		return {
-			"project-id": modInfo["project_id"],
-			"version-id": modInfo["id"],
-			"files": modInfo["files"],
-			# Will be used to check for updates... eventually
-			"publish_date": modInfo["date_published"],
-		}
-	
-	def DownloadMods(self, profile: TableclothProfile):
+
+		return self.__toHostModInfo(modInfo)
+
+	# Gets a JSON list from one of Modrinth's bulk endpoints, or None if the
+	# request failed.
+	def __getBulk(self, endpoint: str, ids: list):
+		try:
+			response = self.Http().GetJson(self.GetApiUrl() + endpoint, params = {"ids": json.dumps(ids)})
+		except (_requests().RequestException, OfflineError) as e:
+			print("Could not get {} from Modrinth! {}".format(endpoint, e))
+			return None
+		if not response.status_code == 200:
+			print("Could not get {} from Modrinth! HTTP {}".format(endpoint, response.status_code))
+			return None
+		return response.json()
+
+	# Gets everything for the ids from a bulk endpoint, splitting them into as
+	# many requests as needed and sending those at once.
+	def __getBulkAll(self, endpoint: str, ids: list, executor) -> list:
+		ids = list(dict.fromkeys(ids))
+		chunks = [ids[i:i + MODRINTH_IDS_PER_REQUEST] for i in range(0, len(ids), MODRINTH_IDS_PER_REQUEST)]
+		results = []
+		for data in executor.map(lambda chunk: self.__getBulk(endpoint, chunk), chunks):
+			results += data or []
+		return results
+
+	# Gets the newest version of the project that supports Fabric and the game
+	# version, or None if there isn't one.
+	def __newestVersion(self, gameVersion: str, projectId: str, loader: str = "fabric"):
+		try:
+			response = self.Http().GetJson(
+				self.GetApiUrl() + "project/" + projectId + "/version",
+				params = {
+					'loaders' : '["{}"]'.format(loader),
+					'game_versions': '["{}"]'.format(gameVersion),
+				})
+		except (_requests().RequestException, OfflineError) as e:
+			print("Could not get version data for {}! {}".format(projectId, e))
+			return None
+		if not response.status_code == 200 or not response.json():
+			return None
+		return response.json()[0]
+
+	# Resolves the mods with Modrinth's bulk endpoints: one request for every
+	# MODRINTH_IDS_PER_REQUEST projects, then the same for the newest versions
+	# of those projects. Mods that aren't settled this way are left out of the
+	# result so they can be looked up on their own.
+	def __bulkResolve(self, gameVersion: str, modVersions: dict, executor) -> dict:
+		results = {}
+		names = list(modVersions.keys())
+		chunks = [names[i:i + MODRINTH_IDS_PER_REQUEST] for i in range(0, len(names), MODRINTH_IDS_PER_REQUEST)]
+
+		projects = {}
+		for chunk, data in zip(chunks, executor.map(lambda chunk: self.__getBulk("projects", chunk), chunks)):
+			if data is None:
+				continue
+			# Mods can be named by slug or by project ID.
+			found = {}
+			for project in data:
+				found[project["id"].lower()] = project
+				found[project["slug"].lower()] = project
+			for modName in chunk:
+				if modName.lower() in found:
+					projects[modName] = found[modName.lower()]
+				else:
+					print("[{}] Couldn't find this mod on Modrinth".format(modName))
+					results[modName] = None
+
+		versionIds = []
+		for project in projects.values():
+			versionIds += project["versions"][-MODRINTH_RECENT_VERSIONS:]
+		versionIds = list(dict.fromkeys(versionIds))
+		chunks = [versionIds[i:i + MODRINTH_IDS_PER_REQUEST] for i in range(0, len(versionIds), MODRINTH_IDS_PER_REQUEST)]
+
+		versionsByProject = collections.defaultdict(list)
+		for data in executor.map(lambda chunk: self.__getBulk("versions", chunk), chunks):
+			for versionInfo in data or []:
+				versionsByProject[versionInfo["project_id"]].append(versionInfo)
+
+		for modName, project in projects.items():
+			matches = [
+				versionInfo for versionInfo in versionsByProject[project["id"]]
+				if versionInfo["version_number"] == modVersions[modName] and
+					"fabric" in versionInfo["loaders"] and
+					gameVersion in versionInfo["game_versions"]
+			]
+			if matches:
+				# Prefer the newest, as the project's own version list would.
+				newest = max(matches, key=lambda versionInfo: versionInfo["date_published"])
+				results[modName] = self.__toHostModInfo(newest)
+		return results
+
+	def ResolveMods(self, gameVersion: str, modVersions: dict) -> dict:
+		import concurrent.futures
+		results = {}
+		with Trace.Phase("resolve-mods"), concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_DOWNLOAD_JOBS) as executor:
+			if len(modVersions) >= MODRINTH_BULK_THRESHOLD:
+				results = self.__bulkResolve(gameVersion, modVersions, executor)
+
+			remaining = [modName for modName in modVersions if not modName in results]
+			resolved = executor.map(lambda modName: self.__resolveMod(gameVersion, modName, modVersions[modName]), remaining)
+			results.update(zip(remaining, resolved))
+		return results
+
+	def ResolveDependencies(self, gameVersion: str, mods: dict) -> dict:
+		import concurrent.futures
+		report = {"added": {}, "dependencies": {}, "required-by": collections.defaultdict(set), "conflicts": [], "cycles": [], "missing": []}
+		# Everything in the graph so far, by project ID and by name.
+		names = {info["project-id"]: name for name, info in mods.items()}
+		infos = dict(mods)
+		graph = {name: info.get("dependencies") for name, info in mods.items()}
+
+		with Trace.Phase("resolve-dependencies"), concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_DOWNLOAD_JOBS) as executor:
+			# Mods added before dependencies were tracked need their versions
+			# looked up again to find out what they depend on.
+			unknown = [info["version-id"] for name, info in mods.items() if graph[name] is None]
+			for versionInfo in self.__getBulkAll("versions", unknown, executor):
+				name = names.get(versionInfo["project_id"])
+				if name is not None:
+					graph[name] = report["dependencies"][name] = self.__toDependencies(versionInfo)
+			for name in graph:
+				if graph[name] is None:
+					print("[{}] Couldn't look up this mod's dependencies".format(name))
+					graph[name] = []
+
+			level = list(mods.keys())
+			while level:
+				# Gather what this level requires that isn't in the graph yet. Each
+				# requirement is keyed by project ID (or by version ID, when that's
+				# all Modrinth gives).
+				wanted = {}
+				for name in level:
+					for dependency in graph[name]:
+						if dependency["type"] != "required":
+							continue
+						key = dependency["project-id"] or dependency["version-id"]
+						if key in names:
+							dependencyName = names[key]
+							report["required-by"][dependencyName].add(name)
+							pinned = dependency["version-id"]
+							if pinned and dependency["project-id"] and pinned != infos[dependencyName]["version-id"]:
+								report["conflicts"].append("{} requires a different version of {} than the one in the profile".format(name, dependencyName))
+							continue
+						want = wanted.setdefault(key, {"project-id": dependency["project-id"], "versions": set(), "required-by": set()})
+						want["required-by"].add(name)
+						if dependency["version-id"]:
+							want["versions"].add(dependency["version-id"])
+
+				for key, want in wanted.items():
+					if len(want["versions"]) > 1:
+						report["conflicts"].append("{} require different versions of {}".format(", ".join(sorted(want["required-by"])), key))
+
+				# Pinned versions come from one bulk request and the rest from each
+				# project's newest compatible version, all at once.
+				pinned = {key: sorted(want["versions"])[0] for key, want in wanted.items() if want["versions"]}
+				unpinned = [key for key in wanted if not key in pinned]
+				pinnedFuture = executor.submit(self.__getBulkAll, "versions", list(pinned.values()), executor)
+				projectsFuture = executor.submit(self.__getBulkAll, "projects", [want["project-id"] for want in wanted.values() if want["project-id"]], executor)
+				newestFutures = {key: executor.submit(self.__newestVersion, gameVersion, key) for key in unpinned}
+
+				versions = {}
+				versionKeys = {versionId: key for key, versionId in pinned.items()}
+				for versionInfo in pinnedFuture.result():
+					versions[versionKeys[versionInfo["id"]]] = versionInfo
+				for key, future in newestFutures.items():
+					if future.result() is not None:
+						versions[key] = future.result()
+				slugs = {project["id"]: project["slug"] for project in projectsFuture.result()}
+				# Dependencies that only named a version weren't in the projects
+				# request, so their names need another one.
+				unnamed = [versionInfo["project_id"] for versionInfo in versions.values() if not versionInfo["project_id"] in slugs]
+				for project in self.__getBulkAll("projects", unnamed, executor):
+					slugs[project["id"]] = project["slug"]
+
+				level = []
+				for key, want in wanted.items():
+					versionInfo = versions.get(key)
+					requiredBy = ", ".join(sorted(want["required-by"]))
+					if versionInfo is None:
+						report["missing"].append("{} (required by {}) has no version for Fabric on Minecraft {}".format(key, requiredBy, gameVersion))
+						continue
+					if not "fabric" in versionInfo["loaders"] or not gameVersion in versionInfo["game_versions"]:
+						report["conflicts"].append("{} requires version {} of {}, which doesn't support Fabric on Minecraft {}".format(requiredBy, versionInfo["version_number"], key, gameVersion))
+
+					projectId = versionInfo["project_id"]
+					if projectId in names:
+						# Only the version was known, and it belongs to a project that's
+						# already in the graph.
+						report["required-by"][names[projectId]] |= want["required-by"]
+						continue
+					name = slugs.get(projectId, projectId)
+					info = self.__toHostModInfo(versionInfo)
+					names[projectId] = name
+					names[key] = name
+					infos[name] = info
+					graph[name] = info["dependencies"]
+					report["added"][name] = info
+					report["required-by"][name] |= want["required-by"]
+					level.append(name)
+
+		for name, dependencies in graph.items():
+			for dependency in dependencies:
+				other = names.get(dependency["project-id"])
+				if dependency["type"] == "incompatible" and other is not None:
+					report["conflicts"].append("{} is incompatible with {}".format(name, other))
+
+		report["cycles"] = self.__findCycles({
+			name: [names[dependency["project-id"] or dependency["version-id"]] for dependency in dependencies
+				if dependency["type"] == "required" and (dependency["project-id"] or dependency["version-id"]) in names]
+			for name, dependencies in graph.items()
+		})
+		return report
+
+	# Finds the cycles in a graph that maps each node to the nodes it points to.
+	def __findCycles(self, edges: dict) -> list:
+		cycles = []
+		visiting = []
+		done = set()
+
+		def visit(node):
+			if node in done:
+				return
+			if node in visiting:
+				cycles.append(visiting[visiting.index(node):] + [node])
+				return
+			visiting.append(node)
+			for other in edges.get(node, []):
+				visit(other)
+			visiting.pop()
+			done.add(node)
+
+		for node in edges:
+			visit(node)
+		return cycles
+
+	def GetNewestVersions(self, queries: list, jobs: int = DEFAULT_DOWNLOAD_JOBS) -> dict:
+		import concurrent.futures
+		with Trace.Phase("newest-versions"), concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+			futures = {query: executor.submit(self.__newestVersion, query[1], query[0], query[2]) for query in set(queries)}
+		newest = {}
+		for query, future in futures.items():
+			versionInfo = future.result()
+			newest[query] = self.__toHostModInfo(versionInfo) if versionInfo else None
+		return newest
+
+	def GetModFiles(self, profile: TableclothProfile) -> dict:
+		modFiles = {}
 		for mod, info in profile.Mods().items():
 			if not info["enabled"]:
-				# TODO: I don't want to remove them because files required by multiple
-				# mods may exist here. Probably need to map files to the mods that need
-				# them - probably an issue for when tablecloth.lock is introduced here
-				print("Skipping disabled mod [{}]. Jars associated with this mod may still be present, however.".format(mod))
+				print("Skipping disabled mod [{}]. Once it's served up, `cleanup` removes its jars unless another mod uses them.".format(mod))
 				continue
-
-			print("Downloading " + mod)
-			for file in info["modrinth"]["files"]:
-				modJarResponse = requests.get(file["url"]) 
-				if not modJarResponse.status_code == 200:
-					print("Couldn't download file for mod [{}]: HTTP {}".format(mod, modJarResponse.status_code))
-					continue
-				path = "mods/" + file["filename"]
-				open(path, 'wb').write(modJarResponse.content)
-				print("Downloaded mod file to " + path)
+			modFiles[mod] = info["modrinth"]["files"]
+		return modFiles
 
 # Base class for all actions in tablecloth.
 class TableclothActionBase:
@@ -466,8 +2418,9 @@ class ProfileRequiredActionBase(TableclothActionBase):
 	def GetProfile(self):
 		return self._config.GetProfile(self.profile.Name())
 
-def CreateActionGroup(argparser: argparse.ArgumentParser, subparsers: argparse._SubParsersAction, groupName, groupHelp):
-	parser = subparsers.add_parser(groupName, help=groupHelp)
+# Turns a command's parser into a group of subcommands. With no subcommand, the
+# group shows its help.
+def CreateActionGroup(argparser: argparse.ArgumentParser, parser: argparse.ArgumentParser, groupName):
 	# Set default behavior for the group with no arguments (show help)
 	parser.set_defaults(func = lambda args, config: argparser.parse_args([groupName, '-h']))
 	# This creates the group itself
@@ -477,11 +2430,37 @@ def CallbackFromClass(action: type):
 	return lambda argv, config: action(argv, config).Perform()
 
 # ============================argument parser setup=============================
-argparser = argparse.ArgumentParser(prog="Tablecloth MC Alpha 0.2", description="A CLI-based Minecraft Server launcher and Fabric mod installer ([WIP] commands can't be used)")
-argparser.add_argument("--showResult", help="Displays the config when the command completes.", action="store_true")
-argparser.add_argument("--profile", "-p", help="The name of the profile to operate on or use. Ignored by the profile actions. If omitted, will use config.current-profile if config.assume-current-profile is true.")
-argparser.add_argument("--dry-run", help="[WIP] Performs a dry run and shows what the result would be without saving the config", action="store_true")
-subparsers = argparser.add_subparsers()
+# Commands register the help they're listed with and a function that fills in
+# their parser. Building every parser takes longer than running most commands,
+# so only the parser for the command being run is filled in.
+COMMANDS = {}
+
+def RegisterCommand(name: str, help: str, builder) -> None:
+	COMMANDS[name] = (help, builder)
+
+# Finds the command being run, skipping over the values of global options.
+def _findCommand(argv: list):
+	for i, arg in enumerate(argv):
+		if arg in COMMANDS and (i == 0 or not argv[i - 1] in ["--profile", "-p", "--trace"]):
+			return arg
+	return None
+
+def BuildArgparser(argv: list) -> argparse.ArgumentParser:
+	argparser = argparse.ArgumentParser(prog="Tablecloth MC Alpha 0.2", description="A CLI-based Minecraft Server launcher and Fabric mod installer ([WIP] commands can't be used)")
+	argparser.add_argument("--showResult", help="Displays the config when the command completes.", action="store_true")
+	argparser.add_argument("--profile", "-p", help="The name of the profile to operate on or use. Ignored by the profile actions. If omitted, will use config.current-profile if config.assume-current-profile is true.")
+	argparser.add_argument("--dry-run", help="[WIP] Performs a dry run and shows what the result would be without saving the config", action="store_true")
+	argparser.add_argument("--offline", help="Doesn't use the network. API responses come only from the metadata cache and files only from the artifact cache.", action="store_true")
+	argparser.add_argument("--timings", help="Shows where the time went when the command completes: each phase, each host's request latency, download throughput, cache hit rates and retries.", action="store_true")
+	argparser.add_argument("--trace", help="Writes a JSON trace of every phase, request and download, with the --timings summary, to this file.")
+	subparsers = argparser.add_subparsers()
+
+	command = _findCommand(argv)
+	for name, (help, builder) in COMMANDS.items():
+		parser = subparsers.add_parser(name, help=help)
+		if name == command:
+			builder(argparser, parser)
+	return argparser
 
 # ==============================================================================
 # PROFILE COMMANDS
@@ -520,36 +2499,117 @@ class ProfileActions:
 			for profile in self._config.GetProfileNames():
 				print(profile)
 
-profile_parsers = CreateActionGroup(
-	argparser,
-	subparsers,
-	"profile",
-	"Manage profiles. None of the profile commands will assume a profile, regardless of settings."
-)
-
-current_subparser = profile_parsers.add_parser("add", help="Adds a profile")
-current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile to create", type=str)
-current_subparser.add_argument('--minecraft', '-m', metavar="Minecraft Version", help='The version of Minecraft this profile uses', type=str)
-current_subparser.add_argument('--fabric-loader', '-l', metavar="Fabric Loader", help="The version of the Fabric Loader this profile uses", type=str)
-current_subparser.add_argument('--fabric-installer', '-i', metavar="Fabric Installer", help="The version of the Fabric installer this profile uses", type=str)
-current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Create))
-
-current_subparser = profile_parsers.add_parser("copy", help="Copies one profile to another")
-current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the original profile", type=str)
-current_subparser.add_argument('newProfile', metavar="New Profile Name", help="The name of the new profile", type=str)
-current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Copy))
-
-current_subparser = profile_parsers.add_parser("rename", help="Renames an existing profile")
-current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile", type=str)
-current_subparser.add_argument('newProfileName', metavar="Profile New Name", help="The new name of the profile", type=str)
-current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Rename))
-
-current_subparser = profile_parsers.add_parser("remove", help="Removes a profile")
-current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile to remove", type=str)
-current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Remove))
-
-current_subparser = profile_parsers.add_parser("list", help="Lists all profiles")
-current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.List))
+	# Sets the launch overrides for a profile.
+	class Override(__ProfileActionBase):
+		def Perform(self) -> None:
+			if not self._profileName in self._config.GetProfileNames():
+				print("Profile {} doesn't exist!".format(self._profileName))
+				exit(1)
+			profile = self._config.GetProfile(self._profileName)
+			# "none" clears an override, so the setting is used again.
+			clear = lambda value: None if value.lower() == "none" else value
+
+			if self._argv.jar is not None:
+				profile.SetJarName(clear(self._argv.jar))
+			if self._argv.java_path is not None:
+				profile.SetJavaPath(clear(self._argv.java_path))
+			if self._argv.java_args is not None:
+				profile.SetJavaArgs([arg for arg in self._argv.java_args.split(",") if arg])
+			if self._argv.preset is not None:
+				preset = clear(self._argv.preset)
+				if preset is not None and not preset in JVM_PRESETS:
+					print("There's no JVM preset named {}. The presets are: {}".format(preset, ", ".join(JVM_PRESETS)))
+					exit(1)
+				profile.SetPreset(preset)
+			self._config.MarkDirty()
+
+	# Installs a profile's mods and server jar into its own directory so it can
+	# be activated without downloading anything.
+	class Materialize(__ProfileActionBase):
+		def _Materialize(self) -> "MaterializedProfile":
+			if not self._profileName in self._config.GetProfileNames():
+				print("Profile {} doesn't exist!".format(self._profileName))
+				exit(1)
+			if os.sep in self._profileName or self._profileName.startswith("."):
+				print("Profile {} can't be materialized: its name can't be used as a directory name".format(self._profileName))
+				exit(1)
+
+			materialized = MaterializedProfile(self._config, self._config.GetProfile(self._profileName))
+			jobs = max(1, self._argv.jobs or self._config.GetDownloadJobs())
+			print("Materializing {} in {}".format(self._profileName, materialized.Directory()))
+			if materialized.Materialize(jobs):
+				print("Profile {} couldn't be fully materialized.".format(self._profileName))
+				exit(1)
+			return materialized
+
+		def Perform(self) -> None:
+			self._Materialize()
+
+	# Switches the server to a profile by pointing mods/ and the server jar at
+	# its materialized directory, materializing it first if needed.
+	class Activate(Materialize):
+		def Perform(self) -> None:
+			materialized = self._Materialize()
+
+			previousName = self._config.GetCurrentProfileName()
+			previous = None
+			if previousName != self._profileName and previousName in self._config.GetProfileNames():
+				previous = MaterializedProfile(self._config, self._config.GetProfile(previousName))
+			try:
+				materialized.Activate(previous)
+			except OSError as e:
+				print("Couldn't switch to {}: {}".format(self._profileName, e))
+				exit(1)
+			self._config.SetCurrentProfileName(self._profileName)
+			print("Switched to profile " + self._profileName)
+
+def _buildProfileParsers(argparser: argparse.ArgumentParser, parser: argparse.ArgumentParser) -> None:
+	profile_parsers = CreateActionGroup(argparser, parser, "profile")
+
+	current_subparser = profile_parsers.add_parser("add", help="Adds a profile")
+	current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile to create", type=str)
+	current_subparser.add_argument('--minecraft', '-m', metavar="Minecraft Version", help='The version of Minecraft this profile uses', type=str)
+	current_subparser.add_argument('--fabric-loader', '-l', metavar="Fabric Loader", help="The version of the Fabric Loader this profile uses", type=str)
+	current_subparser.add_argument('--fabric-installer', '-i', metavar="Fabric Installer", help="The version of the Fabric installer this profile uses", type=str)
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Create))
+
+	current_subparser = profile_parsers.add_parser("copy", help="Copies one profile to another")
+	current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the original profile", type=str)
+	current_subparser.add_argument('newProfile', metavar="New Profile Name", help="The name of the new profile", type=str)
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Copy))
+
+	current_subparser = profile_parsers.add_parser("rename", help="Renames an existing profile")
+	current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile", type=str)
+	current_subparser.add_argument('newProfileName', metavar="Profile New Name", help="The new name of the profile", type=str)
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Rename))
+
+	current_subparser = profile_parsers.add_parser("remove", help="Removes a profile")
+	current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile to remove", type=str)
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Remove))
+
+	current_subparser = profile_parsers.add_parser("list", help="Lists all profiles")
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.List))
+
+	current_subparser = profile_parsers.add_parser("override", help="Sets launch overrides for the profile")
+	current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile", type=str)
+	current_subparser.add_argument("--jar", help="The name of the server jar launch runs. \"none\" uses settings.launch.jar-name")
+	current_subparser.add_argument("--java-path", help="The Java executable launch runs. \"none\" uses settings.launch.java-path")
+	current_subparser.add_argument("--java-args", help="Comma-separated args passed to Java after settings.launch.java-args. An empty string clears them")
+	current_subparser.add_argument("--preset", help="The JVM tuning preset ({}). \"none\" uses settings.launch.preset".format(", ".join(JVM_PRESETS)))
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Override))
+
+	current_subparser = profile_parsers.add_parser("materialize", help="Installs the profile's mods and server jar into its own directory")
+	current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile to materialize", type=str)
+	current_subparser.add_argument("--jobs", "-j", help="The number of files to download at once. Defaults to settings.downloads.jobs", type=int)
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Materialize))
+
+	current_subparser = profile_parsers.add_parser("activate", help="Switches the server to the profile, materializing it first if needed")
+	current_subparser.add_argument('profileName', metavar="Profile Name", help="The name of the profile to switch to", type=str)
+	current_subparser.add_argument("--jobs", "-j", help="The number of files to download at once. Defaults to settings.downloads.jobs", type=int)
+	current_subparser.set_defaults(func = CallbackFromClass(ProfileActions.Activate))
+
+RegisterCommand("profile", "Manage profiles. None of the profile commands will assume a profile, regardless of settings.", _buildProfileParsers)
+
 # ==============================================================================
 # END PROFILE ACTIONS
 # ==============================================================================
@@ -565,10 +2625,30 @@ class ModActions:
 
 	class Add(__ModActionBase):
 		def Perform(self) -> None:
-			self.GetProfile().AddMod(self._argv.modName, self._argv.modVersion)
+			added = self.GetProfile().AddMod(self._argv.modName, self._argv.modVersion)
 			#TODO: Config needs to pay attention to its profiles to mark itself dirty.
 			# Set up some observer pattern there.
 			self._config.MarkDirty()
+			if added and not self._argv.no_deps:
+				ModActions.PrintDependencyReport(self.GetProfile().ResolveDependencies())
+
+	# Adds everything the profile's mods require.
+	class Dependencies(__ModActionBase):
+		def Perform(self) -> None:
+			ModActions.PrintDependencyReport(self.GetProfile().ResolveDependencies())
+			self._config.MarkDirty()
+
+	def PrintDependencyReport(report: dict) -> None:
+		for modName in sorted(report["added"]):
+			print("Added dependency {} {} (required by {})".format(modName, report["added"][modName]["version-number"], ", ".join(sorted(report["required-by"][modName]))))
+		for missing in report["missing"]:
+			print("Missing dependency: " + missing)
+		for conflict in report["conflicts"]:
+			print("Conflict: " + conflict)
+		for cycle in report["cycles"]:
+			print("Dependency cycle: " + " -> ".join(cycle))
+		if not (report["added"] or report["missing"] or report["conflicts"]):
+			print("All dependencies are satisfied.")
 
 	# Lists all mods in the profile.
 	class List(__ModActionBase):
@@ -576,60 +2656,162 @@ class ModActions:
 			for mod in self.GetProfile().ListMods():
 				print(mod)
 
-	# Removes the mod from the profile.
+	# Removes the mod from the profile, along with its installed jars.
 	class Remove(__ModActionBase):
 		def Perform(self) -> None:
 			self.GetProfile().RemoveMod(self._argv.modName)
 			self._config.MarkDirty()
+			ModActions.PruneModFiles(self._config, self.GetProfile(), self._argv.modName)
+
+	# Looks up every mod in the profile again.
+	class Refresh(__ModActionBase):
+		def Perform(self) -> None:
+			profile = self.GetProfile()
+			failed = profile.RefreshMods()
+			print("Refreshed {} of {} mods.".format(len(profile.ListMods()) - len(failed), len(profile.ListMods())))
+			if failed:
+				print("These mods couldn't be refreshed and still use their old files:")
+				for modName in sorted(failed):
+					print("  - " + modName)
+			self._config.MarkDirty()
 
-	# Finds all profiles that use the given mod.
+	# Finds all profiles that use the given mod, optionally only the ones
+	# that pin it to a version.
 	class Search(TableclothActionBase):
 		def Perform(self) -> None:
-			profiles = self._config.GetProfileNames()
+			index = self._config.GetModIndex()
 			mod = self._argv.modName
-			print("Mod [{}] is found in the following profiles:".format(mod))
-			for profileName in profiles:
-				profile = self._config.GetProfile(profileName)
-				if profile.HasMod(mod):
-					print("  - " + profileName)
-
-	# Sets the version for the mod. The mod must exist first however.
+			if self._argv.version:
+				found = index.FindPinned(mod, self._argv.version)
+				print("Mod [{}] is pinned to {} in the following profiles:".format(mod, self._argv.version))
+			else:
+				found = index.Find(mod)
+				print("Mod [{}] is found in the following profiles:".format(mod))
+			for profileName, modNames in found.items():
+				for modName in modNames:
+					settings = index.GetModSettings(profileName, modName)
+					version = (settings.get("modrinth") or {}).get("version-number") or settings.get("version")
+					label = profileName if modName == mod else "{} (as {})".format(profileName, modName)
+					print("  - {} [{}]".format(label, version))
+
+	# Sets the version for the mod. The mod must exist first however. The
+	# old version's jars are removed; serve-up installs the new ones.
 	class SetVersion(__ModActionBase):
 		def Perform(self) -> None:
-			self.GetProfile().UpdateMod(self._argv.modName, self._argv.modVersion)
-			self._config.MarkDirty()
+			profile = self.GetProfile()
+			if profile.UpdateMod(self._argv.modName, self._argv.modVersion):
+				self._config.MarkDirty()
+				files = profile.Mods()[self._argv.modName]["modrinth"]["files"]
+				ModActions.PruneModFiles(self._config, profile, self._argv.modName, [file["filename"] for file in files])
+
+	# Removes the jars installed for a mod of the profile that no other mod
+	# uses, from mods/ and the profile's materialized directory, going by the
+	# install manifests rather than looking through the directories. Files
+	# named in keep stay.
+	def PruneModFiles(config: TableclothConfig, profile: TableclothProfile, modName: str, keep: list = None) -> None:
+		keep = set("mods/" + filename for filename in keep or [])
+		for directory, manifest in _openInstallManifests(config, profile.Name()):
+			orphaned = manifest.Unreference(profile.Name(), modName, keep)
+			for path in orphaned:
+				print("Removed " + os.path.normpath(os.path.join(directory, path)))
+			manifest.Remove(orphaned)
+			manifest.Save()
+
+def _buildModParsers(argparser: argparse.ArgumentParser, parser: argparse.ArgumentParser) -> None:
+	mod_parsers = CreateActionGroup(argparser, parser, "mod")
+
+	current_subparser = mod_parsers.add_parser("add", help="Adds the mod to the profile. Doesn't download the mod, however.")
+	current_subparser.add_argument("modName", help="The name of the mod to add.")
+	# Maybe someday we want to make this optional - help the user gind what they want - but not today
+	current_subparser.add_argument("modVersion", help="The version of the mod to add.")
+	current_subparser.add_argument("--no-deps", help="Doesn't add the mods this mod requires.", action='store_true')
+	current_subparser.set_defaults(func = CallbackFromClass(ModActions.Add))
+
+	current_subparser = mod_parsers.add_parser("deps", help="Adds every mod the profile's mods require.")
+	current_subparser.set_defaults(func = CallbackFromClass(ModActions.Dependencies))
+
+	current_subparser = mod_parsers.add_parser("list", help="Lists all the mods in the profile.")
+	current_subparser.set_defaults(func = CallbackFromClass(ModActions.List))
+
+	current_subparser = mod_parsers.add_parser("refresh", help="Looks up every mod in the profile again, such as after changing the Minecraft version.")
+	current_subparser.set_defaults(func = CallbackFromClass(ModActions.Refresh))
+
+	current_subparser = mod_parsers.add_parser("remove", aliases=["rm"], help="Removes the mod from the profile.")
+	current_subparser.add_argument("modName", help="The name of the mod to remove.")
+	current_subparser.set_defaults(func = CallbackFromClass(ModActions.Remove))
+
+	current_subparser = mod_parsers.add_parser("search", help="Reports each profile that has the mod.")
+	current_subparser.add_argument("modName", help="The name, Modrinth project ID or Modrinth version ID of the mod to search for.")
+	current_subparser.add_argument("--version", "-v", help="Only reports profiles that pin the mod to this version or version ID.")
+	current_subparser.set_defaults(func = CallbackFromClass(ModActions.Search))
+
+	current_subparser = mod_parsers.add_parser("set-version", aliases=["sv"], help="Sets the version of the mod.")
+	current_subparser.add_argument("modName", help="The name of the mod to set the version for")
+	current_subparser.add_argument("modVersion", help="The version of the mod.")
+	current_subparser.set_defaults(func = CallbackFromClass(ModActions.SetVersion))
+
+RegisterCommand("mod", "Manages mods for a profile", _buildModParsers)
+
+# ==============================================================================
+# END MOD ACTIONS
+# ==============================================================================
 
-mod_parsers = CreateActionGroup(
-	argparser,
-	subparsers,
-	"mod",
-	"Manages mods for a profile"
-)
+# ==============================================================================
+# CACHE ACTIONS
+# ==============================================================================
+class CacheActions:
+	class __CacheActionBase(TableclothActionBase):
+		def __init__(self, argv: argparse.Namespace, config: TableclothConfig) -> None:
+			super().__init__(argv, config)
+			self._cache = ArtifactCache.FromConfig(config)
+			if self._cache is None:
+				print("The artifact cache is disabled (settings.cache.enabled is false)")
+				exit(1)
 
-current_subparser = mod_parsers.add_parser("add", help="Adds the mod to the profile. Doesn't download the mod, however.")
-current_subparser.add_argument("modName", help="The name of the mod to add.")
-# Maybe someday we want to make this optional - help the user gind what they want - but not today
-current_subparser.add_argument("modVersion", help="The version of the mod to add.")
-current_subparser.set_defaults(func = CallbackFromClass(ModActions.Add))
+	# Reports how much the cache is holding.
+	class Stats(__CacheActionBase):
+		def Perform(self) -> None:
+			stats = self._cache.Stats()
+			print("Cache location: " + stats["path"])
+			print("Files: {}".format(stats["entries"]))
+			print("Size: {} of {}".format(FormatSize(stats["size"]), FormatSize(stats["max-size"])))
+			if stats["oldest"] is not None:
+				print("Least recently used: " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats["oldest"])))
+				print("Most recently used: " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats["newest"])))
+
+			metadata = MetadataCache.FromConfig(self._config).Stats()
+			print("API responses: {} ({}), used for {} seconds before being checked again".format(metadata["entries"], FormatSize(metadata["size"]), metadata["ttl"]))
+
+	# Evicts files from the cache until it fits in its size cap.
+	class Prune(__CacheActionBase):
+		def Perform(self) -> None:
+			if self._argv.all:
+				maxSize = 0
+			elif self._argv.max_size:
+				maxSize = ParseSize(self._argv.max_size)
+			else:
+				maxSize = None
+			files, size = self._cache.Prune(maxSize)
+			print("Removed {} files ({}) from the cache".format(files, FormatSize(size)))
+			if self._argv.all:
+				responses = MetadataCache.FromConfig(self._config).Clear()
+				print("Removed {} API responses from the cache".format(responses))
 
-current_subparser = mod_parsers.add_parser("list", help="Lists all the mods in the profile.")
-current_subparser.set_defaults(func = CallbackFromClass(ModActions.List))
+def _buildCacheParsers(argparser: argparse.ArgumentParser, parser: argparse.ArgumentParser) -> None:
+	cache_parsers = CreateActionGroup(argparser, parser, "cache")
 
-current_subparser = mod_parsers.add_parser("remove", aliases=["rm"], help="Removes the mod from the profile.")
-current_subparser.add_argument("modName", help="The name of the mod to remove.")
-current_subparser.set_defaults(func = CallbackFromClass(ModActions.Remove))
+	current_subparser = cache_parsers.add_parser("stats", help="Reports the size and contents of the cache.")
+	current_subparser.set_defaults(func = CallbackFromClass(CacheActions.Stats))
 
-current_subparser = mod_parsers.add_parser("search", help="Reports each profile that has the mod.")
-current_subparser.add_argument("modName", help="The name of the mod to search for.")
-current_subparser.set_defaults(func = CallbackFromClass(ModActions.Search))
+	current_subparser = cache_parsers.add_parser("prune", help="Removes the least recently used files until the cache fits its size cap.")
+	current_subparser.add_argument("--max-size", help="The size to prune the cache down to (such as 512M). Defaults to settings.cache.max-size")
+	current_subparser.add_argument("--all", help="Removes everything from the cache, including API responses", action='store_true')
+	current_subparser.set_defaults(func = CallbackFromClass(CacheActions.Prune))
 
-current_subparser = mod_parsers.add_parser("set-version", aliases=["sv"], help="Sets the version of the mod.")
-current_subparser.add_argument("modName", help="The name of the mod to set the version for")
-current_subparser.add_argument("modVersion", help="The version of the mod.")
-current_subparser.set_defaults(func = CallbackFromClass(ModActions.SetVersion))
+RegisterCommand("cache", "Manages the artifact cache shared by every profile and server directory", _buildCacheParsers)
 
 # ==============================================================================
-# END MOD ACTIONS
+# END CACHE ACTIONS
 # ==============================================================================
 
 class CleanupAction(TableclothActionBase):
@@ -637,7 +2819,7 @@ class CleanupAction(TableclothActionBase):
 		if not self._argv.yes:
 				response = ""
 				while response != "y" and response != "n":
-					response = input("This will remove the server jar, .fabric, and mods folders. Continue? Y/N ").lower()
+					response = input("This will remove the server jar, .fabric, libraries, mods and materialized profile folders. Continue? Y/N ").lower()
 				if response == "n":
 					print("Aborting cleanup")
 					return
@@ -651,24 +2833,54 @@ class CleanupAction(TableclothActionBase):
 				profile.GetFabricLoaderVersion(),
 				profile.GetFabricInstallerVersion()
 			)
-		if os.path.exists(serverJar):
+		# After a profile has been activated, the jar and mods/ are links into
+		# the profile's materialized directory.
+		if os.path.lexists(serverJar):
 			os.remove(serverJar)
-		if os.path.exists("mods"):
+		if os.path.islink("mods"):
+			os.remove("mods")
+		elif os.path.exists("mods"):
 			shutil.rmtree("mods")
 		if os.path.exists(".fabric"):
 			shutil.rmtree(".fabric")
+		if os.path.exists(FABRIC_LIBRARIES_DIR):
+			shutil.rmtree(FABRIC_LIBRARIES_DIR)
+		if os.path.exists(os.path.join(TABLECLOTH_STATE_DIR, "profiles")):
+			shutil.rmtree(os.path.join(TABLECLOTH_STATE_DIR, "profiles"))
 		return
 
+	# Removes the jars that no mod uses any more, from mods/ and each
+	# materialized profile, going by which mods serve-up recorded each file
+	# was installed for.
+	def __cleanup(self) -> None:
+		removed = 0
+		for directory, manifest in _openInstallManifests(self._config):
+			orphans, untracked = manifest.FindOrphans()
+			for path in orphans:
+				print("Removing " + os.path.normpath(os.path.join(directory, path)))
+			manifest.Remove(orphans)
+			manifest.Save()
+			removed += len(orphans)
+			if untracked:
+				names = [os.path.basename(path) for path in untracked[:5]]
+				if len(untracked) > len(names):
+					names.append("and {} more".format(len(untracked) - len(names)))
+				print("Leaving {} files in {} that Tablecloth has no record of installing: {}".format(
+					len(untracked), os.path.normpath(os.path.join(directory, "mods")), ", ".join(names)))
+		print("Removed {} unused files.".format(removed))
+
 	def Perform(self) -> None:
 		if self._argv.spotless:
 			self.__squeakyCleanup()
 		else:
-			print("Cleanup is still a work in progress.")
+			self.__cleanup()
+
+def _buildCleanupParser(argparser: argparse.ArgumentParser, current_subparser: argparse.ArgumentParser) -> None:
+	current_subparser.add_argument("--spotless", help="Clean up all jars installed or created by Tablecloth", action='store_true')
+	current_subparser.add_argument("--yes", "-y", help="Skips the prompt when doing a spotless cleanup", action='store_true')
+	current_subparser.set_defaults(func=CallbackFromClass(CleanupAction))
 
-current_subparser = subparsers.add_parser("cleanup", help="Cleans up jars related to removed and disabled mods")
-current_subparser.add_argument("--spotless", help="Clean up all jars installed or created by Tablecloth", action='store_true')
-current_subparser.add_argument("--yes", "-y", help="Skips the prompt when doing a spotless cleanup", action='store_true')
-current_subparser.set_defaults(func=CallbackFromClass(CleanupAction))
+RegisterCommand("cleanup", "Cleans up jars related to removed and disabled mods", _buildCleanupParser)
 
 class InitAction(TableclothActionBase):
 	def Perform(self) -> None:
@@ -677,66 +2889,1857 @@ class InitAction(TableclothActionBase):
 			return
 		self._config.MarkDirty()
 
-current_subparser = subparsers.add_parser("init", help="Creates the default Tablecloth.py if one doesn't exist.")
-current_subparser.set_defaults(func=CallbackFromClass(InitAction))
+def _buildInitParser(argparser: argparse.ArgumentParser, current_subparser: argparse.ArgumentParser) -> None:
+	current_subparser.set_defaults(func=CallbackFromClass(InitAction))
 
-class LaunchAction(TableclothActionBase):
-	def __craftLaunchArgs(self) -> list:
+RegisterCommand("init", "Creates the default Tablecloth.py if one doesn't exist.", _buildInitParser)
+
+# Reads the first line of a small system file, or None if it can't be read.
+def _readSystemFile(path: str):
+	try:
+		with open(path, 'r') as systemFile:
+			return systemFile.readline().strip()
+	except OSError:
+		return None
+
+# Finds how much memory and how many cores the server may actually use:
+# the host's, unless a cgroup (such as a container's) limits it further.
+def DetectHostResources() -> dict:
+	memory = None
+	with contextlib.suppress(ValueError, OSError, AttributeError):
+		memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+	memoryLimit = None
+	# cgroup v2 first, then v1. Unlimited shows up as "max" or a huge number.
+	for path in ["/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"]:
+		value = _readSystemFile(path)
+		if value and value.isdigit():
+			memoryLimit = int(value)
+			break
+	if memoryLimit is not None and memory is not None and memoryLimit >= memory:
+		memoryLimit = None
+
+	cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+	coreLimit = None
+	quota = _readSystemFile("/sys/fs/cgroup/cpu.max")
+	if quota:
+		quota, _, period = quota.partition(" ")
+	else:
+		quota = _readSystemFile("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+		period = _readSystemFile("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+	if quota and period and quota.isdigit() and period.isdigit() and int(period) > 0:
+		coreLimit = max(1, -(-int(quota) // int(period)))
+
+	return {
+		"memory": memory,
+		"memory-limit": memoryLimit,
+		"cores": min(cores, coreLimit) if coreLimit else cores,
+	}
+
+# Named sets of JVM options for running a Minecraft server. "heap" is the share
+# of the memory available to the server that goes to the heap; the rest is
+# left for the JVM itself, native libraries and the OS.
+JVM_PRESETS = {
+	# G1 with the flags commonly used for Minecraft servers (known as Aikar's
+	# flags), which favor short pauses and a large young generation since the
+	# server creates a lot of short-lived objects every tick.
+	"g1": {
+		"heap": 0.8,
+		"args": [
+			"-XX:+UseG1GC",
+			"-XX:+ParallelRefProcEnabled",
+			"-XX:MaxGCPauseMillis=200",
+			"-XX:+UnlockExperimentalVMOptions",
+			"-XX:+DisableExplicitGC",
+			"-XX:G1HeapWastePercent=5",
+			"-XX:G1MixedGCCountTarget=4",
+			"-XX:G1MixedGCLiveThresholdPercent=90",
+			"-XX:G1RSetUpdatingPauseTimePercent=5",
+			"-XX:SurvivorRatio=32",
+			"-XX:+PerfDisableSharedMem",
+			"-XX:MaxTenuringThreshold=1",
+		],
+		# Heaps over 12G do better with bigger regions and young generation.
+		"small-heap-args": [
+			"-XX:G1NewSizePercent=30",
+			"-XX:G1MaxNewSizePercent=40",
+			"-XX:G1HeapRegionSize=8M",
+			"-XX:G1ReservePercent=20",
+			"-XX:InitiatingHeapOccupancyPercent=15",
+		],
+		"large-heap-args": [
+			"-XX:G1NewSizePercent=40",
+			"-XX:G1MaxNewSizePercent=50",
+			"-XX:G1HeapRegionSize=16M",
+			"-XX:G1ReservePercent=15",
+			"-XX:InitiatingHeapOccupancyPercent=20",
+		],
+	},
+	# ZGC collects concurrently, so pauses stay tiny however big the heap is,
+	# at the cost of some throughput and memory headroom.
+	"zgc": {
+		"heap": 0.7,
+		"args": [
+			"-XX:+UseZGC",
+			"-XX:+DisableExplicitGC",
+			"-XX:+PerfDisableSharedMem",
+		],
+	},
+	# Shenandoah also collects concurrently, and is in most OpenJDK builds
+	# other than Oracle's.
+	"shenandoah": {
+		"heap": 0.7,
+		"args": [
+			"-XX:+UseShenandoahGC",
+			"-XX:+DisableExplicitGC",
+			"-XX:+PerfDisableSharedMem",
+		],
+	},
+}
+# Heaps at least this big use a preset's "large-heap-args".
+JVM_LARGE_HEAP = ParseSize("12G")
+# The smallest heap a preset will size.
+JVM_MIN_HEAP = ParseSize("1G")
+
+# Builds the JVM options for a preset, sizing the heap and the garbage
+# collector's threads for the resources available. Returns the options and
+# a few notes on how they were picked.
+def CraftPresetArgs(presetName: str, resources: dict, largePages: bool = False, preTouch: bool = False) -> tuple:
+	preset = JVM_PRESETS[presetName]
+	notes = []
+	available = resources["memory-limit"] or resources["memory"]
+	if available is None:
+		raise ValueError("Couldn't find out how much memory there is")
+	notes.append("{} of memory available{}".format(FormatSize(available), " (cgroup limit)" if resources["memory-limit"] else ""))
+
+	heap = max(JVM_MIN_HEAP, int(available * preset["heap"]))
+	heapMegabytes = heap // 1024 ** 2
+	# The whole heap is claimed up front; a server's heap never shrinks back
+	# usefully anyway, and resizing costs pauses.
+	args = ["-Xms{}M".format(heapMegabytes), "-Xmx{}M".format(heapMegabytes)]
+	args += preset["args"]
+	args += preset.get("large-heap-args" if heap >= JVM_LARGE_HEAP else "small-heap-args", [])
+	notes.append("Using {} of it for the heap with the {} preset".format(FormatSize(heap), presetName))
+
+	# The JVM's defaults, but from the cores this process may use rather than
+	# the ones the machine has.
+	cores = resources["cores"]
+	parallelThreads = cores if cores <= 8 else 8 + (cores - 8) * 5 // 8
+	args += ["-XX:ParallelGCThreads={}".format(parallelThreads), "-XX:ConcGCThreads={}".format(max(1, parallelThreads // 4))]
+	notes.append("{} cores available, so {} parallel GC threads".format(cores, parallelThreads))
+
+	if largePages:
+		args.append("-XX:+UseLargePages")
+	if preTouch:
+		args.append("-XX:+AlwaysPreTouch")
+	return args, notes
+
+# Appends JSON records, one per line, to a file that's rotated once it grows
+# past maxSize: metrics.jsonl becomes metrics.jsonl.1, and so on, keeping up
+# to `backups` old files.
+class RotatingMetricsFile:
+	def __init__(self, path: str, maxSize: int, backups: int):
+		self.__path = path
+		self.__maxSize = maxSize
+		self.__backups = backups
+		self.__lock = threading.Lock()
+
+	def __rotate(self) -> None:
+		for i in range(self.__backups - 1, 0, -1):
+			older = "{}.{}".format(self.__path, i)
+			if os.path.exists(older):
+				os.replace(older, "{}.{}".format(self.__path, i + 1))
+		if self.__backups > 0:
+			os.replace(self.__path, self.__path + ".1")
+		else:
+			os.remove(self.__path)
+
+	def Write(self, record: dict) -> None:
+		line = json.dumps(record) + "\n"
+		with self.__lock:
+			try:
+				os.makedirs(os.path.dirname(self.__path) or ".", exist_ok=True)
+				if os.path.exists(self.__path) and os.path.getsize(self.__path) + len(line) > self.__maxSize:
+					self.__rotate()
+				with open(self.__path, 'a') as metricsFile:
+					metricsFile.write(line)
+			except OSError as e:
+				print("Couldn't write to {}: {}".format(self.__path, e))
+
+# Reads what /proc says about a process: resident memory, CPU time used,
+# threads and open file descriptors. Returns None where there's no /proc or
+# the process is gone.
+def SampleProcess(pid: int):
+	try:
+		with open("/proc/{}/stat".format(pid), 'r') as statFile:
+			# The command name can contain spaces, so split after it.
+			fields = statFile.read().rsplit(")", 1)[1].split()
+		rss = None
+		threads = None
+		with open("/proc/{}/status".format(pid), 'r') as statusFile:
+			for line in statusFile:
+				if line.startswith("VmRSS:"):
+					rss = int(line.split()[1]) * 1024
+				elif line.startswith("Threads:"):
+					threads = int(line.split()[1])
+		fds = len(os.listdir("/proc/{}/fd".format(pid)))
+	except (OSError, IndexError, ValueError):
+		return None
+	# utime and stime are fields 14 and 15 of stat; the split starts at field 3.
+	ticks = os.sysconf("SC_CLK_TCK")
+	return {
+		"rss": rss,
+		"cpu-seconds": (int(fields[11]) + int(fields[12])) / ticks,
+		"threads": threads,
+		"fds": fds,
+	}
+
+# Reads the server's log as it's written and keeps figures on it: lag
+# ("Can't keep up!") events, how long startups took, players joining and
+# leaving, and exceptions, tagged with the mod whose code they came through.
+# Lag figures are kept both as totals and over a rolling window.
+class ServerLogAnalyzer:
+	# Frames in stack traces from log4j name the jar the class came from, as in
+	# "at a.b.C.d(C.java:1) ~[sodium-fabric-0.4.10.jar:?]".
+	FRAME_JAR = r"\[([^\[\]:/\\]+\.jar)[:\]]"
+	# Mixin handlers Fabric merges into Minecraft's classes are named
+	# handler$zza000$modid$method.
+	FRAME_MIXIN = r"\$zz\w+\$([a-z0-9_\-]+)\$"
+
+	def __init__(self, profileName: str, modFiles: dict, window: float):
+		import re
+		self.__profileName = profileName
+		self.__modFiles = modFiles
+		self.__window = window
+		self.__listener = None
+		self.__lock = threading.Lock()
+
+		self.__lagPattern = re.compile(r"Can't keep up!.*?Running (\d+)ms or (\d+) ticks behind")
+		self.__donePattern = re.compile(r"\]:? (?:\(\S+\) )?Done \((\d+(?:\.\d+)?)s\)!")
+		self.__joinPattern = re.compile(r"\]:? (?:\(\S+\) )?(\w{1,16}) joined the game\s*$")
+		self.__leavePattern = re.compile(r"\]:? (?:\(\S+\) )?(\w{1,16}) left the game\s*$")
+		self.__exceptionPattern = re.compile(r"^(?:.*\]:? (?:\(\S+\) )?)?((?:[a-zA-Z_$][\w$]*\.)+[\w$]*(?:Exception|Error|Throwable))(?::|\s*$)")
+		self.__framePattern = re.compile(r"^\s+(?:at |\.\.\. \d+ more)|^Caused by: |^\s+Suppressed: ")
+		self.__frameJarPattern = re.compile(ServerLogAnalyzer.FRAME_JAR)
+		self.__frameMixinPattern = re.compile(ServerLogAnalyzer.FRAME_MIXIN)
+
+		self.__lines = 0
+		self.__starts = 0
+		self.__lag = collections.deque()
+		self.__lagEvents = 0
+		self.__lagMilliseconds = 0
+		self.__lagTicks = 0
+		self.__startupSeconds = None
+		self.__players = set()
+		self.__joins = 0
+		self.__leaves = 0
+		self.__exceptions = {}
+		# The exception whose stack trace is being read, and the mod it's been
+		# pinned on so far.
+		self.__pending = None
+
+	def __emit(self, event: str, **fields) -> None:
+		if self.__listener is not None:
+			self.__listener(event, **fields)
+
+	# listener is called with the name and fields of each thing found.
+	def SetListener(self, listener) -> None:
+		self.__listener = listener
+
+	def __blame(self, frame: str):
+		for jar in self.__frameJarPattern.findall(frame):
+			if jar in self.__modFiles:
+				return self.__modFiles[jar]
+		mixin = self.__frameMixinPattern.search(frame)
+		if mixin is not None:
+			return mixin.group(1)
+		return None
+
+	def __finishException(self) -> None:
+		exception, mod = self.__pending
+		self.__pending = None
+		mod = mod or "unknown"
+		self.__exceptions[(mod, exception)] = self.__exceptions.get((mod, exception), 0) + 1
+		self.__emit("exception", mod=mod, exception=exception)
+
+	def __pruneLag(self, now: float) -> None:
+		while self.__lag and self.__lag[0][0] < now - self.__window:
+			self.__lag.popleft()
+
+	# A new server process is starting: nobody's online any more.
+	def ServerStarted(self) -> None:
+		with self.__lock:
+			if self.__pending is not None:
+				self.__finishException()
+			self.__starts += 1
+			self.__players.clear()
+
+	def Feed(self, line: str) -> None:
+		line = line.rstrip("\r\n")
+		with self.__lock:
+			self.__lines += 1
+			if self.__pending is not None:
+				if self.__framePattern.match(line):
+					if self.__pending[1] is None:
+						self.__pending = (self.__pending[0], self.__blame(line))
+					return
+				self.__finishException()
+
+			match = self.__lagPattern.search(line)
+			if match is not None:
+				milliseconds, ticks = int(match.group(1)), int(match.group(2))
+				now = time.time()
+				self.__lag.append((now, milliseconds, ticks))
+				self.__pruneLag(now)
+				self.__lagEvents += 1
+				self.__lagMilliseconds += milliseconds
+				self.__lagTicks += ticks
+				self.__emit("lag", milliseconds=milliseconds, ticks=ticks)
+				return
+
+			match = self.__donePattern.search(line)
+			if match is not None:
+				self.__startupSeconds = float(match.group(1))
+				self.__emit("ready", seconds=self.__startupSeconds)
+				return
+
+			match = self.__joinPattern.search(line)
+			if match is not None:
+				self.__players.add(match.group(1))
+				self.__joins += 1
+				self.__emit("join", player=match.group(1), online=len(self.__players))
+				return
+
+			match = self.__leavePattern.search(line)
+			if match is not None:
+				self.__players.discard(match.group(1))
+				self.__leaves += 1
+				self.__emit("leave", player=match.group(1), online=len(self.__players))
+				return
+
+			match = self.__exceptionPattern.match(line)
+			if match is not None:
+				self.__pending = (match.group(1), self.__blame(line))
+
+	# Counts an exception whose stack trace was still being read when the log
+	# ended.
+	def Finish(self) -> None:
+		with self.__lock:
+			if self.__pending is not None:
+				self.__finishException()
+
+	# Renders the figures in Prometheus' text exposition format.
+	def Render(self) -> str:
+		def escape(value) -> str:
+			return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+		with self.__lock:
+			self.__pruneLag(time.time())
+			profile = "profile=\"{}\"".format(escape(self.__profileName))
+			metrics = [
+				("tablecloth_server_log_lines_total", "counter", "Lines the server has logged", [(profile, self.__lines)]),
+				("tablecloth_server_starts_total", "counter", "Times the server has been started", [(profile, self.__starts)]),
+				("tablecloth_server_lag_events_total", "counter", "Can't keep up! warnings", [(profile, self.__lagEvents)]),
+				("tablecloth_server_lag_milliseconds_total", "counter", "Milliseconds behind reported by Can't keep up! warnings", [(profile, self.__lagMilliseconds)]),
+				("tablecloth_server_lag_ticks_total", "counter", "Ticks skipped according to Can't keep up! warnings", [(profile, self.__lagTicks)]),
+				("tablecloth_server_lag_window_events", "gauge", "Can't keep up! warnings in the last {:g} seconds".format(self.__window), [(profile, len(self.__lag))]),
+				("tablecloth_server_lag_window_milliseconds_max", "gauge", "Worst lag in the last {:g} seconds".format(self.__window), [(profile, max((lag[1] for lag in self.__lag), default=0))]),
+				("tablecloth_server_lag_window_ticks", "gauge", "Ticks skipped in the last {:g} seconds".format(self.__window), [(profile, sum(lag[2] for lag in self.__lag))]),
+				("tablecloth_server_players_online", "gauge", "Players online", [(profile, len(self.__players))]),
+				("tablecloth_server_player_joins_total", "counter", "Players that joined", [(profile, self.__joins)]),
+				("tablecloth_server_player_leaves_total", "counter", "Players that left", [(profile, self.__leaves)]),
+				("tablecloth_server_exceptions_total", "counter", "Exceptions logged, by the mod they came through", [
+					("{},mod=\"{}\",exception=\"{}\"".format(profile, escape(mod), escape(exception)), count)
+					for (mod, exception), count in sorted(self.__exceptions.items())
+				]),
+			]
+			if self.__startupSeconds is not None:
+				metrics.append(("tablecloth_server_startup_seconds", "gauge", "How long the last startup took", [(profile, self.__startupSeconds)]))
+
+		lines = []
+		for name, kind, help, samples in metrics:
+			lines.append("# HELP {} {}".format(name, help))
+			lines.append("# TYPE {} {}".format(name, kind))
+			for labels, value in samples:
+				lines.append("{}{{{}}} {}".format(name, labels, value))
+		return "\n".join(lines) + "\n"
+
+# Makes a ServerLogAnalyzer's figures available, by rewriting a file for
+# node_exporter's textfile collector and/or serving them over HTTP for
+# Prometheus to scrape.
+class LogMetricsExporter:
+	def __init__(self, analyzer: ServerLogAnalyzer, textfile, listen, interval: float):
+		self.__analyzer = analyzer
+		self.__textfile = textfile
+		self.__listen = listen
+		self.__interval = interval
+		self.__stopping = threading.Event()
+		self.__threads = []
+		self.__server = None
+
+	def __writeTextfile(self) -> None:
+		# Written then renamed, so the collector never reads half a file.
+		temporary = self.__textfile + ".tmp"
+		try:
+			os.makedirs(os.path.dirname(self.__textfile) or ".", exist_ok=True)
+			with open(temporary, 'w') as textfile:
+				textfile.write(self.__analyzer.Render())
+			os.replace(temporary, self.__textfile)
+		except OSError as e:
+			print("Couldn't write {}: {}".format(self.__textfile, e))
+
+	def __textfileLoop(self) -> None:
+		while not self.__stopping.wait(self.__interval):
+			self.__writeTextfile()
+
+	def Start(self) -> None:
+		if self.__textfile:
+			self.__writeTextfile()
+			thread = threading.Thread(target=self.__textfileLoop, daemon=True)
+			thread.start()
+			self.__threads.append(thread)
+
+		if self.__listen:
+			import http.server
+			analyzer = self.__analyzer
+
+			class MetricsHandler(http.server.BaseHTTPRequestHandler):
+				def do_GET(self):
+					if self.path.split("?")[0] not in ["/", "/metrics"]:
+						self.send_error(404)
+						return
+					body = analyzer.Render().encode()
+					self.send_response(200)
+					self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+					self.send_header("Content-Length", str(len(body)))
+					self.end_headers()
+					self.wfile.write(body)
+
+				def log_message(self, format, *args):
+					pass
+
+			host, _, port = str(self.__listen).rpartition(":")
+			self.__server = http.server.ThreadingHTTPServer((host or "127.0.0.1", int(port)), MetricsHandler)
+			self.__server.daemon_threads = True
+			thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+			thread.start()
+			self.__threads.append(thread)
+			print("Serving server metrics at http://{}:{}/metrics".format(host or "127.0.0.1", port))
+
+	def Stop(self) -> None:
+		self.__stopping.set()
+		if self.__server is not None:
+			self.__server.shutdown()
+			self.__server.server_close()
+		if self.__textfile:
+			self.__writeTextfile()
+
+# Copies the server's output to ours as it comes, handing each line to the
+# analyzer after it's been passed on so reading the log never holds up the
+# console. Returns the thread doing the copying.
+def PumpServerOutput(process, analyzer: ServerLogAnalyzer) -> threading.Thread:
+	def pump():
+		out = sys.stdout.buffer
+		for line in iter(process.stdout.readline, b""):
+			with contextlib.suppress(OSError, ValueError):
+				out.write(line)
+				out.flush()
+			analyzer.Feed(line.decode(errors="replace"))
+		process.stdout.close()
+		analyzer.Finish()
+
+	thread = threading.Thread(target=pump, daemon=True)
+	thread.start()
+	return thread
+
+# Runs the server as a child process and keeps it running. A server that
+# exits with an error is started again after a delay that doubles with each
+# crash in a row, up to a limit; a server that stops cleanly (such as after
+# /stop) isn't. Stop signals sent to Tablecloth are passed on so the server
+# can save the world before exiting. While the server runs, samples of its
+# resource use are written to the metrics file.
+class ServerSupervisor:
+	STOP_SIGNALS = ["SIGINT", "SIGTERM", "SIGHUP"]
+
+	# If given, the server's output is read by analyzer, and what it finds is
+	# recorded in the metrics file too.
+	def __init__(self, command: list, settings: dict, profileName: str, analyzer: ServerLogAnalyzer = None):
+		self.__command = command
+		self.__settings = settings
+		self.__profileName = profileName
+		self.__metrics = RotatingMetricsFile(settings["metrics-path"], ParseSize(settings["metrics-max-size"]), int(settings["metrics-backups"]))
+		self.__stopping = threading.Event()
+		self.__process = None
+		self.__processLock = threading.Lock()
+		self.__analyzer = analyzer
+		if analyzer is not None:
+			analyzer.SetListener(self.__record)
+
+	def __record(self, event: str, **fields) -> None:
+		record = {"time": time.time(), "event": event, "profile": self.__profileName}
+		record.update(fields)
+		self.__metrics.Write(record)
+
+	def __onSignal(self, signalNumber, frame) -> None:
+		import signal
+		self.__stopping.set()
+		with self.__processLock:
+			process = self.__process
+		if process is not None and process.poll() is None:
+			print("Passing {} on to the server...".format(signal.Signals(signalNumber).name))
+			with contextlib.suppress(OSError):
+				process.send_signal(signalNumber)
+
+	def __sample(self, process, startedAt: float) -> None:
+		interval = float(self.__settings["sample-interval"])
+		if interval <= 0 or not os.path.isdir("/proc"):
+			return
+		last = None
+		while process.poll() is None:
+			sample = SampleProcess(process.pid)
+			if sample is not None:
+				now = time.monotonic()
+				if last is not None and now > last[0]:
+					sample["cpu-percent"] = round(100 * (sample["cpu-seconds"] - last[1]) / (now - last[0]), 1)
+				last = (now, sample["cpu-seconds"])
+				self.__record("sample", pid=process.pid, uptime=round(now - startedAt, 1), **sample)
+			# Wakes up early if the server exits.
+			with contextlib.suppress(Exception):
+				process.wait(timeout=interval)
+
+	# Runs the server until it stops cleanly, is told to stop, or crashes too
+	# many times in a row. Returns the server's last exit code.
+	def Run(self) -> int:
+		import signal
+		import subprocess
+		previousHandlers = {}
+		for name in ServerSupervisor.STOP_SIGNALS:
+			if hasattr(signal, name):
+				previousHandlers[name] = signal.signal(getattr(signal, name), self.__onSignal)
+
+		crashes = 0
+		try:
+			while True:
+				print("Starting server...")
+				startedAt = time.monotonic()
+				with self.__processLock:
+					if self.__analyzer is None:
+						self.__process = subprocess.Popen(self.__command)
+					else:
+						self.__analyzer.ServerStarted()
+						self.__process = subprocess.Popen(self.__command, stdout=subprocess.PIPE)
+				process = self.__process
+				self.__record("start", pid=process.pid, command=self.__command)
+				pump = PumpServerOutput(process, self.__analyzer) if self.__analyzer is not None else None
+				sampler = threading.Thread(target=self.__sample, args=(process, startedAt), daemon=True)
+				sampler.start()
+
+				returnCode = process.wait()
+				sampler.join()
+				if pump is not None:
+					pump.join()
+				uptime = time.monotonic() - startedAt
+				# Killed by SIGKILL (as the kernel's OOM killer does) shows up as
+				# -9, or 137 when it went through a shell.
+				killed = returnCode in [-9, 137]
+				self.__record("exit", pid=process.pid, code=returnCode, uptime=round(uptime, 1), killed=killed)
+
+				if self.__stopping.is_set():
+					print("Server stopped (return code {}).".format(returnCode))
+					return returnCode
+				if returnCode == 0:
+					print("Server stopped cleanly; not restarting it.")
+					return returnCode
+
+				if uptime >= float(self.__settings["stable-after"]):
+					crashes = 0
+				crashes += 1
+				print("Server crashed (return code {}{}) after {:.0f} seconds.".format(returnCode, ", killed, possibly out of memory" if killed else "", uptime))
+				if crashes > int(self.__settings["max-restarts"]):
+					print("The server crashed {} times in a row; giving up. Check the server logs for more info.".format(crashes))
+					self.__record("give-up", crashes=crashes)
+					return returnCode
+
+				delay = min(float(self.__settings["restart-delay-max"]), float(self.__settings["restart-delay"]) * 2 ** (crashes - 1))
+				print("Restarting in {:.0f} seconds ({} of {})...".format(delay, crashes, self.__settings["max-restarts"]))
+				self.__record("restart", crashes=crashes, delay=delay)
+				if self.__stopping.wait(delay):
+					return returnCode
+		finally:
+			for name, handler in previousHandlers.items():
+				signal.signal(getattr(signal, name), handler)
+
+class LaunchAction(ProfileRequiredActionBase):
+	# Returns the full command and notes on how it was put together.
+	def __craftLaunchArgs(self) -> tuple:
 		config = self._config
+		profile = self.GetProfile()
 		javaArgs = config.GetLaunchInfo()
 		args = []
+		notes = []
 
-		#TODO: Ensure that these values are valid.
-		if "min-ram" in javaArgs:
-			print("Using {} as the minimum ram".format(javaArgs["min-ram"]))
-			args.append("-Xms{}".format(javaArgs["min-ram"]))
-		if "max-ram" in javaArgs:
-			print("Using {} as the maximum ram".format(javaArgs["max-ram"]))
-			args.append("-Xmx{}".format(javaArgs["max-ram"]))
+		preset = profile.GetPreset() or javaArgs["preset"]
+		if preset:
+			if not preset in JVM_PRESETS:
+				print("There's no JVM preset named {}. The presets are: {}".format(preset, ", ".join(JVM_PRESETS)))
+				exit(1)
+			try:
+				presetArgs, presetNotes = CraftPresetArgs(preset, DetectHostResources(), javaArgs["large-pages"], javaArgs["pre-touch"])
+			except ValueError as e:
+				print("Can't use the {} preset: {}".format(preset, e))
+				exit(1)
+			args += presetArgs
+			notes += presetNotes
+		else:
+			#TODO: Ensure that these values are valid.
+			if "min-ram" in javaArgs:
+				notes.append("Using {} as the minimum ram".format(javaArgs["min-ram"]))
+				args.append("-Xms{}".format(javaArgs["min-ram"]))
+			if "max-ram" in javaArgs:
+				notes.append("Using {} as the maximum ram".format(javaArgs["max-ram"]))
+				args.append("-Xmx{}".format(javaArgs["max-ram"]))
+
+		# Anything set by hand comes last, so it can override the preset.
+		args += javaArgs["java-args"]
+		args += profile.GetJavaArgs()
+
+		java = profile.GetJavaPath() or javaArgs["java-path"] or "java"
+		jarName = GetServerJarSource(config, profile)["filename"]
+		return [java] + args + ["-jar", jarName, "--nogui"], notes
 
-		# At present, these must be added manually to config. Not great at all.
-		for arg in javaArgs["java-args"]:
-			args.append[arg]
+	def Perform(self) -> None:
+		import shlex
+		import subprocess
+		command, notes = self.__craftLaunchArgs()
+		if self._argv.print_args:
+			print(shlex.join(command))
+			return
 
-		args += ["-jar", config.GetDefaultJarName(), "--nogui"]
-		return args
+		for note in notes:
+			print(note)
+
+		analyzer = None
+		exporter = None
+		logMetrics = self._config.GetLogMetricsSettings()
+		textfile = self._argv.metrics_textfile or logMetrics["textfile"]
+		listen = self._argv.metrics_listen or logMetrics["listen"]
+		if textfile or listen:
+			analyzer = ServerLogAnalyzer(self.profile.Name(), self.__modFiles(), float(logMetrics["window"]))
+			exporter = LogMetricsExporter(analyzer, textfile, listen, float(logMetrics["export-interval"]))
+			exporter.Start()
+
+		try:
+			if self._argv.supervise:
+				settings = self._config.GetSupervisorSettings()
+				if self._argv.sample_interval is not None:
+					settings["sample-interval"] = self._argv.sample_interval
+				exit(ServerSupervisor(command, settings, self.profile.Name(), analyzer).Run())
+
+			print("Starting server...")
+			if analyzer is None:
+				complete = subprocess.run(command)
+				returnCode = complete.returncode
+			else:
+				analyzer.ServerStarted()
+				process = subprocess.Popen(command, stdout=subprocess.PIPE)
+				pump = PumpServerOutput(process, analyzer)
+				while True:
+					# Ctrl+C reaches the server too; wait for it to save and stop.
+					try:
+						returnCode = process.wait()
+						break
+					except KeyboardInterrupt:
+						pass
+				pump.join()
+			print("Server run aborted (return code {}). Check the server logs for more info.".format(returnCode))
+		finally:
+			if exporter is not None:
+				exporter.Stop()
+
+	# Maps the profile's mod jars to the mods they belong to, so exceptions can
+	# be pinned on a mod.
+	def __modFiles(self) -> dict:
+		modFiles = {}
+		for modName, info in self.GetProfile().Mods().items():
+			for file in (info.get("modrinth") or {}).get("files", []):
+				if file.get("filename"):
+					modFiles[file["filename"]] = modName
+		return modFiles
+
+def _buildLaunchParser(argparser: argparse.ArgumentParser, current_subparser: argparse.ArgumentParser) -> None:
+	current_subparser.add_argument("--print-args", help="Prints the command that would start the server instead of running it", action='store_true')
+	current_subparser.add_argument("--supervise", help="Restarts the server when it crashes and records its resource use. See settings.supervisor", action='store_true')
+	current_subparser.add_argument("--sample-interval", help="Seconds between resource samples when supervising. Defaults to settings.supervisor.sample-interval", type=float)
+	current_subparser.add_argument("--metrics-textfile", help="Reads the server's log and writes what it finds to this file in Prometheus' text format. Defaults to settings.log-metrics.textfile")
+	current_subparser.add_argument("--metrics-listen", help="Reads the server's log and serves what it finds for Prometheus at [HOST:]PORT. Defaults to settings.log-metrics.listen")
+	current_subparser.set_defaults(func = CallbackFromClass(LaunchAction))
+
+RegisterCommand("launch", "Launches the Minecraft server", _buildLaunchParser)
+
+# Gets where the profile's server jar comes from and the name it's installed
+# under.
+def GetServerJarSource(config: TableclothConfig, profile: TableclothProfile) -> dict:
+	gameVersion = profile.GetMinecraftVersion()
+	loaderVersion = profile.GetFabricLoaderVersion()
+	installerVersion = profile.GetFabricInstallerVersion()
+
+	fabricInstallerUrl = FABRIC_META_URL.rstrip("/") + "/v2/versions/loader/{}/{}/{}/server/jar".format(gameVersion, loaderVersion, installerVersion)
+	jarName = profile.GetJarName() or config.GetDefaultJarName()
+	if jarName is None:
+		downloadName = "fabric-server-mc.{}-loader.{}-launcher.{}.jar".format(gameVersion, loaderVersion, installerVersion)
+	else:
+		downloadName = jarName
+	return {"url": fabricInstallerUrl, "filename": downloadName}
+
+# Describes the installed server jar for the lock. Fabric meta doesn't report
+# hashes for the server jar, so they're taken from the jar that was installed.
+# They were recorded when it was downloaded.
+def GetInstalledServerJar(source: dict, manifest: InstallManifest, root: str = ".") -> dict:
+	path = os.path.join(root, source["filename"])
+	return {
+		"filename": source["filename"],
+		"url": source["url"],
+		"size": os.path.getsize(path),
+		"hashes": manifest.GetHashes(source["filename"]) or _hashFileAll(path, ArtifactCache.HASH_ALGORITHMS),
+	}
+
+def _downloadServerJar(source: dict, manifest: InstallManifest, root: str) -> bool:
+	downloadName = source["filename"]
+	if manifest.IsCurrent(downloadName, source):
+		Trace.Count("already-installed")
+		return False
+	with Trace.Phase("server-jar"):
+		downloaded = DownloadFile(source["url"], os.path.join(root, downloadName), source.get("hashes"), source.get("size"))
+	manifest.Record(downloadName, dict(source, hashes = downloaded["hashes"]))
+	return True
+
+# Installs the server jar and the mod files into root, fetching the jar
+# alongside the mods rather than making them wait on it, since it comes from a
+# different host. Returns a dict mapping everything that failed to its
+# failures.
+def InstallServer(server: dict, modFiles: dict, manifest: InstallManifest, validation: dict, jobs: int, cache: ArtifactCache, root: str = ".") -> dict:
+	import concurrent.futures
+	if not os.path.exists(os.path.join(root, "mods")):
+		os.makedirs(os.path.join(root, "mods"))
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+		serverJar = executor.submit(_downloadServerJar, server, manifest, root)
 
-	def Perform(self) -> None:
-		print("Starting server...")
-		complete = subprocess.run(["java"] + self.__craftLaunchArgs())
-		print("Server run aborted (return code {}). Check the server logs for more info.".format(complete.returncode))
+		print("Installing mods...")
+		modrinthService = ModrinthHostService()
+		with Trace.Phase("mods"):
+			failed = modrinthService.InstallModFiles(modFiles, jobs, cache, manifest, validation["hashes"], validation["size"], root)
 
-current_subparser = subparsers.add_parser("launch", help="Launches the Minecraft server")
-current_subparser.set_defaults(func = CallbackFromClass(LaunchAction))
+		try:
+			if serverJar.result():
+				print("Server jar created. You may need to change its permissions.")
+			else:
+				print("Server jar is already up to date.")
+		except (_requests().RequestException, OfflineError, DownloadError, OSError) as e:
+			print("Couldn't download the server jar: {}".format(e))
+			failed["server jar"] = [str(e)]
+	return failed
+
+# Turns a Maven coordinate (group:artifact:version) into the path of its jar in
+# a Maven repository.
+def _mavenPath(name: str) -> str:
+	group, artifact, version = name.split(":")[:3]
+	return "/".join(group.split(".") + [artifact, version, "{}-{}.jar".format(artifact, version)])
+
+# Gets the sha1 a Maven repository publishes next to a file, or None.
+def _mavenSha1(url: str):
+	try:
+		with HttpClient.Shared().Get(url + ".sha1") as response:
+			if response.status_code != 200:
+				return None
+			digest = response.text.split()[0].lower() if response.text.split() else ""
+	except (_requests().RequestException, OfflineError):
+		return None
+	return digest if len(digest) == 40 else None
+
+# Lists what Fabric's server launcher would otherwise download the first time
+# it runs, one file at a time: the loader and its libraries, into libraries/,
+# and the vanilla server jar, into .fabric/server. Each file has the path it's
+# installed to, its url and, as far as they're known, its size and hashes.
+# Libraries Fabric meta doesn't give hashes for are checked against the sha1
+# their Maven repository publishes, unless the manifest shows they're already
+# installed, in which case the hashes they were installed with are used.
+# Raises DownloadError if the files can't be found.
+def GetFabricServerFiles(gameVersion: str, loaderVersion: str, jobs: int = DEFAULT_DOWNLOAD_JOBS, manifest: InstallManifest = None) -> list:
+	import concurrent.futures
+	http = HttpClient.Shared()
+	response = http.GetJson(FABRIC_META_URL.rstrip("/") + "/v2/versions/loader/{}/{}/server/json".format(gameVersion, loaderVersion))
+	if response.status_code != 200:
+		raise DownloadError("Fabric meta has no server profile for Minecraft {} with loader {} (HTTP {})".format(gameVersion, loaderVersion, response.status_code))
+	files = []
+	for library in response.json().get("libraries", []):
+		path = _mavenPath(library["name"])
+		files.append({
+			"path": FABRIC_LIBRARIES_DIR + "/" + path,
+			"filename": path.rsplit("/", 1)[-1],
+			"url": library.get("url", FABRIC_MAVEN_URL).rstrip("/") + "/" + path,
+			"size": library.get("size"),
+			"hashes": {algorithm: library[algorithm] for algorithm in ArtifactCache.HASH_ALGORITHMS if library.get(algorithm)},
+		})
+	unhashed = []
+	for file in files:
+		if not file["hashes"] and manifest is not None and manifest.IsCurrent(file["path"], file):
+			file["hashes"] = manifest.GetHashes(file["path"]) or {}
+		if not file["hashes"]:
+			unhashed.append(file)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+		for file, digest in zip(unhashed, executor.map(lambda file: _mavenSha1(file["url"]), unhashed)):
+			if digest is not None:
+				file["hashes"] = {"sha1": digest}
+
+	versions = http.GetJson(MOJANG_META_URL.rstrip("/") + "/mc/game/version_manifest_v2.json")
+	if versions.status_code != 200:
+		raise DownloadError("couldn't get Mojang's version list (HTTP {})".format(versions.status_code))
+	entry = next((version for version in versions.json()["versions"] if version["id"] == gameVersion), None)
+	if entry is None:
+		raise DownloadError("Mojang doesn't list Minecraft " + gameVersion)
+	versionInfo = http.GetJson(entry["url"])
+	if versionInfo.status_code != 200:
+		raise DownloadError("couldn't get Minecraft {}'s details (HTTP {})".format(gameVersion, versionInfo.status_code))
+	server = versionInfo.json()["downloads"]["server"]
+	files.append({
+		"path": FABRIC_DATA_DIR + "/{}-server.jar".format(gameVersion),
+		"filename": "{}-server.jar".format(gameVersion),
+		"url": server["url"],
+		"size": server.get("size"),
+		"hashes": {"sha1": server["sha1"]},
+	})
+	return files
+
+# Installs one of the files GetFabricServerFiles lists, unless the manifest
+# shows it's already there. Returns how it was installed ("current", "cached"
+# or "downloaded"). A file that had no hashes gets those it was downloaded
+# with, so they can go in the lock.
+def _installServerFile(file: dict, manifest: InstallManifest, cache: ArtifactCache, root: str) -> str:
+	if manifest.IsCurrent(file["path"], file):
+		Trace.Count("already-installed")
+		if not file.get("hashes"):
+			file["hashes"] = manifest.GetHashes(file["path"]) or {}
+		return "current"
+	destination = os.path.join(root, file["path"])
+	os.makedirs(os.path.dirname(destination), exist_ok=True)
+	hashes = file.get("hashes", {})
+	if cache is not None and cache.Fetch(hashes, destination):
+		Trace.Count("artifact-cache-hit")
+		status = "cached"
+	else:
+		if cache is not None:
+			Trace.Count("artifact-cache-miss")
+		downloaded = DownloadFile(file["url"], destination, hashes or None, file.get("size"))
+		status = "downloaded"
+		if not hashes:
+			file["hashes"] = {algorithm: downloaded["hashes"][algorithm] for algorithm in ArtifactCache.HASH_ALGORITHMS}
+		if cache is not None:
+			with contextlib.suppress(OSError):
+				cache.Store(destination, file["hashes"], downloaded["hashes"])
+	manifest.Record(file["path"], file)
+	return status
+
+# Installs the files GetFabricServerFiles lists, using up to `jobs` workers, so
+# the server's first launch doesn't have to. Files in the artifact cache are
+# taken from it, which makes this cheap again after a spotless cleanup.
+# Returns a list of what failed.
+def PrefetchServerFiles(files: list, manifest: InstallManifest, cache: ArtifactCache, jobs: int, root: str = ".") -> list:
+	import concurrent.futures
+	failed = []
+	statuses = collections.Counter()
+	with Trace.Phase("server-libraries"), concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+		futures = {executor.submit(_installServerFile, file, manifest, cache, root): file for file in files}
+		for future in concurrent.futures.as_completed(futures):
+			try:
+				statuses[future.result()] += 1
+			except (_requests().RequestException, OfflineError, DownloadError, OSError) as e:
+				failed.append("{} ({})".format(futures[future]["path"], e))
+	print("Prefetched {} files the server needs to start: {} downloaded, {} from the cache, {} already there.".format(
+		len(files), statuses["downloaded"], statuses["cached"], statuses["current"]))
+	return failed
+
+# Points link at target, replacing whatever link was there in one step so the
+# server never sees a missing or half-switched link.
+def _swapSymlink(target: str, link: str) -> None:
+	tempLink = _tempPath(link)
+	os.symlink(target, tempLink)
+	try:
+		os.replace(tempLink, link)
+	except OSError:
+		os.remove(tempLink)
+		raise
+
+# A profile's mods and server jar, installed once into their own directory
+# under .tablecloth/profiles. Activating the profile then only has to point
+# mods/ and the server jar at that directory.
+class MaterializedProfile:
+	def __init__(self, config: TableclothConfig, profile: TableclothProfile, root: str = "."):
+		self.__config = config
+		self.__profile = profile
+		self.__root = root
+		# Relative to root, so the links keep working if the server is moved.
+		self.__directory = os.path.join(TABLECLOTH_STATE_DIR, "profiles", profile.Name())
+
+	def Directory(self) -> str:
+		return self.__directory
+
+	def JarName(self) -> str:
+		return GetServerJarSource(self.__config, self.__profile)["filename"]
+
+	def IsMaterialized(self) -> bool:
+		return os.path.isdir(os.path.join(self.__root, self.__directory, "mods"))
+
+	# Determines if mods/ is pointed at this profile's directory.
+	def IsActive(self) -> bool:
+		link = os.path.join(self.__root, "mods")
+		return os.path.islink(link) and os.path.normpath(os.readlink(link)) == os.path.normpath(os.path.join(self.__directory, "mods"))
+
+	# Installs the profile's mods and server jar into its directory, taking
+	# files from the cache where it can. Files that are already there are
+	# skipped, and jars left over from mods the profile no longer uses are
+	# removed, since nothing but Tablecloth puts files there. Returns a dict
+	# mapping everything that failed to its failures.
+	def Materialize(self, jobs: int) -> dict:
+		directory = os.path.join(self.__root, self.__directory)
+		manifest = InstallManifest.FromConfig(self.__config, "installed.json", directory)
+		modFiles = ModrinthHostService().GetModFiles(self.__profile)
+		failed = InstallServer(
+			GetServerJarSource(self.__config, self.__profile),
+			modFiles,
+			manifest,
+			self.__config.GetValidationSettings(),
+			jobs,
+			ArtifactCache.FromConfig(self.__config),
+			directory
+		)
+
+		manifest.Reference(self.__profile.Name(), modFiles)
+		orphans, untracked = manifest.FindOrphans()
+		# Nothing but Tablecloth puts files here, so files it didn't record
+		# are leftovers too.
+		manifest.Remove(orphans + untracked)
+		manifest.Save()
+		return failed
+
+	# Points mods/ and the server jar at this profile's directory. Whatever
+	# serve-up put there before profiles were materialized becomes the
+	# previous profile's copy if it doesn't have one yet, and is moved into
+	# .tablecloth otherwise.
+	def Activate(self, previous = None) -> None:
+		jarName = self.JarName()
+		for name in ["mods", jarName]:
+			link = os.path.join(self.__root, name)
+			if os.path.lexists(link) and not os.path.islink(link):
+				keep = os.path.join(self.__root, previous.Directory(), name) if previous is not None else None
+				if keep is None or os.path.lexists(keep):
+					keep = os.path.join(self.__root, TABLECLOTH_STATE_DIR, "{}.replaced.{}".format(name, int(time.time())))
+				os.makedirs(os.path.dirname(keep), exist_ok=True)
+				os.rename(link, keep)
+				print("Moved {} to {}".format(link, keep))
+			_swapSymlink(os.path.join(self.__directory, name), link)
+
+		# A jar named after its versions would otherwise be left pointing at
+		# the previous profile.
+		if previous is not None and previous.JarName() != jarName:
+			oldJar = os.path.join(self.__root, previous.JarName())
+			if os.path.islink(oldJar):
+				os.remove(oldJar)
 
 class ServeUpAction(ProfileRequiredActionBase):
+	def __jobs(self) -> int:
+		return max(1, self._argv.jobs or self._config.GetDownloadJobs())
+
+	# Finds where the profile's mods and server jar go, and the manifest that
+	# records them. Once a profile has been activated, mods/ and the server jar
+	# are links into its materialized directory, so they're installed there;
+	# writing through the links would leave files in that directory that its
+	# manifest doesn't know about, and replace the jar's link with the jar.
+	def __installDirectory(self, manifest: InstallManifest) -> tuple:
+		materialized = MaterializedProfile(self._config, self.profile)
+		if materialized.IsActive():
+			directory = materialized.Directory()
+			print("Installing into {}, which mods/ is linked to".format(directory))
+			return directory, InstallManifest.FromConfig(self._config, "installed.json", directory)
+		if os.path.islink("mods") or os.path.islink(materialized.JarName()):
+			print("mods/ or the server jar is linked to another profile's directory. Run `profile activate {}` to switch to {} first.".format(self.profile.Name(), self.profile.Name()))
+			exit(1)
+		return ".", manifest
+
+	# Installs the server jar and mods into directory, recording them in
+	# modsManifest. The serverFiles go in the server directory whichever
+	# profile is active, so they're recorded in its manifest, and fetched
+	# alongside the mods.
+	def __install(self, server: dict, modFiles: dict, manifest: InstallManifest, directory: str, modsManifest: InstallManifest, validation: dict, serverFiles: list = None) -> dict:
+		import concurrent.futures
+		cache = ArtifactCache.FromConfig(self._config)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+			prefetch = executor.submit(PrefetchServerFiles, serverFiles, manifest, cache, self.__jobs()) if serverFiles else None
+			failed = InstallServer(server, modFiles, modsManifest, validation, self.__jobs(), cache, directory)
+			if prefetch is not None and prefetch.result():
+				print("Couldn't prefetch everything the server needs to start: {}".format(", ".join(prefetch.result())))
+				failed["server files"] = prefetch.result()
+		return failed
+
+	def __prefetches(self) -> bool:
+		return not self._argv.no_prefetch and self._config.GetPrefetchServerFiles()
+
+	# Looks up the files the Fabric launcher would fetch on the server's first
+	# launch. Not finding them isn't worth failing over, since the launcher can
+	# still fetch them itself.
+	def __serverFiles(self, profile: TableclothProfile, manifest: InstallManifest) -> list:
+		if not self.__prefetches():
+			return None
+		try:
+			return GetFabricServerFiles(profile.GetMinecraftVersion(), profile.GetFabricLoaderVersion(), self.__jobs(), manifest)
+		except (_requests().RequestException, OfflineError, DownloadError, KeyError, ValueError) as e:
+			print("Warning: couldn't find the files the server needs to start, so it will fetch them on its first launch: {}".format(e))
+			return None
+
+	# Installs exactly what the lock describes, without looking anything up.
+	def __performFrozen(self, manifest: InstallManifest, directory: str, modsManifest: InstallManifest) -> dict:
+		try:
+			lock = TableclothLock.Load()
+		except (OSError, ValueError) as e:
+			print("Can't serve up from {}: {}".format(TABLECLOTH_LOCK_PATH, e))
+			exit(1)
+		# mods/ is recorded as the profile's, so installing another profile's
+		# lock into it would leave cleanup removing this profile's jars.
+		if lock.ProfileName() != self.profile.Name():
+			print("{} was written for profile {}, not {}. Serve up with --profile {}, or without --frozen.".format(
+				TABLECLOTH_LOCK_PATH, lock.ProfileName(), self.profile.Name(), lock.ProfileName()))
+			exit(1)
+
+		print("Installing from " + TABLECLOTH_LOCK_PATH)
+		# The point of a lock is getting exactly the same files, so they're always
+		# checked.
+		failed = self.__install(lock.Server(), lock.ModFiles(), manifest, directory, modsManifest, {"hashes": True, "size": True}, lock.ServerFiles() if self.__prefetches() else None)
+		modsManifest.Reference(self.profile.Name(), lock.ModFiles())
+		return failed
+
 	def Perform(self) -> None:
+		manifest = InstallManifest.FromConfig(self._config)
+		directory, modsManifest = self.__installDirectory(manifest)
+		if self._argv.frozen:
+			failed = self.__performFrozen(manifest, directory, modsManifest)
+			manifest.Save()
+			modsManifest.Save()
+			print("Done, with errors." if failed else "Done!")
+			return
+
 		profile = self.GetProfile()
-		gameVersion = profile.GetMinecraftVersion()
-		loaderVersion = profile.GetFabricLoaderVersion()
-		installerVersion = profile.GetFabricInstallerVersion()
-
-		fabricInstallerUrl = "https://meta.fabricmc.net/v2/versions/loader/{}/{}/{}/server/jar".format(gameVersion, loaderVersion, installerVersion)
-		jarName = self._config.GetDefaultJarName()
-		if jarName is None:
-			downloadName = "fabric-server-mc.{}-loader.{}-launcher.{}.jar".format(gameVersion, loaderVersion, installerVersion)
+		server = GetServerJarSource(self._config, profile)
+		modFiles = ModrinthHostService().GetModFiles(profile)
+		serverFiles = self.__serverFiles(profile, manifest)
+		failed = self.__install(server, modFiles, manifest, directory, modsManifest, self._config.GetValidationSettings(), serverFiles)
+		modsManifest.Reference(profile.Name(), modFiles)
+		with Trace.Phase("manifest"):
+			manifest.Save()
+			modsManifest.Save()
+		if failed:
+			print("Done, with errors. {} wasn't updated.".format(TABLECLOTH_LOCK_PATH))
+			return
+
+		with Trace.Phase("lock"):
+			TableclothLock.FromProfile(profile, GetInstalledServerJar(server, modsManifest, directory), serverFiles).Save()
+		print("Done! Wrote " + TABLECLOTH_LOCK_PATH)
+
+def _buildServeUpParser(argparser: argparse.ArgumentParser, current_subparser: argparse.ArgumentParser) -> None:
+	current_subparser.add_argument("--jobs", "-j", help="The number of files to download at once. Defaults to settings.downloads.jobs", type=int)
+	current_subparser.add_argument("--frozen", help="Installs exactly what " + TABLECLOTH_LOCK_PATH + " describes, without looking anything up", action='store_true')
+	current_subparser.add_argument("--no-prefetch", help="Leaves the Fabric libraries and the vanilla server jar for the server to fetch on its first launch", action='store_true')
+	current_subparser.set_defaults(func = CallbackFromClass(ServeUpAction))
+
+RegisterCommand("serve-up", "Downloads the mods according to the desired profile", _buildServeUpParser)
+
+# ==============================================================================
+# FLEET ACTIONS
+# ==============================================================================
+class FleetActions:
+	# Reads the servers listed in a fleet manifest. Roots are relative to the
+	# manifest itself, so a fleet can be moved around as a whole.
+	def LoadManifest(path: str) -> list:
+		with open(path, 'r') as manifestFile:
+			data = json.load(manifestFile)
+		base = os.path.dirname(os.path.abspath(path))
+		servers = []
+		for entry in data.get("servers", []):
+			if isinstance(entry, str):
+				entry = {"root": entry}
+			servers.append({
+				"root": os.path.join(base, entry["root"]),
+				"profile": entry.get("profile"),
+				"frozen": entry.get("frozen", False),
+			})
+		return servers
+
+	# Runs serve-up for many server directories at once. Everything the servers
+	# need is gathered first, so each distinct file is fetched once (from the
+	# cache or the network) and copied to every server that uses it, with no
+	# more than `jobs` files being installed at a time across the whole fleet.
+	# Each server's cache and download settings come from its own config, not
+	# from the directory fleet is run in.
+	class ServeUp(TableclothActionBase):
+		def __init__(self, argv: argparse.Namespace, config: TableclothConfig) -> None:
+			super().__init__(argv, config)
+			self.__lock = threading.Lock()
+			self.__totals = collections.Counter()
+
+		def __servers(self) -> list:
+			servers = []
+			if self._argv.manifest:
+				try:
+					servers += FleetActions.LoadManifest(self._argv.manifest)
+				except (OSError, ValueError, KeyError) as e:
+					print("Can't read the fleet manifest {}: {}".format(self._argv.manifest, e))
+					exit(1)
+			for root in self._argv.roots:
+				servers.append({"root": root, "profile": self._argv.profile, "frozen": self._argv.frozen})
+
+			# The same directory listed twice would have two installs racing each other.
+			unique = {}
+			for server in servers:
+				unique.setdefault(os.path.realpath(server["root"]), server)
+			return list(unique.values())
+
+		# Works out what a server needs: its manifest, server jar and mod files.
+		# Returns a description of what's wrong if it can't be served up.
+		def __plan(self, server: dict):
+			server["statuses"] = collections.Counter()
+			server["errors"] = []
+			root = server["root"]
+			if not os.path.exists(os.path.join(root, TABLECLOTH_CONFIG_PATH)):
+				return "there's no " + TABLECLOTH_CONFIG_PATH
+			config = TableclothConfig(root)
+			server["manifest"] = InstallManifest.FromConfig(config, root=root)
+			server["cache"] = ArtifactCache.FromConfig(config)
+			server["jobs"] = config.GetDownloadJobs()
+			HttpClient.Configure(MetadataCache.FromConfig(config), HttpClient.IsOffline())
+
+			if server["frozen"]:
+				try:
+					lock = TableclothLock.Load(os.path.join(root, TABLECLOTH_LOCK_PATH))
+				except (OSError, ValueError) as e:
+					return str(e)
+				server["profile"] = lock.ProfileName()
+				server["jar"] = lock.Server()
+				server["mod-files"] = lock.ModFiles()
+				return None
+
+			profileName = server["profile"] or config.GetCurrentProfileName()
+			if not profileName in config.GetProfileNames():
+				return "there's no profile " + profileName
+			server["profile"] = profileName
+			server["config-profile"] = config.GetProfile(profileName)
+			server["jar"] = GetServerJarSource(config, server["config-profile"])
+			server["mod-files"] = ModrinthHostService().GetModFiles(server["config-profile"])
+			return None
+
+		def __count(self, server: dict, status: str, error: str = None) -> None:
+			with self.__lock:
+				server["statuses"][status] += 1
+				if error is not None:
+					server["errors"].append(error)
+
+		# Installs one distinct file for every server that needs it. The first
+		# server to need it gets it from the caches of the servers that need it or
+		# from the network, and the rest get a copy of that. A download is stored
+		# in all of those caches.
+		def __installArtifact(self, targets: list) -> None:
+			pending = []
+			for target in targets:
+				if target["server"]["manifest"].IsCurrent(target["path"], target["file"]):
+					self.__count(target["server"], "current")
+					Trace.Count("already-installed")
+				else:
+					pending.append(target)
+			if not pending:
+				return
+
+			first = pending[0]
+			file = first["file"]
+			source = os.path.join(first["server"]["root"], first["path"])
+			hashes = file.get("hashes", {})
+			recorded = file
+			caches = FleetActions.ServeUp.Caches(target["server"] for target in pending)
+			try:
+				os.makedirs(os.path.dirname(source), exist_ok=True)
+				if any(cache.Fetch(hashes, source) for cache in caches):
+					status = "cached"
+					Trace.Count("artifact-cache-hit")
+				else:
+					if caches:
+						Trace.Count("artifact-cache-miss")
+					downloaded = DownloadFile(file["url"], source, hashes or None, file.get("size"))
+					status = "downloaded"
+					with self.__lock:
+						self.__totals["downloaded-bytes"] += downloaded["size"]
+					if not hashes:
+						# Nothing to check it against (the server jar), but the hashes
+						# are still worth remembering.
+						recorded = dict(file, hashes = downloaded["hashes"])
+					else:
+						for cache in caches:
+							with contextlib.suppress(OSError):
+								cache.Store(source, hashes, downloaded["hashes"])
+			except (_requests().RequestException, OfflineError, DownloadError, OSError) as e:
+				print("Couldn't get {}: {}".format(file["filename"], e))
+				for target in pending:
+					self.__count(target["server"], "failed", "{} ({})".format(file["filename"], e))
+				return
+			first["server"]["manifest"].Record(first["path"], recorded)
+			self.__count(first["server"], status)
+			with self.__lock:
+				self.__totals[status] += 1
+
+			for target in pending[1:]:
+				destination = os.path.join(target["server"]["root"], target["path"])
+				try:
+					os.makedirs(os.path.dirname(destination), exist_ok=True)
+					_copyFileAtomic(source, destination)
+					target["server"]["manifest"].Record(target["path"], recorded)
+				except OSError as e:
+					self.__count(target["server"], "failed", "{} ({})".format(file["filename"], e))
+					continue
+				self.__count(target["server"], "shared")
+				with self.__lock:
+					self.__totals["shared"] += 1
+
+		# Saves what was installed and, for servers that were served up from
+		# their profile without errors, writes their lock.
+		def __finish(self, server: dict) -> None:
+			server["manifest"].Reference(server["profile"], server["mod-files"])
+			server["manifest"].Save()
+			if server["errors"] or server["frozen"]:
+				return
+			try:
+				jar = GetInstalledServerJar(server["jar"], server["manifest"], server["root"])
+				TableclothLock.FromProfile(server["config-profile"], jar).Save(os.path.join(server["root"], TABLECLOTH_LOCK_PATH))
+			except OSError as e:
+				server["errors"].append("couldn't write {} ({})".format(TABLECLOTH_LOCK_PATH, e))
+
+		# The distinct artifact caches the servers use.
+		def Caches(servers) -> list:
+			caches = {}
+			for server in servers:
+				if server.get("cache") is not None:
+					caches.setdefault(os.path.realpath(server["cache"].Root()), server["cache"])
+			return list(caches.values())
+
+		def __report(self, servers: list, artifactCount: int) -> None:
+			fileCount = sum(sum(server["statuses"].values()) for server in servers if "statuses" in server)
+			print("Served up {} servers: {} files, {} of them distinct.".format(len(servers), fileCount, artifactCount))
+			print("Downloaded {} files ({}), took {} from the cache and copied {} between servers.".format(
+				self.__totals["downloaded"], FormatSize(self.__totals["downloaded-bytes"]), self.__totals["cached"], self.__totals["shared"]))
+			for server in servers:
+				label = "{} [{}]".format(server["root"], server["profile"] or "?")
+				if server.get("problem"):
+					print("  - {}: SKIPPED, {}".format(label, server["problem"]))
+					continue
+				statuses = server["statuses"]
+				counts = "{} current, {} downloaded, {} cached, {} shared".format(statuses["current"], statuses["downloaded"], statuses["cached"], statuses["shared"])
+				if server["errors"]:
+					print("  - {}: FAILED ({}); {}".format(label, counts, ", ".join(server["errors"])))
+				else:
+					print("  - {}: OK ({})".format(label, counts))
+
+		def Perform(self) -> None:
+			import concurrent.futures
+			servers = self.__servers()
+			if not servers:
+				print("No servers to serve up. Give their directories or a fleet manifest.")
+				exit(1)
+
+			# Group every file every server needs by what it is, so each is only
+			# fetched once.
+			artifacts = {}
+			with Trace.Phase("plan"):
+				for server in servers:
+					server["problem"] = self.__plan(server)
+					if server["problem"]:
+						continue
+					targets = [(server["jar"]["filename"], server["jar"])]
+					for files in server["mod-files"].values():
+						targets += [("mods/" + file["filename"], file) for file in files]
+					for path, file in targets:
+						key = file.get("hashes", {}).get("sha512") or file["url"]
+						artifacts.setdefault(key, []).append({"server": server, "path": path, "file": file})
+
+			# Servers may allow different numbers of downloads at once. The fleet
+			# keeps to the smallest, since they all share this host's connection.
+			planned = [server for server in servers if not server["problem"]]
+			jobs = max(1, self._argv.jobs or min((server["jobs"] for server in planned), default = DEFAULT_DOWNLOAD_JOBS))
+			with Trace.Phase("install"), concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+				for future in [executor.submit(self.__installArtifact, targets) for targets in artifacts.values()]:
+					future.result()
+
+			with Trace.Phase("manifest"):
+				for server in servers:
+					if not server["problem"]:
+						self.__finish(server)
+			if self.__totals["downloaded"]:
+				for cache in FleetActions.ServeUp.Caches(planned):
+					try:
+						with Trace.Phase("cache-prune"):
+							cache.Prune()
+					except OSError as e:
+						print("Couldn't prune the cache {}: {}".format(cache.Root(), e))
+
+			self.__report(servers, len(artifacts))
+			if any(server["problem"] or server["errors"] for server in servers):
+				exit(1)
+
+def _buildFleetParsers(argparser: argparse.ArgumentParser, parser: argparse.ArgumentParser) -> None:
+	fleet_parsers = CreateActionGroup(argparser, parser, "fleet")
+
+	current_subparser = fleet_parsers.add_parser("serve-up", help="Runs serve-up for many server directories at once, fetching each distinct file only once.")
+	current_subparser.add_argument("roots", nargs="*", help="The server directories to serve up. Each uses its current profile, or --profile if it's given.")
+	current_subparser.add_argument("--manifest", "-m", help="A JSON file listing the servers to serve up, as {\"servers\": [{\"root\": ..., \"profile\": ..., \"frozen\": ...}]}")
+	current_subparser.add_argument("--jobs", "-j", help="The number of files to install at once across the whole fleet. Defaults to the smallest settings.downloads.jobs of the servers", type=int)
+	current_subparser.add_argument("--frozen", help="Installs exactly what each server's " + TABLECLOTH_LOCK_PATH + " describes", action='store_true')
+	current_subparser.set_defaults(func = CallbackFromClass(FleetActions.ServeUp), uses_config = False)
+
+RegisterCommand("fleet", "Works with many server directories at once", _buildFleetParsers)
+
+# ==============================================================================
+# END FLEET ACTIONS
+# ==============================================================================
+
+# ==============================================================================
+# LOCK ACTIONS
+# ==============================================================================
+class LockActions:
+	# Shows what changes between two locks, and what would be downloaded to go
+	# from one to the other.
+	class Diff(TableclothActionBase):
+		def Perform(self) -> None:
+			try:
+				older = TableclothLock.Load(self._argv.oldLock)
+				newer = TableclothLock.Load(self._argv.newLock)
+			except (OSError, ValueError) as e:
+				print("Can't compare the locks: {}".format(e))
+				exit(1)
+
+			diff = older.Diff(newer)
+			oldMods = older.Mods()
+			newMods = newer.Mods()
+			if diff["server-changed"]:
+				print("~ server jar: {} -> {}".format(older.Server()["filename"], newer.Server()["filename"]))
+			for mod in diff["added"]:
+				print("+ {} {}".format(mod, newMods[mod]["version"]))
+			for mod in diff["removed"]:
+				print("- {} {}".format(mod, oldMods[mod]["version"]))
+			for mod in diff["changed"]:
+				print("~ {} {} -> {}".format(mod, oldMods[mod]["version"], newMods[mod]["version"]))
+
+			downloads = diff["downloads"]
+			size = sum(file.get("size") or 0 for file in downloads)
+			print("Going from {} to {} downloads {} files ({}).".format(self._argv.oldLock, self._argv.newLock, len(downloads), FormatSize(size)))
+			for file in downloads:
+				print("  - {} ({})".format(file["filename"], FormatSize(file.get("size") or 0)))
+
+def _buildLockParsers(argparser: argparse.ArgumentParser, parser: argparse.ArgumentParser) -> None:
+	lock_parsers = CreateActionGroup(argparser, parser, "lock")
+
+	current_subparser = lock_parsers.add_parser("diff", help="Shows what changes between two lock files and which files would be downloaded.")
+	current_subparser.add_argument("oldLock", help="The lock file to compare from.")
+	current_subparser.add_argument("newLock", nargs="?", default=TABLECLOTH_LOCK_PATH, help="The lock file to compare to. Defaults to " + TABLECLOTH_LOCK_PATH)
+	current_subparser.set_defaults(func = CallbackFromClass(LockActions.Diff), uses_config = False)
+
+RegisterCommand("lock", "Works with " + TABLECLOTH_LOCK_PATH + " files", _buildLockParsers)
+
+# ==============================================================================
+# END LOCK ACTIONS
+# ==============================================================================
+
+# ==============================================================================
+# BUNDLE ACTIONS
+# ==============================================================================
+# Hashes a file as it's read, so it can be checked while it's copied somewhere
+# else.
+class _HashingReader:
+	def __init__(self, file, algorithms: list):
+		import hashlib
+		self.__file = file
+		self.__digests = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+		self.__size = 0
+
+	def read(self, size: int = -1) -> bytes:
+		data = self.__file.read(size)
+		for digest in self.__digests.values():
+			digest.update(data)
+		self.__size += len(data)
+		return data
+
+	def Size(self) -> int:
+		return self.__size
+
+	def Hashes(self) -> dict:
+		return {algorithm: digest.hexdigest() for algorithm, digest in self.__digests.items()}
+
+# A bundle is a tar of everything a profile needs to run: the server jar and
+# mod jars at the paths they're installed to, after a bundle.json that holds
+# the profile, its lock and the size and hashes of every file. It can be
+# deployed without the network.
+class BundleActions:
+	BUNDLE_VERSION = 1
+	BUNDLE_INDEX = "bundle.json"
+
+	# Finds whether the bundle may put a file at path: the server jar in the
+	# server directory, a jar in mods/, or one of the Fabric launcher's files
+	# under libraries/ or .fabric/. Anything else (absolute paths, .., or hidden
+	# files) could write outside of where it belongs.
+	def IsSafePath(path: str) -> bool:
+		parts = path.split("/")
+		if parts[0] == ".fabric" and len(parts) > 2:
+			parts = parts[1:]
+		elif parts[0] == FABRIC_LIBRARIES_DIR and len(parts) > 2:
+			pass
+		elif not (len(parts) == 1 or (len(parts) == 2 and parts[0] == "mods")):
+			return False
+		return all(part not in ["", ".", ".."] and not part.startswith(".") and not "\\" in part for part in parts)
+
+	# The jars Fabric remaps the vanilla server jar into on its first launch,
+	# keyed by their path. They're only found on a host where the server has
+	# started, but bundling them spares the target server doing it again.
+	def RemappedJars(gameVersion: str, loaderVersion: str) -> dict:
+		directory = ".fabric/remappedJars/minecraft-{}-{}".format(gameVersion, loaderVersion)
+		jars = {}
+		for root, _, filenames in os.walk(directory):
+			for filename in filenames:
+				path = os.path.join(root, filename).replace(os.sep, "/")
+				if BundleActions.IsSafePath(path):
+					jars[path] = {"filename": filename, "url": None, "hashes": _hashFileAll(path, ArtifactCache.HASH_ALGORITHMS)}
+		return jars
+
+	# Packs the profile into a bundle. Files come from wherever they're already
+	# on this host (the server directory, the profile's materialized directory
+	# or the artifact cache) and are only downloaded if they aren't anywhere.
+	class Export(ProfileRequiredActionBase):
+		# Lists where each file can be found, keyed by its path in the bundle.
+		# Returns those found and those that aren't on this host.
+		# The Fabric launcher's files are shared by every profile, so they're only
+		# looked for in the server directory.
+		def __locate(self, profile: TableclothProfile, files: dict, serverFiles: dict) -> tuple:
+			rootInstall = (".", InstallManifest.FromConfig(self._config))
+			materialized = MaterializedProfile(self._config, profile).Directory()
+			installs = [(materialized, InstallManifest.FromConfig(self._config, "installed.json", materialized))]
+			if self._config.GetCurrentProfileName() == profile.Name():
+				installs.insert(0, rootInstall)
+			cache = ArtifactCache.FromConfig(self._config)
+
+			found = {}
+			missing = {}
+			for path, file in files.items():
+				for root, manifest in [rootInstall] if path in serverFiles else installs:
+					if manifest.IsCurrent(path, file):
+						found[path] = os.path.join(root, path)
+						if not file.get("hashes"):
+							file["hashes"] = manifest.GetHashes(path) or {}
+						break
+				else:
+					cached = cache.Path(file.get("hashes", {})) if cache is not None else None
+					if cached is not None:
+						found[path] = cached
+					else:
+						missing[path] = file
+			return found, missing
+
+		def __download(self, missing: dict, staging: str) -> dict:
+			import concurrent.futures
+			jobs = max(1, self._argv.jobs or self._config.GetDownloadJobs())
+			found = {}
+			failed = []
+
+			def download(path, file):
+				destination = os.path.join(staging, path)
+				os.makedirs(os.path.dirname(destination), exist_ok=True)
+				downloaded = DownloadFile(file["url"], destination, file.get("hashes") or None, file.get("size"))
+				if not file.get("hashes"):
+					file["hashes"] = downloaded["hashes"]
+				print("Downloaded " + path)
+				return destination
+
+			with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+				futures = {path: executor.submit(download, path, file) for path, file in missing.items()}
+				for path, future in futures.items():
+					try:
+						found[path] = future.result()
+					except (_requests().RequestException, OfflineError, DownloadError, OSError) as e:
+						failed.append("{} ({})".format(path, e))
+			if failed:
+				print("Couldn't get everything for the bundle:")
+				for failure in failed:
+					print("  - " + failure)
+				exit(1)
+			return found
+
+		# Looks up the files the Fabric launcher needs to start, keyed by their
+		# path, since a server without the network can't fetch them on its first
+		# launch. If they can't be looked up, those in the lock are used, as long
+		# as it was written for the same profile and versions.
+		def __serverFiles(self, profile: TableclothProfile) -> dict:
+			jobs = max(1, self._argv.jobs or self._config.GetDownloadJobs())
+			try:
+				files = GetFabricServerFiles(profile.GetMinecraftVersion(), profile.GetFabricLoaderVersion(), jobs, InstallManifest.FromConfig(self._config))
+			except (_requests().RequestException, OfflineError, DownloadError, KeyError, ValueError) as e:
+				try:
+					lock = TableclothLock.Load().ToDict()
+				except (OSError, ValueError):
+					lock = {}
+				if not lock.get("server-files") or lock.get("profile") != profile.Name() or lock.get("minecraft") != profile.GetMinecraftVersion() \
+					or lock.get("fabric", {}).get("loader") != profile.GetFabricLoaderVersion():
+					print("Couldn't find the files the server needs to start, so they can't be bundled: {}".format(e))
+					exit(1)
+				print("Couldn't look up the files the server needs to start, so those in {} are bundled: {}".format(TABLECLOTH_LOCK_PATH, e))
+				files = lock["server-files"]
+			return {file["path"]: dict(file) for file in files}
+
+		def Perform(self) -> None:
+			import io
+			import tarfile
+			import tempfile
+			profile = self.GetProfile()
+			server = GetServerJarSource(self._config, profile)
+			files = {server["filename"]: dict(server)}
+			for modFiles in ModrinthHostService().GetModFiles(profile).values():
+				for file in modFiles:
+					files["mods/" + file["filename"]] = dict(file)
+			serverFiles = self.__serverFiles(profile)
+			files.update(serverFiles)
+
+			found, missing = self.__locate(profile, files, serverFiles)
+			os.makedirs(TABLECLOTH_STATE_DIR, exist_ok=True)
+			with tempfile.TemporaryDirectory(prefix="bundle.", dir=TABLECLOTH_STATE_DIR) as staging:
+				if missing:
+					print("Downloading {} files that aren't on this host...".format(len(missing)))
+					found.update(self.__download(missing, staging))
+
+				# The server jar's hashes aren't known until it's been installed or
+				# downloaded somewhere.
+				serverFile = files[server["filename"]]
+				if not serverFile.get("hashes"):
+					serverFile["hashes"] = _hashFileAll(found[server["filename"]], ArtifactCache.HASH_ALGORITHMS)
+				for path, file in files.items():
+					file["size"] = os.path.getsize(found[path])
+
+				lock = TableclothLock.FromProfile(profile, {
+					"filename": server["filename"],
+					"url": server["url"],
+					"size": serverFile["size"],
+					"hashes": serverFile["hashes"],
+				}, [{key: file[key] for key in ["path", "filename", "url", "size", "hashes"]} for file in serverFiles.values()])
+				for path, file in BundleActions.RemappedJars(profile.GetMinecraftVersion(), profile.GetFabricLoaderVersion()).items():
+					files[path] = file
+					found[path] = path
+					file["size"] = os.path.getsize(path)
+				index = json.dumps({
+					"bundle-version": BundleActions.BUNDLE_VERSION,
+					"tablecloth-version": TABLECLOTH_VERSION,
+					"created": time.time(),
+					"profile": profile.Name(),
+					"config": profile.ToDict(),
+					"lock": lock.ToDict(),
+					"files": {path: {"size": file["size"], "hashes": file["hashes"], "url": file.get("url")} for path, file in files.items()},
+				}, indent=1).encode()
+
+				# Jars are already compressed, so compressing the bundle mostly costs
+				# time; it's only done when asked for.
+				bundlePath = self._argv.bundle
+				tempPath = _tempPath(bundlePath)
+				try:
+					with tarfile.open(tempPath, "w:gz" if self._argv.gzip else "w") as bundle:
+						info = tarfile.TarInfo(BundleActions.BUNDLE_INDEX)
+						info.size = len(index)
+						info.mtime = int(time.time())
+						bundle.addfile(info, io.BytesIO(index))
+						for path, file in files.items():
+							info = tarfile.TarInfo(path)
+							info.size = file["size"]
+							info.mtime = int(time.time())
+							# Files are checked as they go in, in case one changed or a cached
+							# copy went bad since it was found.
+							with open(found[path], 'rb') as source:
+								reader = _HashingReader(source, list(file["hashes"]))
+								bundle.addfile(info, reader)
+							actual = reader.Hashes()
+							if any(actual[algorithm] != digest.lower() for algorithm, digest in file["hashes"].items()):
+								raise IntegrityError("{} doesn't match its hashes".format(found[path]))
+					os.replace(tempPath, bundlePath)
+				except (OSError, IntegrityError) as e:
+					with contextlib.suppress(FileNotFoundError):
+						os.remove(tempPath)
+					print("Couldn't write the bundle: {}".format(e))
+					exit(1)
+
+			print("Wrote {} ({} files, {}) for profile {}".format(bundlePath, len(files), FormatSize(os.path.getsize(bundlePath)), profile.Name()))
+
+	# Deploys a bundle into the server directory without the network. The tar
+	# is read as a stream, and each file is hashed as it's written and only
+	# renamed into place once it matches. Files that are already installed are
+	# skipped. The bundle's profile is added to the config and made current,
+	# and its lock is written.
+	class Import(TableclothActionBase):
+		def __readIndex(self, bundle) -> dict:
+			member = bundle.next()
+			if member is None or member.name != BundleActions.BUNDLE_INDEX:
+				raise ValueError("it doesn't start with " + BundleActions.BUNDLE_INDEX)
+			index = json.load(bundle.extractfile(member))
+			if index.get("bundle-version") != BundleActions.BUNDLE_VERSION:
+				raise ValueError("it has an unsupported bundle version ({})".format(index.get("bundle-version")))
+			for path in index["files"]:
+				if not BundleActions.IsSafePath(path):
+					raise ValueError("it wants to write to " + path)
+			return index
+
+		# Writes one file from the bundle to path, checking it on the way.
+		def __extract(self, stream, path: str, file: dict) -> dict:
+			tempPath = _tempPath(path)
+			try:
+				reader = _HashingReader(stream, list(set(ArtifactCache.HASH_ALGORITHMS) | set(file["hashes"])))
+				with open(tempPath, 'wb') as destination:
+					for chunk in iter(lambda: reader.read(DOWNLOAD_CHUNK_SIZE), b""):
+						destination.write(chunk)
+					destination.flush()
+					os.fsync(destination.fileno())
+				actual = reader.Hashes()
+				if reader.Size() != file["size"]:
+					raise IntegrityError("expected {} bytes but got {}".format(file["size"], reader.Size()))
+				for algorithm, digest in file["hashes"].items():
+					if actual[algorithm] != digest.lower():
+						raise IntegrityError("the {} hash doesn't match".format(algorithm))
+				os.replace(tempPath, path)
+			except BaseException:
+				with contextlib.suppress(FileNotFoundError):
+					os.remove(tempPath)
+				raise
+			return actual
+
+		def Perform(self) -> None:
+			import tarfile
+			start = time.monotonic()
+			try:
+				bundle = tarfile.open(self._argv.bundle, "r|*")
+			except (OSError, tarfile.TarError) as e:
+				print("Can't open {}: {}".format(self._argv.bundle, e))
+				exit(1)
+
+			with bundle:
+				try:
+					index = self.__readIndex(bundle)
+				except (OSError, ValueError, KeyError, tarfile.TarError) as e:
+					print("{} isn't a bundle Tablecloth can use: {}".format(self._argv.bundle, e))
+					exit(1)
+
+				profileName = self._argv.name or index["profile"]
+				# A server directory without a config only has the default config,
+				# which there's no reason to keep.
+				isNew = not os.path.exists(TABLECLOTH_CONFIG_PATH)
+				if profileName in self._config.GetProfileNames() and not (self._argv.force or isNew):
+					print("Profile {} already exists. Use --force to replace it, or --name to import it under another name.".format(profileName))
+					exit(1)
+
+				manifest = InstallManifest.FromConfig(self._config)
+				cache = ArtifactCache.FromConfig(self._config)
+				os.makedirs("mods", exist_ok=True)
+				statuses = collections.Counter()
+				failed = []
+				seen = set()
+				extracted = 0
+				try:
+					for member in bundle:
+						if member.name == BundleActions.BUNDLE_INDEX:
+							continue
+						file = index["files"].get(member.name)
+						if file is None or not member.isfile() or member.name in seen:
+							print("Skipping {}, which the bundle doesn't list".format(member.name))
+							continue
+						seen.add(member.name)
+						if manifest.IsCurrent(member.name, file):
+							statuses["current"] += 1
+							continue
+						try:
+							os.makedirs(os.path.dirname(member.name) or ".", exist_ok=True)
+							actual = self.__extract(bundle.extractfile(member), member.name, file)
+						except (OSError, IntegrityError) as e:
+							failed.append("{} ({})".format(member.name, e))
+							continue
+						manifest.Record(member.name, file)
+						statuses["installed"] += 1
+						extracted += file["size"]
+						if cache is not None:
+							with contextlib.suppress(OSError):
+								cache.Store(member.name, file["hashes"], actual)
+				except (OSError, tarfile.TarError) as e:
+					failed.append("the bundle ends early ({})".format(e))
+			failed += ["{} (not in the bundle)".format(path) for path in index["files"] if not path in seen]
+			# The files that were installed are recorded either way, but mods/
+			# only becomes the imported profile's once all of it is there.
+			if not failed:
+				manifest.Reference(profileName, TableclothLock(index["lock"]).ModFiles())
+			manifest.Save()
+
+			print("Installed {} files ({}) from {} in {:.1f}s; {} were already installed.".format(
+				statuses["installed"], FormatSize(extracted), self._argv.bundle, time.monotonic() - start, statuses["current"]))
+			if failed:
+				print("Failed:")
+				for failure in failed:
+					print("  - " + failure)
+				print("The profile wasn't imported.")
+				exit(1)
+
+			self._config.ImportProfile(profileName, index["config"])
+			self._config.SetCurrentProfileName(profileName)
+			lock = index["lock"]
+			lock["profile"] = profileName
+			TableclothLock(lock).Save()
+			print("Imported profile {} and made it current. Wrote {}".format(profileName, TABLECLOTH_LOCK_PATH))
+
+def _buildBundleParsers(argparser: argparse.ArgumentParser, parser: argparse.ArgumentParser) -> None:
+	bundle_parsers = CreateActionGroup(argparser, parser, "bundle")
+
+	current_subparser = bundle_parsers.add_parser("export", help="Packs the profile's server jar, mods, and their metadata and hashes into one file that can be deployed without the network.")
+	current_subparser.add_argument("bundle", help="The file to write the bundle to.")
+	current_subparser.add_argument("--gzip", help="Compresses the bundle. Jars are already compressed, so this saves little.", action='store_true')
+	current_subparser.add_argument("--jobs", "-j", help="The number of files to download at once, for files that aren't on this host. Defaults to settings.downloads.jobs", type=int)
+	current_subparser.set_defaults(func = CallbackFromClass(BundleActions.Export))
+
+	current_subparser = bundle_parsers.add_parser("import", help="Deploys a bundle made by bundle export into this server directory, without the network.")
+	current_subparser.add_argument("bundle", help="The bundle to deploy.")
+	current_subparser.add_argument("--name", help="The name to give the imported profile. Defaults to the name it was exported with.")
+	current_subparser.add_argument("--force", help="Replaces a profile with the same name.", action='store_true')
+	current_subparser.set_defaults(func = CallbackFromClass(BundleActions.Import))
+
+RegisterCommand("bundle", "Packs a profile into one file, or deploys one, for servers without the network", _buildBundleParsers)
+
+# ==============================================================================
+# END BUNDLE ACTIONS
+# ==============================================================================
+
+# Checks the installed files against the hashes and sizes they should have.
+class VerifyAction(ProfileRequiredActionBase):
+	# Checks one file. Returns a description of what's wrong with it, or None.
+	def __verify(self, path: str, file: dict):
+		try:
+			size = os.path.getsize(path)
+		except FileNotFoundError:
+			return "missing"
+		if file.get("size") is not None and size != file["size"]:
+			return "expected {} bytes but found {}".format(file["size"], size)
+
+		hashes = file.get("hashes", {})
+		for algorithm in ArtifactCache.HASH_ALGORITHMS:
+			if hashes.get(algorithm):
+				if _hashFile(path, algorithm) != hashes[algorithm].lower():
+					return "the {} hash doesn't match".format(algorithm)
+				return None
+		return "there's no hash to check it against"
+
+	def Perform(self) -> None:
+		import concurrent.futures
+		if self._argv.lock:
+			try:
+				lock = TableclothLock.Load()
+			except (OSError, ValueError) as e:
+				print("Can't verify against {}: {}".format(TABLECLOTH_LOCK_PATH, e))
+				exit(1)
+			modFiles = lock.ModFiles()
+			expected = {lock.Server()["filename"]: lock.Server()}
 		else:
-			downloadName = jarName
+			modFiles = ModrinthHostService().GetModFiles(self.GetProfile())
+			expected = {}
+		for files in modFiles.values():
+			for file in files:
+				expected["mods/" + file["filename"]] = file
+
+		jobs = max(1, self._argv.jobs or self._config.GetDownloadJobs())
+		start = time.monotonic()
+		# Hashing releases the GIL, so threads are enough to use every core.
+		with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+			problems = dict(zip(expected.keys(), executor.map(lambda path: self.__verify(path, expected[path]), expected.keys())))
+		problems = {path: problem for path, problem in problems.items() if problem is not None}
+
+		unexpected = []
+		if os.path.isdir("mods"):
+			with os.scandir("mods") as scan:
+				unexpected = sorted(
+					"mods/" + entry.name for entry in scan
+					if entry.is_file() and entry.name.endswith(".jar") and not "mods/" + entry.name in expected
+				)
+
+		for path in sorted(problems):
+			print("MISMATCH {}: {}".format(path, problems[path]))
+		for path in unexpected:
+			print("UNEXPECTED {}: no enabled mod uses this file".format(path))
+		print("Checked {} files in {:.2f}s: {} problems, {} unexpected files.".format(len(expected), time.monotonic() - start, len(problems), len(unexpected)))
+		if problems:
+			exit(1)
 
-		serverJar = requests.get(fabricInstallerUrl).content
-		open(downloadName, 'wb').write(serverJar)
+def _buildVerifyParser(argparser: argparse.ArgumentParser, current_subparser: argparse.ArgumentParser) -> None:
+	current_subparser.add_argument("--jobs", "-j", help="The number of files to check at once. Defaults to settings.downloads.jobs", type=int)
+	current_subparser.add_argument("--lock", help="Checks the files (and the server jar) against " + TABLECLOTH_LOCK_PATH + " instead of the profile", action='store_true')
+	current_subparser.set_defaults(func = CallbackFromClass(VerifyAction))
 
-		print("Server jar created. You may need to change its permissions.")
-		if not os.path.exists("mods"):
-			os.mkdir("mods")
+RegisterCommand("verify", "Checks the installed mod files against the hashes and sizes they should have", _buildVerifyParser)
 
-		print("Installing mods...")
-		modrinthService = ModrinthHostService()
-		modrinthService.DownloadMods(profile)
-		print("Done!")
+# Reports mods that have a newer version for their profile's Minecraft
+# version. Profiles tend to share most of their mods, so every mod is grouped
+# by what would be looked up for it and each lookup is only done once.
+class UpdateCheckAction(TableclothActionBase):
+	def Perform(self) -> None:
+		profileNames = [self._argv.profile] if self._argv.profile else list(self._config.GetProfileNames())
+		# (project ID, game version, loader) -> [(profile name, mod name)]
+		queries = {}
+		for profileName in profileNames:
+			profile = self._config.GetProfile(profileName)
+			for modName, settings in profile.Mods().items():
+				if not settings["enabled"] or not settings.get("modrinth"):
+					continue
+				query = (settings["modrinth"]["project-id"], profile.GetMinecraftVersion(), "fabric")
+				queries.setdefault(query, []).append((profileName, modName))
 
-current_subparser = subparsers.add_parser("serve-up", help="Downloads the mods according to the desired profile")
-current_subparser.set_defaults(func = CallbackFromClass(ServeUpAction))
+		jobs = max(1, self._argv.jobs or self._config.GetDownloadJobs())
+		newest = ModrinthHostService().GetNewestVersions(list(queries), jobs)
+
+		updates = {}
+		for query, uses in queries.items():
+			latest = newest[query]
+			if latest is None:
+				continue
+			for profileName, modName in uses:
+				settings = self._config.GetProfile(profileName).Mods()[modName]
+				current = settings["modrinth"]
+				if latest["version-id"] == current["version-id"]:
+					continue
+				# Modrinth lists versions newest first, but an older version can still
+				# be the newest one for a game version, so don't "update" backwards.
+				if current.get("publish_date") and latest["publish_date"] <= current["publish_date"]:
+					continue
+				updates.setdefault(profileName, []).append((modName, current.get("version-number") or settings["version"], latest))
+
+		modCount = sum(len(uses) for uses in queries.values())
+		print("Checked {} mods in {} profiles with {} lookups.".format(modCount, len(profileNames), len(queries)))
+		if not updates:
+			print("Everything is up to date.")
+			return
+
+		for profileName in sorted(updates):
+			print("{}:".format(profileName))
+			for modName, current, latest in sorted(updates[profileName], key = lambda update: update[0]):
+				print("  - {} {} -> {}".format(modName, current, latest["version-number"]))
+				if self._argv.apply:
+					self._config.GetProfile(profileName).ApplyUpdate(modName, latest)
+
+		if self._argv.apply:
+			self._config.MarkDirty()
+			print("Applied {} updates. Run `mod deps` in case the new versions need other mods, then `serve-up`.".format(sum(len(mods) for mods in updates.values())))
+
+def _buildUpdateCheckParser(argparser: argparse.ArgumentParser, current_subparser: argparse.ArgumentParser) -> None:
+	current_subparser.add_argument("--apply", help="Moves each mod to its newest version", action='store_true')
+	current_subparser.add_argument("--jobs", "-j", help="The number of lookups to make at once. Defaults to settings.downloads.jobs", type=int)
+	current_subparser.set_defaults(func = CallbackFromClass(UpdateCheckAction))
+
+RegisterCommand("update-check", "Reports mods with newer versions for every profile, or just --profile", _buildUpdateCheckParser)
 
 class SetVersionAction(ProfileRequiredActionBase):
 	def Perform(self) -> None:
@@ -746,6 +4749,7 @@ class SetVersionAction(ProfileRequiredActionBase):
 			# incompatible.
 			profile.SetMinecraftVersion(self._argv.minecraft)
 			self._config.MarkDirty()
+			print("Run `mod refresh` to look up the mods for Minecraft {}.".format(self._argv.minecraft))
 		
 		if self._argv.fabric_installer:
 			profile.SetFabricInstallerVersion(self._argv.fabric_installer)
@@ -755,28 +4759,48 @@ class SetVersionAction(ProfileRequiredActionBase):
 			profile.SetFabricLoaderVersion(self._argv.fabric_loader)
 			self._config.MarkDirty()
 
-current_subparser = subparsers.add_parser("set-version", help="Allows you to set the versions of Minecraft and the Fabric Installer/Loader")
-current_subparser.add_argument("--minecraft", "-m", help="The Minecraft version to use")
-current_subparser.add_argument("--fabric-installer", "-i", help="The Fabric Installer version to use")
-current_subparser.add_argument("--fabric-loader", "-l", help="The Fabric Loader version to use")
-current_subparser.set_defaults(func = CallbackFromClass(SetVersionAction))
+def _buildSetVersionParser(argparser: argparse.ArgumentParser, current_subparser: argparse.ArgumentParser) -> None:
+	current_subparser.add_argument("--minecraft", "-m", help="The Minecraft version to use")
+	current_subparser.add_argument("--fabric-installer", "-i", help="The Fabric Installer version to use")
+	current_subparser.add_argument("--fabric-loader", "-l", help="The Fabric Loader version to use")
+	current_subparser.set_defaults(func = CallbackFromClass(SetVersionAction))
+
+RegisterCommand("set-version", "Allows you to set the versions of Minecraft and the Fabric Installer/Loader", _buildSetVersionParser)
 
 # ================================main function=================================
 def main():
+	argparser = BuildArgparser(sys.argv[1:])
 	if (len(sys.argv) == 1):
 		argparser.parse_args(['-h'])
 		return
 
 	config = TableclothConfig()
 	args = argparser.parse_args()
+	# Commands that work with other server directories, or only with the files
+	# they're given, don't use the config here, so one isn't created for them.
+	usesConfig = getattr(args, "uses_config", True)
+	HttpClient.Configure(MetadataCache.FromConfig(config) if usesConfig else None, args.offline)
+	if args.timings or args.trace:
+		Trace.Start(sys.argv[1:])
 	try:
 		args.func(args, config)
 	except EOFError:
 		print("Operation aborted (user input)")
+	finally:
+		# Written even when the command exits early, since a failed run is
+		# often the one worth looking at.
+		trace = Trace.Current()
+		if trace is not None and args.timings:
+			trace.PrintSummary()
+		if trace is not None and args.trace:
+			try:
+				trace.Save(args.trace)
+			except OSError as e:
+				print("Couldn't write the trace to {}: {}".format(args.trace, e))
 
 	if args.showResult or args.dry_run:
 		print(json.dumps(config.ToDict(), indent=2))
-	if not args.dry_run and config.IsDirty():
+	if not args.dry_run and usesConfig and config.IsDirty():
 		config.Save()
 
 if __name__ == "__main__":
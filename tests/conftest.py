@@ -0,0 +1,99 @@
+# Shared fixtures: a stand-in for Modrinth, Fabric meta and Mojang (see
+# benchmarks/standin.py), and server directories to run Tablecloth in against
+# it.
+
+import contextlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLECLOTH = os.path.join(ROOT, "tablecloth.py")
+STANDIN = os.path.join(ROOT, "benchmarks", "standin.py")
+
+sys.path.insert(0, ROOT)
+
+GAME_VERSION = "1.20.1"
+MOD_VERSION = "1.0.2"
+
+# Runs a stand-in with the given flags and yields its address.
+@contextlib.contextmanager
+def StandIn(*args):
+	process = subprocess.Popen([sys.executable, STANDIN, "--port", "0"] + list(args), stdout=subprocess.PIPE, text=True)
+	try:
+		line = process.stdout.readline()
+		if not line.startswith("Listening on "):
+			raise RuntimeError("The stand-in server didn't start")
+		yield line.split()[-1]
+	finally:
+		process.terminate()
+		process.wait()
+
+def Profile(mods: list, modVersion: str = MOD_VERSION) -> dict:
+	return {
+		"minecraft": {"version": GAME_VERSION},
+		"fabric": {"loader": "0.14.21", "installer": "0.11.2"},
+		"mods": {mod: {"version": modVersion, "enabled": True, "modrinth": None} for mod in mods},
+		"overrides": {"jar-name": None, "java-path": None, "java-args": []},
+	}
+
+# A server directory, with its own config and artifact cache, and Tablecloth
+# pointed at a stand-in.
+class Server:
+	def __init__(self, directory: str, base: str, cacheRoot: str):
+		self.directory = directory
+		self.cacheRoot = cacheRoot
+		self.env = dict(os.environ,
+			TABLECLOTH_MODRINTH_API=base + "/v2/",
+			TABLECLOTH_FABRIC_META=base + "/",
+			TABLECLOTH_MOJANG_META=base + "/")
+
+	def Path(self, *parts) -> str:
+		return os.path.join(self.directory, *parts)
+
+	def WriteConfig(self, profiles: dict, current: str = None) -> None:
+		config = {
+			"profiles": profiles,
+			"settings": {
+				"assume-current-profile": True,
+				"current-profile": current or next(iter(profiles)),
+				"launch": {"jar-name": "server.jar", "java-path": None, "min-ram": "1G", "max-ram": "2G", "java-args": []},
+				"validation": {"hashes": True, "size": True},
+				"cache": {"enabled": True, "path": self.cacheRoot, "max-size": "1G", "metadata-ttl": 600},
+			},
+		}
+		with open(self.Path("tablecloth.json"), "w") as configFile:
+			json.dump(config, configFile)
+
+	def Config(self) -> dict:
+		with open(self.Path("tablecloth.json"), "r") as configFile:
+			return json.load(configFile)
+
+	def Manifest(self, directory: str = ".", path: str = os.path.join(".tablecloth", "installed.json")) -> dict:
+		with open(self.Path(directory, path), "r") as manifestFile:
+			return json.load(manifestFile)["files"]
+
+	def Mods(self, directory: str = ".") -> list:
+		return sorted(os.listdir(self.Path(directory, "mods")))
+
+	# Runs Tablecloth in the directory. Fails the test if the exit code isn't
+	# the one expected.
+	def Run(self, *argv, returncode: int = 0, cwd: str = None) -> str:
+		result = subprocess.run([sys.executable, TABLECLOTH] + list(argv), cwd=cwd or self.directory, env=self.env,
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, input="")
+		assert result.returncode == returncode, "{} exited with {}:\n{}".format(" ".join(argv), result.returncode, result.stdout)
+		return result.stdout
+
+@pytest.fixture(scope="session")
+def standin():
+	with StandIn("--versions", "3", "--jar-size", "40K", "--server-jar-size", "64K", "--library-size", "32K", "--libraries", "4") as base:
+		yield base
+
+@pytest.fixture
+def server(tmp_path, standin) -> Server:
+	directory = tmp_path / "server"
+	directory.mkdir()
+	return Server(str(directory), standin, str(tmp_path / "cache"))
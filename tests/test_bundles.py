@@ -0,0 +1,40 @@
+# Deploying a profile from a bundle on a server without the network.
+
+import json
+import os
+
+from conftest import Profile, Server
+
+REMAPPED = os.path.join(".fabric", "remappedJars", "minecraft-1.20.1-0.14.21", "server-intermediary.jar")
+
+def test_bundle_has_everything_the_server_needs(server, tmp_path):
+	server.WriteConfig({"live": Profile(["mod-1", "mod-2"])})
+	server.Run("mod", "refresh")
+	server.Run("serve-up")
+	# As if the server had started and remapped the vanilla jar.
+	os.makedirs(os.path.dirname(server.Path(REMAPPED)))
+	with open(server.Path(REMAPPED), "wb") as remappedFile:
+		remappedFile.write(b"remapped" * 1024)
+	bundle = str(tmp_path / "live.tar")
+	server.Run("bundle", "export", bundle)
+
+	# Nothing answers here, so anything that needs the network fails.
+	target = Server(str(tmp_path / "target"), "http://127.0.0.1:1", str(tmp_path / "target-cache"))
+	os.mkdir(target.directory)
+	target.Run("bundle", "import", bundle)
+
+	with open(target.Path("tablecloth.lock.json"), "r") as lockFile:
+		serverFiles = json.load(lockFile)["server-files"]
+	# The loader, 4 libraries and the vanilla jar.
+	assert len(serverFiles) == 6
+	for file in serverFiles:
+		assert os.path.isfile(target.Path(file["path"]))
+		assert file["hashes"]
+	assert any(file["path"].startswith("libraries/") for file in serverFiles)
+	assert os.path.isfile(target.Path(".fabric", "server", "1.20.1-server.jar"))
+	with open(target.Path(REMAPPED), "rb") as remappedFile:
+		assert remappedFile.read() == b"remapped" * 1024
+
+	output = target.Run("--offline", "serve-up", "--frozen")
+	assert "6 files the server needs to start: 0 downloaded, 0 from the cache, 6 already there" in output
+	assert "0 problems" in target.Run("verify", "--lock")
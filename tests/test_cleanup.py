@@ -0,0 +1,74 @@
+# Which mods use each installed file, and removing the files none do.
+
+import os
+
+from conftest import Profile, Server
+
+def UsedBy(server, filename: str) -> dict:
+	return server.Manifest()["mods/" + filename].get("used-by")
+
+def Jar(mod: str) -> str:
+	return "{}-1.0.2.jar".format(mod)
+
+def test_cleanup_removes_disabled_mods(server):
+	server.WriteConfig({"live": Profile(["mod-1", "mod-2"])})
+	server.Run("mod", "refresh")
+	server.Run("serve-up")
+	assert UsedBy(server, Jar("mod-2")) == {"live": ["mod-2"]}
+
+	config = server.Config()
+	config["profiles"]["live"]["mods"]["mod-2"]["enabled"] = False
+	server.WriteConfig(config["profiles"])
+	server.Run("serve-up")
+	open(server.Path("mods", "by-hand.jar"), "w").close()
+	output = server.Run("cleanup")
+
+	assert server.Mods() == ["by-hand.jar", Jar("mod-1")]
+	assert "by-hand.jar" in output
+
+def test_mod_remove_and_set_version_prune(server):
+	server.WriteConfig({"live": Profile(["mod-1", "mod-2"])})
+	server.Run("mod", "refresh")
+	server.Run("serve-up")
+
+	server.Run("mod", "remove", "mod-1")
+	server.Run("mod", "set-version", "mod-2", "1.0.0")
+	assert server.Mods() == []
+	server.Run("serve-up")
+	assert server.Mods() == ["mod-2-1.0.0.jar"]
+
+# A bundle that breaks off partway isn't imported, so the profile that's
+# installed keeps its files.
+def test_broken_bundle_import_keeps_references(server, tmp_path, standin):
+	other = Server(str(tmp_path / "other"), standin, server.cacheRoot)
+	os.mkdir(other.directory)
+	other.WriteConfig({"imported": Profile(["mod-8", "mod-10"])})
+	other.Run("mod", "refresh")
+	other.Run("serve-up")
+	bundle = str(tmp_path / "imported.tar")
+	other.Run("bundle", "export", bundle)
+	with open(bundle, "r+b") as bundleFile:
+		bundleFile.truncate(os.path.getsize(bundle) * 2 // 3)
+
+	server.WriteConfig({"live": Profile(["mod-8", "mod-9"])})
+	server.Run("mod", "refresh")
+	server.Run("serve-up")
+	server.Run("bundle", "import", bundle, returncode=1)
+	assert UsedBy(server, Jar("mod-8")) == {"live": ["mod-8"]}
+	assert UsedBy(server, Jar("mod-9")) == {"live": ["mod-9"]}
+
+	server.Run("cleanup")
+	assert Jar("mod-8") in server.Mods()
+	assert Jar("mod-9") in server.Mods()
+	assert server.Config()["settings"]["current-profile"] == "live"
+
+def test_frozen_serve_up_refuses_another_profiles_lock(server):
+	server.WriteConfig({"live": Profile(["mod-1"]), "other": Profile(["mod-2"])})
+	server.Run("mod", "refresh")
+	server.Run("--profile", "other", "mod", "refresh")
+	server.Run("serve-up")
+
+	server.Run("--profile", "other", "serve-up", "--frozen", returncode=1)
+	assert UsedBy(server, Jar("mod-1")) == {"live": ["mod-1"]}
+	server.Run("cleanup")
+	assert server.Mods() == [Jar("mod-1")]
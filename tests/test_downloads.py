@@ -0,0 +1,59 @@
+# Downloads against a stand-in that breaks off transfers partway.
+
+import hashlib
+import json
+import urllib.request
+
+import pytest
+
+import tablecloth
+from conftest import StandIn
+
+def JarFile(base: str, slug: str) -> dict:
+	with urllib.request.urlopen("{}/v2/project/{}/version".format(base, slug)) as response:
+		return json.load(response)[0]["files"][0]
+
+def Stats(base: str) -> dict:
+	with urllib.request.urlopen(base + "/stats") as response:
+		return json.load(response)
+
+@pytest.fixture
+def dropping():
+	tablecloth.HttpClient.Configure()
+	# Every transfer breaks off halfway. 40K is less than a download chunk.
+	with StandIn("--drop-rate", "1", "--jar-size", "40K") as base:
+		yield base
+
+# The first 32K arrive before the connection drops, in the middle of the
+# first 64K chunk. They have to be kept for the next attempt.
+def test_bytes_from_a_broken_chunk_are_kept(dropping, tmp_path):
+	file = JarFile(dropping, "kept")
+	destination = str(tmp_path / file["filename"])
+	with pytest.raises(tablecloth._requests().exceptions.ChunkedEncodingError):
+		tablecloth._downloadOnce(file["url"], destination, file["hashes"], file["size"])
+	assert tablecloth._partialSize(destination) == 32 * 1024
+
+def test_dropped_download_resumes(dropping, tmp_path):
+	file = JarFile(dropping, "resumed")
+	destination = str(tmp_path / file["filename"])
+	downloaded = tablecloth.DownloadFile(file["url"], destination, file["hashes"], file["size"])
+
+	with open(destination, "rb") as jar:
+		assert hashlib.sha512(jar.read()).hexdigest() == file["hashes"]["sha512"]
+	assert downloaded["size"] == file["size"]
+	assert tablecloth._partialSize(destination) == 0
+	stats = Stats(dropping)
+	assert stats["dropped"] >= 1
+	assert stats["resumed"] >= 1
+
+def test_serve_up_survives_drops(tmp_path):
+	from conftest import Profile, Server
+	with StandIn("--drop-rate", "0.7", "--seed", "3", "--versions", "3", "--jar-size", "40K", "--server-jar-size", "64K", "--library-size", "24K", "--libraries", "4") as base:
+		server = Server(str(tmp_path), base, str(tmp_path / "cache"))
+		server.WriteConfig({"default": Profile(["mod-{}".format(i) for i in range(10)])})
+		server.Run("mod", "refresh")
+		output = server.Run("serve-up")
+		assert "Done!" in output
+		assert len(server.Mods()) == 10
+		assert "0 problems" in server.Run("verify", "--lock")
+		assert Stats(base)["resumed"] >= 1
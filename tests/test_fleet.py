@@ -0,0 +1,25 @@
+# Serving up many server directories from one command.
+
+import os
+
+from conftest import Profile, Server
+
+def test_fleet_uses_each_servers_settings(server, tmp_path, standin):
+	other = Server(str(tmp_path / "other"), standin, str(tmp_path / "other-cache"))
+	os.mkdir(other.directory)
+	server.WriteConfig({"live": Profile(["mod-1", "mod-2"])})
+	server.Run("mod", "refresh")
+	other.WriteConfig({"live": Profile(["mod-2", "mod-3"])})
+	other.Run("mod", "refresh")
+
+	elsewhere = tmp_path / "elsewhere"
+	elsewhere.mkdir()
+	server.Run("fleet", "serve-up", server.directory, other.directory, cwd=str(elsewhere))
+	server.Run("lock", "diff", server.Path("tablecloth.lock.json"), other.Path("tablecloth.lock.json"), cwd=str(elsewhere))
+	assert os.listdir(str(elsewhere)) == []
+
+	assert server.Mods() == ["mod-1-1.0.2.jar", "mod-2-1.0.2.jar"]
+	assert other.Mods() == ["mod-2-1.0.2.jar", "mod-3-1.0.2.jar"]
+	# Each server's cache has what it uses, and nothing went to a default one.
+	for cacheRoot in [server.cacheRoot, other.cacheRoot]:
+		assert sum(len(filenames) for _, _, filenames in os.walk(os.path.join(cacheRoot, "artifacts"))) == 2
@@ -0,0 +1,41 @@
+# Materialized profiles, and switching between them.
+
+import glob
+import json
+import os
+
+from conftest import Profile
+
+def Downloads(server, *argv) -> int:
+	server.Run("--trace", "trace.json", *argv)
+	with open(server.Path("trace.json"), "r") as traceFile:
+		return json.load(traceFile)["summary"]["downloads"]["files"]
+
+def test_serve_up_installs_into_the_active_profile(server):
+	server.WriteConfig({"a": Profile(["mod-1", "mod-2"]), "b": Profile(["mod-3"])})
+	server.Run("--profile", "a", "mod", "refresh")
+	server.Run("--profile", "b", "mod", "refresh")
+	server.Run("profile", "activate", "a")
+	server.Run("mod", "add", "mod-4", "1.0.2")
+	server.Run("serve-up")
+
+	assert os.path.islink(server.Path("mods"))
+	assert os.path.islink(server.Path("server.jar"))
+	assert "mod-4-1.0.2.jar" in server.Mods(".tablecloth/profiles/a")
+	assert "mods/mod-4-1.0.2.jar" in server.Manifest(".tablecloth/profiles/a", "installed.json")
+
+	server.Run("profile", "activate", "b")
+	assert Downloads(server, "profile", "activate", "a") == 0
+	assert glob.glob(server.Path(".tablecloth", "*.replaced.*")) == []
+	server.Run("cleanup")
+	assert server.Mods() == ["mod-1-1.0.2.jar", "mod-2-1.0.2.jar", "mod-4-1.0.2.jar"]
+
+def test_serve_up_refuses_another_profiles_links(server):
+	server.WriteConfig({"a": Profile(["mod-1"]), "b": Profile(["mod-3"])})
+	server.Run("--profile", "a", "mod", "refresh")
+	server.Run("--profile", "b", "mod", "refresh")
+	server.Run("profile", "activate", "a")
+
+	server.Run("--profile", "b", "serve-up", returncode=1)
+	assert os.path.islink(server.Path("server.jar"))
+	assert server.Mods() == ["mod-1-1.0.2.jar"]
@@ -0,0 +1,43 @@
+# serve-up, and what it leaves for the next run.
+
+import json
+
+from conftest import Profile
+
+def Requests(server, *argv) -> int:
+	server.Run("--trace", "trace.json", *argv)
+	with open(server.Path("trace.json"), "r") as traceFile:
+		hosts = json.load(traceFile)["summary"]["hosts"]
+	return sum(host["requests"] for host in hosts.values())
+
+def test_prefetches_server_files(server):
+	server.WriteConfig({"default": Profile(["mod-1", "mod-2"])})
+	server.Run("mod", "refresh")
+	server.Run("serve-up")
+
+	with open(server.Path("tablecloth.lock.json"), "r") as lockFile:
+		serverFiles = json.load(lockFile)["server-files"]
+	# The loader, 4 libraries and the vanilla jar.
+	assert len(serverFiles) == 6
+	for file in serverFiles:
+		assert file["hashes"]
+		assert server.Manifest()[file["path"]]
+
+# Everything's installed and the metadata cache is fresh, so there's nothing
+# to ask for, not even the .sha1 of libraries Fabric meta gives no hashes for.
+def test_warm_serve_up_makes_no_requests(server):
+	server.WriteConfig({"default": Profile(["mod-1", "mod-2"])})
+	server.Run("mod", "refresh")
+	server.Run("serve-up")
+	assert Requests(server, "serve-up") == 0
+
+def test_offline_serve_up_keeps_server_file_hashes(server):
+	server.WriteConfig({"default": Profile(["mod-1"])})
+	server.Run("mod", "refresh")
+	server.Run("serve-up")
+	server.Run("--offline", "serve-up")
+
+	with open(server.Path("tablecloth.lock.json"), "r") as lockFile:
+		serverFiles = json.load(lockFile)["server-files"]
+	assert len(serverFiles) == 6
+	assert all(file["hashes"] for file in serverFiles)